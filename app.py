@@ -16,7 +16,15 @@ from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 import os
 from dotenv import load_dotenv
-from models.distance_matrix import compute_google_distance_matrix, compute_euclidean_distance_matrix
+from models.distance_matrix import (compute_google_distance_matrix, compute_euclidean_distance_matrix,
+                                    compute_distance_matrix, compute_backend_distance_matrix,
+                                    should_use_memmap, store_distance_matrix_memmap,
+                                    release_memmap_distance_matrix, CondensedDistanceMatrix,
+                                    compute_duration_matrix, is_memmap)
+from models.portfolio import compute_instance_features, select_engine
+from models.polish import polish_solution
+from models.live_plan import LivePlan
+from models.trace import TRACE_DIR
 from auth_middleware import login_required, admin_required, configure_auth_middleware
 from subscription_manager import subscription_required, get_subscription_manager
 from subscription_routes import subscription_bp
@@ -99,6 +107,132 @@ def test_session():
     })
 # Global storage for ongoing solver jobs
 solver_jobs = {}
+ACTIVE_JOB_STATUSES = ('initializing', 'running')
+
+# Finished jobs (and their live-edit data) are dropped this long after they were started
+SOLVER_JOB_TTL_SECONDS = int(os.getenv('SOLVER_JOB_TTL_SECONDS', 6 * 3600))
+def prune_solver_jobs():
+    """Forget finished jobs older than SOLVER_JOB_TTL_SECONDS"""
+    cutoff = time.time() - SOLVER_JOB_TTL_SECONDS
+    for job_id, job in list(solver_jobs.items()):
+        if job.get('status') not in ACTIVE_JOB_STATUSES and job.get('created_at', 0) < cutoff:
+            solver_jobs.pop(job_id, None)
+def release_live_edit_data(job):
+    """Drop the instance data a job keeps for live edits (its solution stays readable)"""
+    job['live_data'] = None
+    job['live_plan'] = None
+def cancel_solver_job(job_id):
+    """Signal a solver job to stop; returns False if it has already finished"""
+    job = solver_jobs.get(job_id)
+    if not job or job.get('status') not in ACTIVE_JOB_STATUSES:
+        return False
+    
+    job['cancel_event'].set()
+    job['message'] = 'Cancelling...'
+    return True
+def get_live_plan(job_id):
+    """Editable copy of a job's solution, built on the first live edit"""
+    job = solver_jobs[job_id]
+    if job.get('live_plan') is None:
+        live_data = job['live_data']
+        job['live_plan'] = LivePlan(
+            distance_matrix=np.asarray(live_data['distance_matrix']),
+            demands=live_data['demands'],
+            depot=live_data['depot'],
+            vehicle_capacity=live_data['vehicle_capacity'],
+            max_vehicles=live_data['max_vehicles'],
+            routes=job['solution']['routes'],
+            coordinates=live_data['coordinates'],
+            company_names=live_data['company_names']
+        )
+        # The plan holds its own (growing) matrix from now on
+        job['live_data'] = None
+    return job['live_plan']
+def apply_live_edit(job_id, edit):
+    """Apply one insert/remove edit to a solved job and publish the updated plan"""
+    job = solver_jobs[job_id]
+    plan = get_live_plan(job_id)
+    
+    if edit['action'] == 'insert':
+        customer = plan.add_node(
+            demand=edit['demand'],
+            coordinate=edit.get('coordinates'),
+            name=edit.get('name'),
+            distances_from=edit.get('distances_from'),
+            distances_to=edit.get('distances_to')
+        )
+        result = plan.insert_customer(customer)
+    else:
+        result = plan.remove_customer(edit['customer'])
+    
+    job['solution'] = {
+        **job['solution'],
+        'routes': plan.best_solution,
+        'details': plan.get_solution_details(plan.company_names),
+        'cost': plan.best_cost,
+        'coordinates': plan.coordinates,
+        'live_edits': plan.edits
+    }
+    return result
+def apply_pending_live_edits(job_id):
+    """Apply the edits queued while the job was still solving (caller holds the job's edit lock)"""
+    job = solver_jobs[job_id]
+    while job['pending_edits']:
+        edit = job['pending_edits'].pop(0)
+        # The plan type is only known once the solver has started, after the edit was queued
+        error = live_edit_unsupported(job)
+        if error:
+            result = {'error': error, 'edit': edit}
+        else:
+            try:
+                result = apply_live_edit(job_id, edit)
+            except ValueError as e:
+                result = {'error': str(e), 'edit': edit}
+        job['edit_results'].append(result)
+def live_edit_unsupported(job):
+    """Reason the job's plan can't take live edits, or None"""
+    if job.get('constrained'):
+        return 'Live edits are only supported for plans without time windows or route limits'
+    if job.get('multi_depot'):
+        return 'Live edits are not supported for multi-depot plans yet'
+    if job.get('solution') is not None and job.get('live_data') is None and job.get('live_plan') is None:
+        return 'This plan is too large, superseded or expired, and can no longer be edited'
+    return None
+def submit_live_edit(job_id, edit):
+    """Apply an edit now, or queue it while the job is still solving"""
+    job = solver_jobs[job_id]
+    error = live_edit_unsupported(job)
+    if error:
+        return jsonify({'success': False, 'error': error})
+    
+    with job['edit_lock']:
+        if job.get('solution') is None:
+            if job['status'] == 'error':
+                return jsonify({'success': False, 'error': 'Job failed, there is no plan to edit'})
+            job['pending_edits'].append(edit)
+            return jsonify({
+                'success': True,
+                'queued': True,
+                'pending_edits': len(job['pending_edits']),
+                'message': 'Job is still solving, the edit will be applied to its solution'
+            })
+        
+        # Edits queued while solving go first, in arrival order
+        apply_pending_live_edits(job_id)
+        started = time.perf_counter()
+        try:
+            result = apply_live_edit(job_id, edit)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)})
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    return jsonify({
+        'success': True,
+        'queued': False,
+        **result,
+        'elapsed_ms': elapsed_ms,
+        'solution': job['solution']
+    })
 @app.before_request
 def setup_subscription_manager():
     g.subscription_manager = get_subscription_manager()
@@ -1179,10 +1313,10 @@ def generate_random():
         # Generate node names
         company_names = [f"Depot" if i == depot else f"Customer {i}" for i in range(num_nodes)]
         
-        # Store in session
+        # Store in session (Euclidean is symmetric, so only the upper triangle is kept)
         session['problem_data'] = {
             'coordinates': coordinates.tolist(),
-            'distance_matrix': distance_matrix.tolist(),
+            'distance_matrix_condensed': CondensedDistanceMatrix.from_matrix(distance_matrix).to_dict(),
             'demands': demands,
             'company_names': company_names,
             'depot': depot,
@@ -1241,13 +1375,14 @@ def process_data():
         print(f"Parameters: depot={depot}, capacity={vehicle_capacity}, vehicles={max_vehicles}")
         print(f"Use Google Maps: {use_google_maps}")
         
-        # Clear out any previous problem_data
-        if 'problem_data' in session:
-            del session['problem_data']
+        # Clear out any previous problem_data (a generated problem is still read below)
+        previous_problem = session.pop('problem_data', None)
         # Find the data in session - check both possible storage locations
         coordinates = None
         company_names = None
         demands = None
+        time_windows = None
+        service_times = None
         
         print("Session keys:", list(session.keys()))
         
@@ -1294,6 +1429,16 @@ def process_data():
                 elif 'Demand' in df.columns:
                     demands = df['Demand'].tolist()
                 
+                # Extract optional delivery time windows and service times, in minutes
+                # (e.g. minutes after midnight); travel times are computed in minutes too
+                if 'time_window_start' in df.columns and 'time_window_end' in df.columns:
+                    time_windows = [
+                        [None if pd.isna(start) else float(start), None if pd.isna(end) else float(end)]
+                        for start, end in zip(df['time_window_start'], df['time_window_end'])
+                    ]
+                if 'service_time' in df.columns:
+                    service_times = df['service_time'].fillna(0).astype(float).tolist()
+                
                 print(f"Extracted from dataframe: coords={len(coordinates) if coordinates else 0}, " +
                      f"names={len(company_names) if company_names else 0}, demands={len(demands) if demands else 0}")
                      
@@ -1301,9 +1446,9 @@ def process_data():
                 print(f"Error processing session['data']: {str(e)}")
         
         # Check if data is from random generation (session['problem_data'])
-        elif 'problem_data' in session and session['problem_data']:
+        elif previous_problem:
             print("Found data from random generation in session['problem_data']")
-            problem_data = session['problem_data']
+            problem_data = previous_problem
             coordinates = problem_data.get('coordinates', [])
             company_names = problem_data.get('company_names', [])
             demands = problem_data.get('demands', [])
@@ -1328,6 +1473,8 @@ def process_data():
         session['coordinates'] = coordinates
         session['company_names'] = company_names or [f"Node {i}" if i != depot else "Depot" for i in range(len(coordinates))]
         session['demands'] = demands or [0 if i == depot else 5 for i in range(len(coordinates))]
+        session['time_windows'] = time_windows
+        session['service_times'] = service_times
         
         print(f"Session data prepared: {len(coordinates)} coordinates, {len(session['demands'])} demands")
         
@@ -1382,8 +1529,28 @@ def process_data():
             options=google_maps_options
         )
         
-        # Store matrix in session for later use
-        session['distance_matrix'] = distance_matrix
+        # Store matrix in session for later use; haversine is symmetric, so keep the
+        # condensed upper triangle quantized to whole meters. Road distances from
+        # Google can differ by direction and are kept in full.
+        distance_matrix = np.asarray(distance_matrix)
+        if np.array_equal(distance_matrix, distance_matrix.T):
+            condensed_matrix = CondensedDistanceMatrix.from_matrix(distance_matrix, resolution=1.0).to_dict()
+            full_matrix = None
+        else:
+            condensed_matrix = None
+            full_matrix = np.rint(distance_matrix).tolist()
+        session['distance_matrix_condensed'] = condensed_matrix
+        session['distance_matrix'] = full_matrix
+        
+        # Travel times in minutes for time windows: Google durations where cached, else a fixed speed
+        duration_condensed = duration_full = None
+        if time_windows is not None:
+            google_mode = google_maps_options.get('mode', 'driving') if use_google_maps and os.getenv('GOOGLE_MAPS_API_KEY') else None
+            duration_matrix = compute_duration_matrix(distance_matrix, coordinates, mode=google_mode)
+            if np.array_equal(duration_matrix, duration_matrix.T):
+                duration_condensed = CondensedDistanceMatrix.from_matrix(duration_matrix, resolution=0.01).to_dict()
+            else:
+                duration_full = np.round(duration_matrix, 2).tolist()
         
         # Create a small preview of the matrix for display (5x5)
         matrix_preview = []
@@ -1394,9 +1561,22 @@ def process_data():
                 row.append(distance_matrix[i][j])
             matrix_preview.append(row)
         
-        # Update problem_data if it exists
-        if 'problem_data' in session:
-            session['problem_data']['distance_matrix'] = distance_matrix
+        # Everything run_solver reads
+        session['problem_data'] = {
+            'coordinates': coordinates,
+            'distance_matrix_condensed': condensed_matrix,
+            'distance_matrix': full_matrix,
+            'demands': session['demands'],
+            'company_names': session['company_names'],
+            'depot': depot,
+            'vehicle_capacity': int(vehicle_capacity),
+            'max_vehicles': int(max_vehicles),
+            'time_windows': time_windows,
+            'service_times': service_times,
+            'duration_matrix_condensed': duration_condensed,
+            'duration_matrix': duration_full,
+            'distance_type': 'Google Maps API' if use_google_maps else 'Euclidean'
+        }
         
         return jsonify({
             'success': True,
@@ -1427,34 +1607,32 @@ def process_data():
             'error': f'Error processing data: {str(e)}'
         }), 500
 
-# Helper function for distance calculation (implement based on your existing code)
+# Helper function for distance calculation
 def calculate_distance_matrix(coordinates, use_google_maps=False, options=None):
-    """Calculate distance matrix from coordinates"""
-    import math
-    
-    n = len(coordinates)
-    matrix = [[0 for _ in range(n)] for _ in range(n)]
-    
-    for i in range(n):
-        for j in range(n):
-            if i != j:
-                # Calculate Euclidean distance in meters
-                lat1, lon1 = coordinates[i]
-                lat2, lon2 = coordinates[j]
-                
-                # Convert to radians
-                lat1, lon1 = math.radians(lat1), math.radians(lon1)
-                lat2, lon2 = math.radians(lat2), math.radians(lon2)
-                
-                # Haversine formula for distance
-                dlon = lon2 - lon1
-                dlat = lat2 - lat1
-                a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-                c = 2 * math.asin(math.sqrt(a))
-                r = 6371000  # Radius of Earth in meters
-                matrix[i][j] = c * r
-    
-    return matrix
+    """
+    Calculate distance matrix from (lat, lng) coordinates, in meters
+    
+    Road distances come from the Google Distance Matrix API (pairs resolved on
+    earlier runs are served from the persistent element cache). options['symmetric']
+    (True, False or 'hybrid') controls whether both directions of a pair are
+    requested. Without Google Maps, options['backend'] (or DISTANCE_BACKEND)
+    can select a local road network: 'osrm' (OSRM_URL) or 'road_graph'
+    (ROAD_GRAPH_PATH); otherwise great-circle distances are used.
+    """
+    options = options or {}
+    api_key = os.getenv('GOOGLE_MAPS_API_KEY')
+    if use_google_maps and api_key:
+        return compute_google_distance_matrix(coordinates, api_key, mode=options.get('mode', 'driving'),
+                                              symmetric=options.get('symmetric'))
+    
+    backend = options.get('backend') or os.getenv('DISTANCE_BACKEND')
+    if backend in ('osrm', 'road_graph'):
+        try:
+            return compute_backend_distance_matrix(coordinates, backend, profile=options.get('profile', 'driving'))
+        except Exception as e:
+            print(f"Road network backend '{backend}' failed, using great-circle distances: {str(e)}")
+    return compute_distance_matrix(coordinates, metric='haversine')
+
 @app.route('/get_distance_matrix', methods=['GET'])
 @login_required
 def get_distance_matrix():
@@ -1471,10 +1649,12 @@ def get_distance_matrix():
     if company_names:
         node_labels = company_names
     
+    distance_matrix = get_problem_distance_matrix(problem_data)
+    
     return jsonify({
         'success': True,
-        'matrix': problem_data['distance_matrix'],
-        'nodes': len(problem_data['distance_matrix']),
+        'matrix': distance_matrix.tolist(),
+        'nodes': len(distance_matrix),
         'node_labels': node_labels,
         'distance_type': problem_data.get('distance_type', 'Euclidean')
     })
@@ -1512,13 +1692,32 @@ def solve():
         else:
             user_id = None
         
+        # Cancel any still-running jobs from this user - a re-submit supersedes them - and
+        # drop the live-edit data of their finished ones
+        prune_solver_jobs()
+        if user_id:
+            for other_id, other_job in list(solver_jobs.items()):
+                if other_job.get('user_id') != user_id:
+                    continue
+                if other_job.get('status') in ACTIVE_JOB_STATUSES:
+                    other_job['superseded_by'] = job_id
+                    cancel_solver_job(other_id)
+                else:
+                    release_live_edit_data(other_job)
+        
         # Initialize progress
         solver_jobs[job_id] = {
             'status': 'initializing',
             'progress': 0,
             'message': 'Initializing solver...',
             'updates': [],
-            'user_id': user_id  # Associate job with user
+            'user_id': user_id,  # Associate job with user
+            'cancel_event': threading.Event(),
+            'created_at': time.time(),
+            'live_data': None,  # Set by run_solver for plans that can take live edits
+            'edit_lock': threading.Lock(),
+            'pending_edits': [],
+            'edit_results': []
         }
         
         # Record route creation in usage tracking
@@ -1583,15 +1782,92 @@ def get_solution(job_id):
     
     job_info = solver_jobs[job_id]
     
-    if job_info['status'] != 'completed':
+    # Cancelled jobs keep the best solution found before they were stopped
+    if job_info['status'] != 'completed' and not (
+            job_info['status'] == 'cancelled' and job_info.get('solution')):
         return jsonify({'success': False, 'error': 'Solution not ready yet'})
     
+    # Top-k alternative plans from the elite pool (?k=3 by default)
+    k = request.args.get('k', default=3, type=int)
+    
     return jsonify({
         'success': True,
+        'status': job_info['status'],
         'solution': job_info.get('solution', None),
+        'alternatives': job_info.get('alternatives', [])[:max(k, 0)],
+        'edit_results': job_info.get('edit_results', []),
         'cost_history': job_info.get('cost_history', []),
         'temp_history': job_info.get('temp_history', [])
     })
+
+@app.route('/cancel_job/<job_id>', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    if job_id not in solver_jobs:
+        return jsonify({'success': False, 'error': 'Job not found'})
+    
+    # Check if the job belongs to the current user
+    if 'user' in session and solver_jobs[job_id].get('user_id') != session['user']['id']:
+        return jsonify({'success': False, 'error': 'Unauthorized access to job'})
+    
+    if not cancel_solver_job(job_id):
+        return jsonify({
+            'success': False,
+            'error': f"Job is already {solver_jobs[job_id]['status']}"
+        })
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'message': 'Cancellation requested'
+    })
+
+# Live plan edits: same-day orders are inserted into (or removed from) a job's plan
+# without re-solving, so they don't count against the route quota
+@app.route('/insert_customer/<job_id>', methods=['POST'])
+@login_required
+def insert_customer(job_id):
+    if job_id not in solver_jobs:
+        return jsonify({'success': False, 'error': 'Job not found'})
+    
+    # Check if the job belongs to the current user
+    if 'user' in session and solver_jobs[job_id].get('user_id') != session['user']['id']:
+        return jsonify({'success': False, 'error': 'Unauthorized access to job'})
+    
+    data = request.get_json() or {}
+    try:
+        demand = float(data.get('demand', 0))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Demand must be a number'})
+    if data.get('coordinates') is None and (data.get('distances_from') is None or data.get('distances_to') is None):
+        return jsonify({'success': False, 'error': 'Coordinates or distances_from/distances_to are required'})
+    
+    return submit_live_edit(job_id, {
+        'action': 'insert',
+        'demand': int(demand) if demand.is_integer() else demand,
+        'coordinates': data.get('coordinates'),
+        'name': data.get('name'),
+        'distances_from': data.get('distances_from'),
+        'distances_to': data.get('distances_to')
+    })
+
+@app.route('/remove_customer/<job_id>', methods=['POST'])
+@login_required
+def remove_customer(job_id):
+    if job_id not in solver_jobs:
+        return jsonify({'success': False, 'error': 'Job not found'})
+    
+    # Check if the job belongs to the current user
+    if 'user' in session and solver_jobs[job_id].get('user_id') != session['user']['id']:
+        return jsonify({'success': False, 'error': 'Unauthorized access to job'})
+    
+    data = request.get_json() or {}
+    try:
+        customer = int(data['customer'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'A customer index is required'})
+    
+    return submit_live_edit(job_id, {'action': 'remove', 'customer': customer})
 @app.route('/proxy_google_distance_matrix', methods=['POST'])
 def proxy_google_distance_matrix():
     """Proxy Google Maps Distance Matrix API requests to protect API key"""
@@ -2356,42 +2632,105 @@ def record_usage_with_service_role(user_id, usage_type):
         print(f"Error recording usage with service role: {str(e)}")
         return {'success': False, 'error': str(e)}
 # Utility functions
+def get_problem_distance_source(problem_data):
+    """Stored distance data: a CondensedDistanceMatrix, or the nested lists of a full matrix"""
+    if problem_data.get('distance_matrix_condensed'):
+        return CondensedDistanceMatrix.from_dict(problem_data['distance_matrix_condensed'])
+    return problem_data['distance_matrix']
+def get_problem_distance_matrix(problem_data):
+    """Dense distance matrix from problem data, expanding condensed session storage if needed"""
+    return np.asarray(get_problem_distance_source(problem_data))
+def get_problem_duration_matrix(problem_data):
+    """Dense travel time matrix in minutes from problem data, or None without time windows"""
+    if problem_data.get('duration_matrix_condensed'):
+        return CondensedDistanceMatrix.from_dict(problem_data['duration_matrix_condensed']).to_distances()
+    if problem_data.get('duration_matrix') is not None:
+        return np.array(problem_data['duration_matrix'], dtype=np.float64)
+    return None
 def run_solver(job_id, problem_data, params):
     """Run the CVRP solver in a separate thread"""  
+    distance_matrix = None
     try:
         # Update job status
         solver_jobs[job_id]['status'] = 'running'
         solver_jobs[job_id]['message'] = 'Initializing solver...'
         
-        # Extract data
-        distance_matrix = np.array(problem_data['distance_matrix'])
+        # Extract data - huge matrices go to a disk-backed memmap instead of RAM, written
+        # block by block from the stored data so the dense matrix is never in RAM at once
+        distance_source = get_problem_distance_source(problem_data)
+        if should_use_memmap(len(distance_source)):
+            distance_matrix = store_distance_matrix_memmap(distance_source)
+            distance_source = None  # Memmapped plans are too large for live edits
+        else:
+            distance_matrix = np.asarray(distance_source)
         demands = problem_data['demands']
         depot = problem_data['depot']
         vehicle_capacity = problem_data['vehicle_capacity']
         company_names = problem_data.get('company_names', None)
         
+        max_vehicles = problem_data.get('max_vehicles', 5)
+        
+        # Optional delivery time windows and service times, with travel times, all in minutes
+        time_windows = problem_data.get('time_windows')
+        service_times = problem_data.get('service_times')
+        duration_matrix = get_problem_duration_matrix(problem_data)
+        
+        # Optional driver shift limits: one value for all vehicles or a list per vehicle
+        max_route_distance = params.get('max_route_distance', problem_data.get('max_route_distance'))
+        max_route_duration = params.get('max_route_duration', problem_data.get('max_route_duration'))
+        
+        # Number of alternative plans kept during the search
+        elite_pool_size = int(params.get('elite_pool_size', 5))
+        
+        # Solver selection: 'auto' picks the engine and parameter set from instance features
+        algorithm = params.get('algorithm', 'auto')
+        constrained = (time_windows is not None or max_route_distance is not None or
+                       max_route_duration is not None)
+        solver_jobs[job_id]['constrained'] = constrained
+        
+        # Several warehouses: customers are assigned to depots and each depot is solved on its own
+        depots = params.get('depots', problem_data.get('depots'))
+        multi_depot = bool(depots) and len(depots) > 1 and not constrained
+        solver_jobs[job_id]['multi_depot'] = multi_depot
+        if multi_depot:
+            algorithm = 'multi_depot'
+        elif algorithm == 'auto':
+            features = compute_instance_features(
+                distance_matrix, demands, depot, vehicle_capacity, max_vehicles,
+                coordinates=problem_data.get('coordinates'),
+                constrained=constrained
+            )
+            algorithm, rule_params, rule_name = select_engine(features)
+            
+            # The rule's parameter set wins over the request: the solver form always sends its
+            # SA fields, so they would otherwise mask every rule. override_params keeps the request's.
+            if params.get('override_params'):
+                params = {**rule_params, **params}
+            else:
+                params = {**params, **rule_params}
+            solver_jobs[job_id]['engine'] = {'algorithm': algorithm, 'rule': rule_name, 'features': features}
+            print(f"Job {job_id}: portfolio rule '{rule_name}' selected engine '{algorithm}'")
+        
+        # Tabu and HGS copy the matrix into Python lists (about 4x the array), which a
+        # memmapped matrix is too big for; those jobs run SA on the memmap instead
+        if is_memmap(distance_matrix) and algorithm in ('tabu', 'hgs'):
+            print(f"Job {job_id}: memory-mapped {len(distance_matrix)}-node matrix, running 'sa' instead of '{algorithm}'")
+            algorithm = 'sa'
+        
         # Extract algorithm parameters
         initial_temperature = float(params.get('initial_temperature', 1000.0))
         final_temperature = float(params.get('final_temperature', 1.0))
         cooling_rate = float(params.get('cooling_rate', 0.98))
         max_iterations = int(params.get('max_iterations', 1000))
         iterations_per_temp = int(params.get('iterations_per_temp', 100))
-        max_vehicles = problem_data.get('max_vehicles', 5)
         
-        # Create the CVRP_SimulatedAnnealing solver
-        from models.cvrp import CVRP_SimulatedAnnealing
-        solver = CVRP_SimulatedAnnealing(
-            distance_matrix=distance_matrix,
-            demands=demands,
-            depot=depot,
-            vehicle_capacity=vehicle_capacity,
-            initial_temperature=initial_temperature,
-            final_temperature=final_temperature,
-            cooling_rate=cooling_rate,
-            max_vehicles=max_vehicles,
-            max_iterations=max_iterations,
-            iterations_per_temp=iterations_per_temp
-        )
+        # SA acceptance rule: 'metropolis' (default), 'threshold', 'record_to_record' or 'late_acceptance'
+        acceptance = params.get('acceptance', 'metropolis')
+        acceptance_params = params.get('acceptance_params') or {}
+        
+        # Opt-in SA move trace for offline tuning (analyze with: python -m models.trace <file>)
+        trace_path = os.path.join(TRACE_DIR, f"{job_id}.trace") if params.get('trace') else None
+        solver_jobs[job_id]['trace_path'] = trace_path
         
         # Define callback function for progress updates
         def update_progress(iteration, inner_iter, temperature, best_cost, progress):
@@ -2408,26 +2747,249 @@ def run_solver(job_id, problem_data, params):
                 'time': datetime.now().strftime("%H:%M:%S")
             })
         
-        # Run the solver
-        routes, cost, cost_history, temp_history = solver.solve(callback=update_progress)
+        # Optional phase 1: find the smallest feasible fleet, then optimize distance with it
+        initial_solution = None
+        if params.get('minimize_fleet') and not constrained and not multi_depot:
+            from models.fleet import CVRP_FleetMinimizer
+            solver_jobs[job_id]['message'] = 'Minimizing fleet size...'
+            fleet_solver = CVRP_FleetMinimizer(
+                distance_matrix=distance_matrix,
+                demands=demands,
+                depot=depot,
+                vehicle_capacity=vehicle_capacity,
+                max_vehicles=max_vehicles,
+                time_limit=float(params.get('fleet_time_limit', 10.0)),
+                cancel_event=solver_jobs[job_id]['cancel_event']
+            )
+            fleet_routes, _, _, _ = fleet_solver.solve()
+            solver_jobs[job_id]['fleet'] = {
+                'min_vehicles': fleet_solver.num_routes,
+                'lower_bound': fleet_solver.lower_bound,
+                'proven_minimal': fleet_solver.num_routes <= fleet_solver.lower_bound,
+                'available_vehicles': max_vehicles
+            }
+            print(f"Job {job_id}: minimal fleet {fleet_solver.num_routes} (lower bound {fleet_solver.lower_bound})")
+            
+            # The distance phase keeps the minimal fleet (never more than the user's allowance)
+            if fleet_solver.num_routes <= max_vehicles:
+                max_vehicles = fleet_solver.num_routes
+                initial_solution = fleet_routes
+        
+        solver = None
+        
+        # Multi-depot: assignment, parallel per-depot SA solves and an inter-depot exchange
+        if multi_depot:
+            from models.multi_depot import CVRP_MultiDepot
+            depot_demands = list(demands)
+            for other_depot in depots:
+                depot_demands[int(other_depot)] = 0
+            solver = CVRP_MultiDepot(
+                distance_matrix=distance_matrix,
+                demands=depot_demands,
+                depots=depots,
+                vehicle_capacity=vehicle_capacity,
+                max_vehicles=max_vehicles,
+                depot_vehicles=params.get('depot_vehicles'),
+                assignment_rule=params.get('depot_assignment', 'regret'),
+                cancel_event=solver_jobs[job_id]['cancel_event'],
+                sa_params={
+                    'initial_temperature': initial_temperature,
+                    'final_temperature': final_temperature,
+                    'cooling_rate': cooling_rate,
+                    'max_iterations': max_iterations,
+                    'iterations_per_temp': iterations_per_temp,
+                    'acceptance': acceptance,
+                    'acceptance_params': acceptance_params
+                }
+            )
+            routes, cost, cost_history, temp_history = solver.solve(callback=update_progress)
+        
+        # Tiny instances: provable optimum in milliseconds instead of a full SA run
+        from models.exact import CVRP_Exact, EXACT_MAX_CUSTOMERS
+        if algorithm == 'exact' and len(distance_matrix) - 1 <= EXACT_MAX_CUSTOMERS and not constrained:
+            solver = CVRP_Exact(
+                distance_matrix=distance_matrix,
+                demands=demands,
+                depot=depot,
+                vehicle_capacity=vehicle_capacity,
+                max_vehicles=max_vehicles,
+                cancel_event=solver_jobs[job_id]['cancel_event']
+            )
+            try:
+                routes, cost, cost_history, temp_history = solver.solve(callback=update_progress)
+            except ValueError as e:
+                # No capacity-feasible split within the fleet; let SA find the best compromise
+                print(f"Exact solver skipped for job {job_id}: {str(e)}")
+                solver = None
+        
+        # Huge instances: sweep into sectors, solve each one with SA, then 2-opt the routes
+        if algorithm == 'decomposition' and not constrained and problem_data.get('coordinates'):
+            from models.decomposition import CVRP_SweepDecomposition
+            solver = CVRP_SweepDecomposition(
+                distance_matrix=distance_matrix,
+                demands=demands,
+                depot=depot,
+                vehicle_capacity=vehicle_capacity,
+                coordinates=problem_data['coordinates'],
+                max_vehicles=max_vehicles,
+                cancel_event=solver_jobs[job_id]['cancel_event'],
+                cluster_size=int(params.get('cluster_size', 100)),
+                sa_params={
+                    'initial_temperature': initial_temperature,
+                    'final_temperature': final_temperature,
+                    'cooling_rate': cooling_rate,
+                    'max_iterations': max_iterations,
+                    'iterations_per_temp': iterations_per_temp,
+                    'acceptance': acceptance,
+                    'acceptance_params': acceptance_params
+                }
+            )
+            try:
+                routes, cost, cost_history, temp_history = solver.solve(callback=update_progress)
+            except ValueError as e:
+                # Sector minimums exceed the fleet; let SA find the best compromise on the whole instance
+                print(f"Decomposition skipped for job {job_id}: {str(e)}")
+                solver = None
+        
+        # Granular tabu search: deterministic best-improvement with tabu memory (capacity only)
+        if algorithm == 'tabu' and not constrained:
+            from models.tabu import CVRP_TabuSearch
+            solver = CVRP_TabuSearch(
+                distance_matrix=distance_matrix,
+                demands=demands,
+                depot=depot,
+                vehicle_capacity=vehicle_capacity,
+                max_vehicles=max_vehicles,
+                max_iterations=max_iterations,
+                tenure=int(params['tabu_tenure']) if params.get('tabu_tenure') is not None else None,
+                granularity=int(params.get('granularity', 10)),
+                cancel_event=solver_jobs[job_id]['cancel_event'],
+                elite_pool_size=elite_pool_size,
+                initial_solution=initial_solution
+            )
+            routes, cost, cost_history, temp_history = solver.solve(callback=update_progress)
+        
+        # Hybrid genetic search: giant-tour chromosomes decoded by Split (capacity only)
+        if algorithm == 'hgs' and not constrained:
+            from models.hgs import CVRP_HybridGenetic
+            solver = CVRP_HybridGenetic(
+                distance_matrix=distance_matrix,
+                demands=demands,
+                depot=depot,
+                vehicle_capacity=vehicle_capacity,
+                max_vehicles=max_vehicles,
+                population_size=int(params.get('population_size', 25)),
+                offspring_per_generation=int(params.get('offspring_per_generation', 10)),
+                generations=int(params.get('generations', 100)),
+                time_limit=float(params['time_limit']) if params.get('time_limit') is not None else None,
+                granularity=int(params.get('granularity', 10)),
+                cancel_event=solver_jobs[job_id]['cancel_event'],
+                elite_pool_size=elite_pool_size,
+                initial_solution=initial_solution
+            )
+            routes, cost, cost_history, temp_history = solver.solve(callback=update_progress)
+        
+        if solver is None:
+            # Create the CVRP_SimulatedAnnealing solver
+            from models.cvrp import CVRP_SimulatedAnnealing
+            solver = CVRP_SimulatedAnnealing(
+                distance_matrix=distance_matrix,
+                demands=demands,
+                depot=depot,
+                vehicle_capacity=vehicle_capacity,
+                initial_temperature=initial_temperature,
+                final_temperature=final_temperature,
+                cooling_rate=cooling_rate,
+                max_vehicles=max_vehicles,
+                max_iterations=max_iterations,
+                iterations_per_temp=iterations_per_temp,
+                cancel_event=solver_jobs[job_id]['cancel_event'],
+                time_windows=time_windows,
+                service_times=service_times,
+                duration_matrix=duration_matrix,
+                max_route_distance=max_route_distance,
+                max_route_duration=max_route_duration,
+                elite_pool_size=elite_pool_size,
+                initial_solution=initial_solution,
+                acceptance=acceptance,
+                acceptance_params=acceptance_params,
+                trace_path=trace_path
+            )
+            
+            # Run the solver
+            routes, cost, cost_history, temp_history = solver.solve(callback=update_progress)
+        
+        # Polish: re-sequence every route of the best solution (in parallel for big plans).
+        # Skipped with time windows / route limits, where a shorter order may be infeasible.
+        # Multi-depot routes are polished around their own depots by the solver.
+        if (params.get('polish', True) and not constrained and not multi_depot and
+                routes and not solver.cancelled):
+            solver_jobs[job_id]['message'] = 'Polishing routes...'
+            polished_routes = polish_solution(distance_matrix, depot, routes)
+            polished_cost = solver.calculate_total_distance(polished_routes)
+            if polished_cost < cost - 1e-9:
+                print(f"Job {job_id}: route polishing improved cost {cost:.2f} -> {polished_cost:.2f}")
+                routes, cost = polished_routes, polished_cost
+                solver.best_solution, solver.best_cost = routes, cost
+                cost_history.append(cost)
         
         # Create solution details
         solution_details = solver.get_solution_details(company_names)
         
-        # Store solution
-        solver_jobs[job_id]['status'] = 'completed'
-        solver_jobs[job_id]['progress'] = 100
-        solver_jobs[job_id]['message'] = f"Solution found with cost: {cost:.2f}"
+        # Compact instance data for live edits (the condensed triangle when there is one), kept
+        # only for in-RAM plans that can take edits; set before the solution so edits never miss it
+        if (not is_memmap(distance_matrix) and not solver_jobs[job_id].get('superseded_by') and
+                not constrained and not multi_depot):
+            solver_jobs[job_id]['live_data'] = {
+                'distance_matrix': (distance_source if isinstance(distance_source, CondensedDistanceMatrix)
+                                    else distance_matrix),
+                'demands': list(demands),
+                'depot': depot,
+                'vehicle_capacity': vehicle_capacity,
+                'max_vehicles': max_vehicles,
+                'coordinates': problem_data.get('coordinates'),
+                'company_names': company_names
+            }
+        del distance_source
+        
+        # Store solution (a cancelled job keeps its partial best result)
+        if solver.cancelled:
+            solver_jobs[job_id]['status'] = 'cancelled'
+            if solver_jobs[job_id].get('superseded_by'):
+                solver_jobs[job_id]['message'] = f"Superseded by a newer job, best cost so far: {cost:.2f}"
+            else:
+                solver_jobs[job_id]['message'] = f"Cancelled, best cost so far: {cost:.2f}"
+        else:
+            solver_jobs[job_id]['status'] = 'completed'
+            solver_jobs[job_id]['progress'] = 100
+            solver_jobs[job_id]['message'] = f"Solution found with cost: {cost:.2f}"
         solver_jobs[job_id]['solution'] = {
             'routes': routes,
             'details': solution_details,
             'cost': cost,
             'depot': depot,
-            'coordinates': problem_data['coordinates']
+            'coordinates': problem_data['coordinates'],
+            'fleet': solver_jobs[job_id].get('fleet'),
+            'depots': [int(other_depot) for other_depot in depots] if multi_depot else None
         }
+        
+        # Alternative plans collected during the same search
+        solver_jobs[job_id]['alternatives'] = [
+            {
+                'routes': alt_routes,
+                'cost': alt_cost,
+                'details': solver.get_solution_details(company_names, routes=alt_routes)
+            }
+            for alt_cost, alt_routes in solver.get_alternatives()
+        ]
         solver_jobs[job_id]['cost_history'] = cost_history
         solver_jobs[job_id]['temp_history'] = temp_history
         
+        # Orders inserted/removed while the job was solving
+        if solver_jobs[job_id].get('pending_edits'):
+            with solver_jobs[job_id]['edit_lock']:
+                apply_pending_live_edits(job_id)
+        
         # If a job completes successfully, also try to save it to the user's history
         try:
             if solver_jobs[job_id].get('user_id'):
@@ -2456,6 +3018,10 @@ def run_solver(job_id, problem_data, params):
         solver_jobs[job_id]['status'] = 'error'
         solver_jobs[job_id]['message'] = f"Error: {str(e)}"
         print(f"Solver error: {str(e)}")
+    finally:
+        # Memmap files are job-scoped; delete them as soon as the solve is over
+        if distance_matrix is not None:
+            release_memmap_distance_matrix(distance_matrix)
 def enhance_vehicle_limit_validation(app):
     """
     Enhance the process_data and solve endpoints to enforce vehicle limits
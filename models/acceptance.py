@@ -0,0 +1,196 @@
+"""
+Acceptance criteria for the simulated annealing move loop.
+
+The move generator proposes a neighbour; the criterion decides whether it
+replaces the current solution. Every criterion has the same interface, so
+any of them drives the same search:
+
+- Metropolis: classic SA, accept a worse neighbour with probability
+  exp(-delta / T), T cooled geometrically.
+- Threshold accepting (Dueck & Scheuer 1990): accept any neighbour less than
+  a threshold worse, the threshold shrinking geometrically.
+- Record-to-record travel (Dueck 1993): accept any neighbour within a fixed
+  fraction above the best cost seen.
+- Late acceptance hill climbing (Burke & Bykov 2017): accept a neighbour not
+  worse than the current cost or the cost L iterations ago, kept in a
+  fixed-size circular history. No temperature to tune and no exp call.
+
+The solver calls start() with the initial cost, accept() per move, step()
+after every outer iteration, and stops early once finished() is true.
+`temperature` is the criterion's control value, reported in temp_history.
+"""
+
+import math
+import random
+
+
+class AcceptanceCriterion:
+    """Interface shared by the acceptance criteria"""
+
+    name = None
+
+    def start(self, cost):
+        """Reset the criterion for a search starting at cost"""
+
+    def accept(self, current_cost, candidate_cost):
+        """Whether candidate_cost replaces current_cost"""
+        raise NotImplementedError
+
+    def step(self):
+        """Called after every outer iteration (temperature step)"""
+
+    def finished(self):
+        """Whether the criterion has run its course (only the temperature schedules end)"""
+        return False
+
+    @property
+    def temperature(self):
+        return 0.0
+
+
+class Metropolis(AcceptanceCriterion):
+    name = 'metropolis'
+
+    def __init__(self, initial_temperature=1000.0, final_temperature=1.0, cooling_rate=0.98):
+        """
+        Parameters:
+        - initial_temperature: Starting temperature
+        - final_temperature: The search ends below this temperature
+        - cooling_rate: Factor applied to the temperature after each outer iteration
+        """
+        self.initial_temperature = initial_temperature
+        self.final_temperature = final_temperature
+        self.cooling_rate = cooling_rate
+        self._temperature = initial_temperature
+
+    def start(self, cost):
+        self._temperature = self.initial_temperature
+
+    def accept(self, current_cost, candidate_cost):
+        delta_cost = candidate_cost - current_cost
+        return delta_cost < 0 or random.random() < math.exp(-delta_cost / self._temperature)
+
+    def step(self):
+        self._temperature *= self.cooling_rate
+
+    def finished(self):
+        return self._temperature <= self.final_temperature
+
+    @property
+    def temperature(self):
+        return self._temperature
+
+
+class ThresholdAccepting(AcceptanceCriterion):
+    name = 'threshold'
+
+    def __init__(self, initial_threshold=None, threshold_ratio=0.01, cooling_rate=0.98):
+        """
+        Parameters:
+        - initial_threshold: Starting threshold in cost units (default: threshold_ratio
+          times the initial cost)
+        - threshold_ratio: Starting threshold relative to the initial cost
+        - cooling_rate: Factor applied to the threshold after each outer iteration
+        """
+        self.initial_threshold = initial_threshold
+        self.threshold_ratio = threshold_ratio
+        self.cooling_rate = cooling_rate
+        self.threshold = initial_threshold or 0.0
+
+    def start(self, cost):
+        if self.initial_threshold is not None:
+            self.threshold = self.initial_threshold
+        else:
+            self.threshold = self.threshold_ratio * cost
+
+    def accept(self, current_cost, candidate_cost):
+        return candidate_cost - current_cost < self.threshold
+
+    def step(self):
+        self.threshold *= self.cooling_rate
+
+    @property
+    def temperature(self):
+        return self.threshold
+
+
+class RecordToRecord(AcceptanceCriterion):
+    name = 'record_to_record'
+
+    def __init__(self, deviation=0.01):
+        """
+        Parameters:
+        - deviation: Accepted excess over the record (best cost seen), as a fraction of it
+        """
+        self.deviation = deviation
+        self.record = float('inf')
+
+    def start(self, cost):
+        self.record = cost
+
+    def accept(self, current_cost, candidate_cost):
+        if candidate_cost < self.record:
+            self.record = candidate_cost
+            return True
+        return candidate_cost < self.record * (1.0 + self.deviation)
+
+    @property
+    def temperature(self):
+        return self.record * self.deviation
+
+
+class LateAcceptance(AcceptanceCriterion):
+    name = 'late_acceptance'
+
+    def __init__(self, history_length=50):
+        """
+        Parameters:
+        - history_length: Number of past current costs remembered (L)
+        """
+        self.history_length = max(1, int(history_length))
+        self.history = [float('inf')] * self.history_length
+        self.position = 0
+
+    def start(self, cost):
+        self.history = [cost] * self.history_length
+        self.position = 0
+
+    def accept(self, current_cost, candidate_cost):
+        accepted = candidate_cost <= current_cost or candidate_cost <= self.history[self.position]
+
+        # The slot remembers the current cost after this decision
+        self.history[self.position] = candidate_cost if accepted else current_cost
+        self.position += 1
+        if self.position == self.history_length:
+            self.position = 0
+        return accepted
+
+
+ACCEPTANCE_CRITERIA = {
+    criterion.name: criterion
+    for criterion in (Metropolis, ThresholdAccepting, RecordToRecord, LateAcceptance)
+}
+
+
+def make_acceptance(name='metropolis', initial_temperature=1000.0, final_temperature=1.0,
+                    cooling_rate=0.98, **params):
+    """
+    Build an acceptance criterion by name
+
+    Parameters:
+    - name: 'metropolis', 'threshold', 'record_to_record' or 'late_acceptance'
+    - initial_temperature, final_temperature, cooling_rate: The solver's schedule
+      (Metropolis uses all three, threshold accepting the cooling rate)
+    - params: Criterion-specific parameters (e.g. history_length, deviation)
+
+    Returns:
+    - AcceptanceCriterion
+    """
+    if name == 'metropolis':
+        params = {'initial_temperature': initial_temperature, 'final_temperature': final_temperature,
+                  'cooling_rate': cooling_rate, **params}
+    elif name == 'threshold':
+        params = {'cooling_rate': cooling_rate, **params}
+    elif name not in ACCEPTANCE_CRITERIA:
+        raise ValueError(f"Unknown acceptance criterion '{name}', expected one of {sorted(ACCEPTANCE_CRITERIA)}")
+    return ACCEPTANCE_CRITERIA[name](**params)
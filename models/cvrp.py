@@ -1,14 +1,228 @@
 import numpy as np
 import random
-import math
 import copy
 from datetime import datetime
 from collections import Counter
+from models.route_state import RouteStateCache
+from models.time_windows import TimeWindowData
+from models.elite_pool import ElitePool
+from models.split import split_tour
+from models.preprocessing import get_preprocessing, DEFAULT_NEIGHBORS
+from models.acceptance import AcceptanceCriterion, make_acceptance
+from models.trace import TraceRecorder
+from models.distance_matrix import lookup_rows
 
-class CVRP_SimulatedAnnealing:
+class CVRPSolverBase:
+    """Problem data, cost helpers and reporting shared by the CVRP solvers"""
+    
+    def __init__(self, distance_matrix, demands, depot, vehicle_capacity, max_vehicles=5, cancel_event=None,
+                 persist_preprocessing=True):
+        """
+        Store the problem data shared by every CVRP solver
+        
+        Parameters:
+        - distance_matrix: 2D array of distances between nodes
+        - demands: Array of customer demands (demand[depot] should be 0)
+        - depot: Index of the depot node
+        - vehicle_capacity: Maximum capacity of each vehicle
+        - max_vehicles: Maximum number of vehicles (routes)
+        - cancel_event: Optional threading.Event; when set, solve() stops early
+          and returns the best solution found so far
+        - persist_preprocessing: Cache the instance preprocessing in memory and on disk;
+          False for one-off sub-instances
+        """
+        # asarray keeps arrays (including disk-backed memmaps) as they are instead of copying
+        self.distance_matrix = np.asarray(distance_matrix)
+        self.demands = demands
+        self.depot = depot
+        self.vehicle_capacity = vehicle_capacity
+        self.max_vehicles = max_vehicles
+        self.num_nodes = len(distance_matrix)
+        
+        # Cooperative cancellation
+        self.cancel_event = cancel_event
+        self.cancelled = False
+        
+        # Solution tracking
+        self.best_solution = None
+        self.best_cost = float('inf')
+        self.elite_pool = None
+        
+        # Cached instance preprocessing (k-NN lists, depot order, ...), loaded on first use
+        self._preprocessing = None
+        self.persist_preprocessing = persist_preprocessing
+        
+        # History for convergence plots
+        self.cost_history = []
+        self.temp_history = []
+    
+    def customers(self):
+        """All customer indices (every node except the depot)"""
+        return [node for node in range(self.num_nodes) if node != self.depot]
+    
+    @property
+    def preprocessing(self):
+        """Instance preprocessing shared by every solve of the same matrix and demands"""
+        return self.get_instance_preprocessing()
+    
+    def get_instance_preprocessing(self, k=DEFAULT_NEIGHBORS):
+        """Instance preprocessing with at least k neighbours per customer (rebuilt when it has fewer)"""
+        wanted = min(k, max(0, self.num_nodes - 2))
+        if self._preprocessing is None or self._preprocessing.neighbors.shape[1] < wanted:
+            self._preprocessing = get_preprocessing(self.distance_matrix, self.demands, self.depot, k=k,
+                                                    persist=self.persist_preprocessing)
+        return self._preprocessing
+    
+    def is_valid_solution(self, routes):
+        """Check if a solution is valid (no duplicates, all customers served)"""
+        # Get all customers in the solution
+        all_customers = []
+        for route in routes:
+            all_customers.extend(route)
+        
+        # Check for duplicates
+        customer_counts = Counter(all_customers)
+        has_duplicates = any(count > 1 for count in customer_counts.values())
+        
+        # Check if all customers are served
+        customers = set(range(self.num_nodes))
+        customers.remove(self.depot)
+        all_served = all(customer in all_customers for customer in customers)
+        
+        return not has_duplicates and all_served
+    
+    def calculate_route_distance(self, route):
+        """Calculate the total distance of a single route"""
+        if not route:
+            return 0
+            
+        distance = self.distance_matrix[self.depot][route[0]]
+        for i in range(len(route) - 1):
+            distance += self.distance_matrix[route[i]][route[i + 1]]
+        distance += self.distance_matrix[route[-1]][self.depot]
+        
+        return distance
+    
+    def route_depot(self, route):
+        """Depot a route starts and ends at"""
+        return self.depot
+    
+    def calculate_total_distance(self, routes):
+        """Calculate the total distance of all routes"""
+        return sum(self.calculate_route_distance(route) for route in routes)
+    
+    def calculate_route_load(self, route):
+        """Calculate the total demand of a route"""
+        return sum(self.demands[customer] for customer in route)
+    
+    def split_giant_tour(self, tour):
+        """
+        Cut an ordering of customers into at most max_vehicles routes, optimally for
+        that order (capacity overload is only used when the fleet cannot carry the demand)
+        """
+        routes, _ = split_tour(self.distance_matrix, self.demands, self.depot,
+                               self.vehicle_capacity, list(tour), max_routes=self.max_vehicles)
+        return routes
+    
+    def cancel(self):
+        """Request the running solve() to stop at the next inner iteration"""
+        self.cancelled = True
+    
+    def is_cancel_requested(self):
+        """Check the cancellation flag (and the external event, if one was provided)"""
+        if not self.cancelled and self.cancel_event is not None and self.cancel_event.is_set():
+            self.cancelled = True
+        return self.cancelled
+    
+    def get_alternatives(self, k=None):
+        """
+        Get the best distinct solutions kept in the elite pool
+        
+        Parameters:
+        - k: Optional maximum number of solutions
+        
+        Returns:
+        - List of (cost, routes) pairs, cheapest first
+        """
+        if self.elite_pool is None:
+            return []
+        return self.elite_pool.top(k)
+    
+    def get_solution_details(self, company_names=None, routes=None):
+        """
+        Get detailed information about the solution
+        
+        Parameters:
+        - company_names: Optional list of names for each node
+        - routes: Optional solution to describe instead of the best one
+        
+        Returns:
+        - Dictionary with solution details
+        """
+        if routes is None:
+            routes = self.best_solution
+            total_distance = self.best_cost
+        else:
+            total_distance = self.calculate_total_distance(routes)
+        
+        solution_details = {
+            'total_distance': total_distance,
+            'routes': []
+        }
+        
+        for i, route in enumerate(routes):
+            route_demand = self.calculate_route_load(route)
+            route_distance = self.calculate_route_distance(route)
+            
+            depot = self.route_depot(route)
+            route_with_depot = [depot] + route + [depot]
+            
+            # Use company names if available
+            if company_names:
+                route_display = [
+                    {'index': node, 'name': company_names[node]} 
+                    for node in route_with_depot
+                ]
+            else:
+                route_display = [
+                    {'index': node, 'name': f"Node {node}"} 
+                    for node in route_with_depot
+                ]
+                
+            route_details = {
+                'id': i + 1,
+                'stops': route_display,
+                'load': route_demand,
+                'capacity': self.vehicle_capacity,
+                'distance': route_distance
+            }
+            
+            # Solver-specific extras (time windows, route limits, ...)
+            route_details.update(self._extra_route_details(route, i))
+            
+            solution_details['routes'].append(route_details)
+        
+        solution_details.update(self._extra_solution_details(routes))
+        
+        return solution_details
+    
+    def _extra_route_details(self, route, index):
+        """Extra per-route fields for get_solution_details"""
+        return {}
+    
+    def _extra_solution_details(self, routes):
+        """Extra solution-level fields for get_solution_details"""
+        return {}
+
+class CVRP_SimulatedAnnealing(CVRPSolverBase):
     def __init__(self, distance_matrix, demands, depot, vehicle_capacity, 
                  initial_temperature=1000.0, final_temperature=1.0, max_vehicles=5, 
-                 cooling_rate=0.98, max_iterations=1000, iterations_per_temp=100):
+                 cooling_rate=0.98, max_iterations=1000, iterations_per_temp=100,
+                 cancel_event=None, time_windows=None, service_times=None, duration_matrix=None,
+                 max_route_distance=None, max_route_duration=None,
+                 elite_pool_size=0, elite_min_distance=0.1, initial_solution=None,
+                 acceptance='metropolis', acceptance_params=None, trace_path=None, trace_capacity=1000000,
+                 persist_preprocessing=True):
         """
         Initialize the CVRP Simulated Annealing solver
         
@@ -22,13 +236,32 @@ class CVRP_SimulatedAnnealing:
         - cooling_rate: Rate at which temperature decreases
         - max_iterations: Maximum number of temperature steps
         - iterations_per_temp: Number of iterations at each temperature
+        - cancel_event: Optional threading.Event; when set, solve() stops early
+          and returns the best solution found so far
+        - time_windows: Optional list of (earliest, latest) service start times per node;
+          the depot's window is the planning horizon
+        - service_times: Optional list of service durations per node
+        - duration_matrix: Optional 2D array of travel times (defaults to distance_matrix)
+        - max_route_distance: Optional route distance limit, either one value for all
+          vehicles or a list with one value per vehicle (route position)
+        - max_route_duration: Optional route duration limit (travel + service + waiting),
+          one value or a list per vehicle
+        - elite_pool_size: Number of distinct good solutions to keep as alternatives (0 disables)
+        - elite_min_distance: Minimum fraction of differing edges between kept alternatives
+        - initial_solution: Optional starting routes (e.g. from the fleet minimization phase);
+          the greedy construction is used otherwise
+        - acceptance: Acceptance criterion, an AcceptanceCriterion or one of 'metropolis'
+          (classic SA), 'threshold', 'record_to_record' and 'late_acceptance'
+        - acceptance_params: Optional parameters of the named criterion
+          (e.g. {'history_length': 500} for late acceptance)
+        - trace_path: Optional file; when set, every proposed move is recorded there
+          for offline analysis (see models/trace.py)
+        - trace_capacity: Number of most recent moves kept in the trace file
+        - persist_preprocessing: Cache the instance preprocessing in memory and on disk;
+          False for one-off sub-instances (decomposition sectors, depot sub-problems)
         """
-        self.distance_matrix = np.array(distance_matrix)
-        self.demands = demands
-        self.depot = depot
-        self.vehicle_capacity = vehicle_capacity
-        self.max_vehicles = max_vehicles
-        self.num_nodes = len(distance_matrix)
+        super().__init__(distance_matrix, demands, depot, vehicle_capacity, max_vehicles, cancel_event,
+                         persist_preprocessing)
         
         # SA parameters
         self.initial_temperature = initial_temperature
@@ -37,68 +270,137 @@ class CVRP_SimulatedAnnealing:
         self.max_iterations = max_iterations
         self.iterations_per_temp = iterations_per_temp
         
+        # Acceptance rule of the move loop (Metropolis unless another criterion is chosen)
+        if isinstance(acceptance, AcceptanceCriterion):
+            self.acceptance = acceptance
+        else:
+            self.acceptance = make_acceptance(
+                acceptance or 'metropolis',
+                initial_temperature=initial_temperature,
+                final_temperature=final_temperature,
+                cooling_rate=cooling_rate,
+                **(acceptance_params or {})
+            )
+        
+        # Opt-in move trace
+        self.trace_path = trace_path
+        self.trace_capacity = trace_capacity
+        self.last_move = ('none', -1, -1)
+        
+        # Time windows (VRPTW); None keeps the plain capacity-only model
+        if time_windows is not None:
+            self.time_windows = TimeWindowData(
+                time_windows,
+                duration_matrix if duration_matrix is not None else self.distance_matrix,
+                depot,
+                service_times
+            )
+        else:
+            self.time_windows = None
+        
+        # Route distance / duration limits (per vehicle, i.e. per route position)
+        self.max_route_distances = self._vehicle_limits(max_route_distance)
+        self.max_route_durations = self._vehicle_limits(max_route_duration)
+        
+        # Uniform limits can be checked per move; per-vehicle ones depend on route positions
+        self.uniform_route_limits = all(
+            limits is None or len(set(limits)) == 1
+            for limits in (self.max_route_distances, self.max_route_durations)
+        )
+        self.has_route_constraints = (self.time_windows is not None or
+                                      self.max_route_distances is not None or
+                                      self.max_route_durations is not None)
+        
+        # Cached per-route loads, time window segments and distance/duration prefix sums
+        duration_source = duration_matrix if duration_matrix is not None else self.distance_matrix
+        self.route_states = RouteStateCache(
+            demands,
+            self.time_windows,
+            distance_matrix=(lookup_rows(self.distance_matrix, 'route distance limits')
+                             if self.max_route_distances is not None else None),
+            duration_matrix=(lookup_rows(duration_source, 'route duration limits')
+                             if self.max_route_durations is not None and self.time_windows is None else None),
+            service_times=service_times,
+            depot=depot
+        )
+        self._empty_state = self.route_states.build([])
+        
         # Solution tracking
         self.current_solution = None
-        self.best_solution = None
         self.current_cost = float('inf')
-        self.best_cost = float('inf')
+        self.current_violation = 0.0
+        self.best_violation = 0.0
         
-        # History for convergence plots
-        self.cost_history = []
-        self.temp_history = []
+        # Pool of diverse good solutions returned as alternatives
+        self.elite_pool = ElitePool(depot, elite_pool_size, elite_min_distance) if elite_pool_size > 0 else None
         
         # Initialize a solution
-        self.initialize_solution()
+        if initial_solution is not None:
+            self.set_solution(initial_solution)
+        else:
+            self.initialize_solution()
     
     def initialize_solution(self):
         """Generate an initial feasible solution using a greedy approach"""
         customers = list(range(self.num_nodes))
         customers.remove(self.depot)
         
-        # Sort customers by distance from depot (farthest first)
-        customers.sort(key=lambda x: -self.distance_matrix[self.depot][x])
-        
-        # Initialize routes
-        routes = []
-        current_route = []
-        current_load = 0
-        remaining_customers = customers.copy()
-        
-        while remaining_customers:
-            # Get next customer
-            customer = remaining_customers.pop(0)
-            customer_demand = self.demands[customer]
+        # Sort customers by distance from depot (farthest first, cached per instance),
+        # or by the end of their time window when time windows are used
+        if self.time_windows is not None:
+            customers.sort(key=lambda x: self.time_windows.windows[x][1])
+        else:
+            customers = self.preprocessing.depot_order.tolist()
+        
+        # Capacity-only problems: cut the whole order optimally with Split
+        if not self.has_route_constraints:
+            routes = self.split_giant_tour(customers)
+        else:
+            # Initialize routes
+            routes = []
+            current_route = []
+            current_load = 0
+            remaining_customers = customers.copy()
+        
+            while remaining_customers:
+                # Get next customer
+                customer = remaining_customers.pop(0)
+                customer_demand = self.demands[customer]
             
-            # If adding this customer exceeds capacity, start a new route
-            if current_load + customer_demand > self.vehicle_capacity:
-                if current_route:  # Only add non-empty routes
-                    routes.append(current_route)
+                # Check time windows and route distance/duration limits
+                over_limit = False
+                if self.has_route_constraints and current_route:
+                    over_limit = self.route_violation(current_route + [customer], len(routes)) > 0
+            
+                # If adding this customer exceeds capacity (or another route constraint), start a new route
+                if current_load + customer_demand > self.vehicle_capacity or over_limit:
+                    if current_route:  # Only add non-empty routes
+                        routes.append(current_route)
                 
-                # Check if we've reached the max number of vehicles
-                if len(routes) >= self.max_vehicles - 1:
-                    # Force all remaining customers into last route
-                    last_route = []
-                    for c in [customer] + remaining_customers:
-                        last_route.append(c)
-                    
-                    if last_route:
-                        routes.append(last_route)
-                    
-                    # Clear remaining customers
-                    remaining_customers = []
-                    break
+                    # Check if we've reached the max number of vehicles
+                    if len(routes) >= self.max_vehicles - 1:
+                        # All remaining customers go into the last route, unless that would
+                        # overload it - then Split re-cuts the whole order within the fleet
+                        last_route = [customer] + remaining_customers
+                        if self.calculate_route_load(last_route) > self.vehicle_capacity:
+                            routes = self.split_giant_tour(customers)
+                        else:
+                            routes.append(last_route)
+                        
+                        current_route = []
+                        break
+                    else:
+                        # Start a new route with this customer
+                        current_route = [customer]
+                        current_load = customer_demand
                 else:
-                    # Start a new route with this customer
-                    current_route = [customer]
-                    current_load = customer_demand
-            else:
-                # Add customer to current route
-                current_route.append(customer)
-                current_load += customer_demand
+                    # Add customer to current route
+                    current_route.append(customer)
+                    current_load += customer_demand
         
-        # Add the last route if not empty and not already added
-        if current_route and (not routes or current_route != routes[-1]):
-            routes.append(current_route)
+            # Add the last route if not empty and not already added
+            if current_route and (not routes or current_route != routes[-1]):
+                routes.append(current_route)
         
         # Verify solution validity
         if not self.is_valid_solution(routes):
@@ -108,8 +410,20 @@ class CVRP_SimulatedAnnealing:
             
         self.current_solution = routes
         self.current_cost = self.calculate_total_distance(routes)
+        self.current_violation = self.calculate_violation(routes)
         self.best_solution = copy.deepcopy(routes)
         self.best_cost = self.current_cost
+        self.best_violation = self.current_violation
+    
+    def set_solution(self, routes):
+        """Start the search from the given routes"""
+        routes = [list(route) for route in routes if route]
+        self.current_solution = routes
+        self.current_cost = self.calculate_total_distance(routes)
+        self.current_violation = self.calculate_violation(routes)
+        self.best_solution = copy.deepcopy(routes)
+        self.best_cost = self.current_cost
+        self.best_violation = self.current_violation
     
     def initialize_fallback_solution(self, customers):
         """Fallback solution in case the main approach fails"""
@@ -139,54 +453,87 @@ class CVRP_SimulatedAnnealing:
             if route:  # Only add non-empty routes
                 routes.append(route)
         
-        # If we still have remaining customers, force them into the last route
-        if remaining and routes:
-            routes[-1].extend(remaining)
-        elif remaining:
-            routes.append(remaining)
+        # If the packing ran out of vehicles, cut the original order with Split
+        # (overload, if any, is minimized and spread instead of piling onto the last route)
+        if remaining:
+            routes = self.split_giant_tour(customers)
         
         self.current_solution = routes
         self.current_cost = self.calculate_total_distance(routes)
+        self.current_violation = self.calculate_violation(routes)
         self.best_solution = copy.deepcopy(routes)
         self.best_cost = self.current_cost
+        self.best_violation = self.current_violation
     
-    def is_valid_solution(self, routes):
-        """Check if a solution is valid (no duplicates, all customers served)"""
-        # Get all customers in the solution
-        all_customers = []
-        for route in routes:
-            all_customers.extend(route)
+    def calculate_violation(self, routes):
+        """
+        Total route constraint violation of a solution: time warp plus distance and
+        duration in excess of each vehicle's limit (0 without such constraints)
+        """
+        if not self.has_route_constraints:
+            return 0.0
+        return sum(self._state_violation(self.route_states.get(route), vehicle)
+                   for vehicle, route in enumerate(routes))
+    
+    def route_violation(self, route, vehicle=0):
+        """Constraint violation of a single route driven by the given vehicle"""
+        return self._state_violation(self.route_states.build(route), vehicle)
+    
+    def _vehicle_limits(self, limit):
+        """Normalize a scalar or per-vehicle route limit into a list (None entries mean unlimited)"""
+        if limit is None:
+            return None
+        if np.isscalar(limit):
+            return [float(limit)] * self.max_vehicles
+        return [float('inf') if value is None else float(value) for value in limit]
+    
+    def _limit(self, limits, vehicle):
+        return limits[min(vehicle, len(limits) - 1)]
+    
+    def _state_violation(self, state, vehicle=0, recipe=None):
+        """
+        Constraint violation of a cached route, or - given a recipe - of the route
+        the recipe builds from it. O(1) with a recipe, since every measure is joined
+        from cached prefix/suffix segments.
+        """
+        violation = 0.0
+        duration = None
         
-        # Check for duplicates
-        customer_counts = Counter(all_customers)
-        has_duplicates = any(count > 1 for count in customer_counts.values())
+        if state.time is not None:
+            segment = state.time.join(*recipe(state.time)) if recipe else state.time.total
+            violation += segment[3]
+            duration = segment[2]
+        elif state.duration is not None:
+            duration = state.duration.join(*recipe(state.duration)) if recipe else state.duration.total
         
-        # Check if all customers are served
-        customers = set(range(self.num_nodes))
-        customers.remove(self.depot)
-        all_served = all(customer in all_customers for customer in customers)
+        if self.max_route_durations is not None:
+            violation += max(0.0, duration - self._limit(self.max_route_durations, vehicle))
         
-        return not has_duplicates and all_served
-    
-    def calculate_route_distance(self, route):
-        """Calculate the total distance of a single route"""
-        if not route:
-            return 0
-            
-        distance = self.distance_matrix[self.depot][route[0]]
-        for i in range(len(route) - 1):
-            distance += self.distance_matrix[route[i]][route[i + 1]]
-        distance += self.distance_matrix[route[-1]][self.depot]
+        if state.distance is not None:
+            distance = state.distance.join(*recipe(state.distance)) if recipe else state.distance.total
+            violation += max(0.0, distance - self._limit(self.max_route_distances, vehicle))
         
-        return distance
-    
-    def calculate_total_distance(self, routes):
-        """Calculate the total distance of all routes"""
-        return sum(self.calculate_route_distance(route) for route in routes)
+        return violation
     
-    def calculate_route_load(self, route):
-        """Calculate the total demand of a route"""
-        return sum(self.demands[customer] for customer in route)
+    def _changes_allowed(self, changes):
+        """
+        Check time windows and route limits for a move, given as (state, recipe)
+        pairs for each changed route (recipe None for a route that becomes empty).
+        A move may not increase the total violation of the routes it touches, so
+        feasible solutions stay feasible and infeasible starts can only improve.
+        Per-vehicle limits are re-checked on the whole neighbor instead, since
+        they depend on route positions.
+        """
+        if not self.has_route_constraints or not self.uniform_route_limits:
+            return True
+        
+        before = after = 0.0
+        for state, recipe in changes:
+            if state is not None:
+                before += self._state_violation(state)
+            if recipe is not None:
+                after += self._state_violation(state or self._empty_state, recipe=recipe)
+        return after <= before + 1e-9
     
     def generate_neighbor(self):
         """Generate a neighboring solution by performing one of several move operations"""
@@ -196,12 +543,17 @@ class CVRP_SimulatedAnnealing:
         while attempts < max_attempts:
             attempts += 1
             
-            # Create a deep copy of the current solution
-            neighbor = copy.deepcopy(self.current_solution)
+            # Shallow copy: routes are shared with the current solution and only the
+            # ones a move changes are copied, so unchanged routes keep their cached state
+            neighbor = list(self.current_solution)
+            
+            # Move type and the two nodes involved, for the move trace
+            move = ('none', -1, -1)
             
             # If we have an empty solution, initialize it
             if not neighbor or all(len(route) == 0 for route in neighbor):
                 self.initialize_solution()
+                self.last_move = move
                 return copy.deepcopy(self.current_solution)
             
             # Randomly select a move operation
@@ -213,8 +565,20 @@ class CVRP_SimulatedAnnealing:
                     # Intra-route swap
                     route_idx = random.choice([i for i, route in enumerate(neighbor) if len(route) >= 2])
                     route = neighbor[route_idx]
-                    i, j = random.sample(range(len(route)), 2)
+                    i, j = sorted(random.sample(range(len(route)), 2))
+                    
+                    # Check time windows and route limits
+                    if self.has_route_constraints:
+                        if j > i + 1:
+                            recipe = lambda c: (c.prefix(i), c.at(j), c.inner(i + 1, j - 1), c.at(i), c.suffix(j + 1))
+                        else:
+                            recipe = lambda c: (c.prefix(i), c.at(j), c.at(i), c.suffix(j + 1))
+                        if not self._changes_allowed([(self.route_states.get(route), recipe)]):
+                            continue  # Skip this attempt
+                    
+                    route = neighbor[route_idx] = list(route)
                     route[i], route[j] = route[j], route[i]
+                    move = ('swap', route[i], route[j])
                 else:
                     # Inter-route swap
                     if len(neighbor) < 2:
@@ -232,19 +596,31 @@ class CVRP_SimulatedAnnealing:
                     customer_j_idx = random.randrange(len(neighbor[j]))
                     
                     # Check capacity constraints
-                    route_i_load = self.calculate_route_load(neighbor[i])
-                    route_j_load = self.calculate_route_load(neighbor[j])
+                    state_i = self.route_states.get(neighbor[i])
+                    state_j = self.route_states.get(neighbor[j])
                     
                     customer_i = neighbor[i][customer_i_idx]
                     customer_j = neighbor[j][customer_j_idx]
                     
-                    new_route_i_load = route_i_load - self.demands[customer_i] + self.demands[customer_j]
-                    new_route_j_load = route_j_load - self.demands[customer_j] + self.demands[customer_i]
+                    new_route_i_load = state_i.load - self.demands[customer_i] + self.demands[customer_j]
+                    new_route_j_load = state_j.load - self.demands[customer_j] + self.demands[customer_i]
                     
                     if (new_route_i_load <= self.vehicle_capacity and 
                         new_route_j_load <= self.vehicle_capacity):
+                        # Check time windows and route limits
+                        if self.has_route_constraints and not self._changes_allowed([
+                            (state_i, lambda c: (c.prefix(customer_i_idx), c.customer(customer_j),
+                                                 c.suffix(customer_i_idx + 1))),
+                            (state_j, lambda c: (c.prefix(customer_j_idx), c.customer(customer_i),
+                                                 c.suffix(customer_j_idx + 1)))
+                        ]):
+                            continue  # Skip this attempt
+                        
                         # Swap the customers
+                        neighbor[i] = list(neighbor[i])
+                        neighbor[j] = list(neighbor[j])
                         neighbor[i][customer_i_idx], neighbor[j][customer_j_idx] = neighbor[j][customer_j_idx], neighbor[i][customer_i_idx]
+                        move = ('swap', customer_i, customer_j)
             
             elif move_type == "relocate" and len(neighbor) >= 1:
                 # Move a customer from one route to another
@@ -267,16 +643,31 @@ class CVRP_SimulatedAnnealing:
                 customer_idx = random.randrange(len(source_route))
                 customer = source_route[customer_idx]
                 
+                # Source route once the customer is removed
+                source_state = self.route_states.get(source_route)
+                source_recipe = None
+                if len(source_route) > 1:
+                    source_recipe = lambda c: (c.prefix(customer_idx), c.suffix(customer_idx + 1))
+                
                 # Determine if we should create a new route or use an existing one
                 create_new_route = (len(neighbor) < self.max_vehicles) and (random.random() < 0.3)
                 
                 if create_new_route:
+                    # Check time windows and route limits
+                    if self.has_route_constraints and not self._changes_allowed([
+                        (source_state, source_recipe),
+                        (None, lambda c: (c.depot_segment(), c.customer(customer), c.depot_segment()))
+                    ]):
+                        continue  # Skip this attempt
+                    
                     # Create a new route with just this customer
                     new_route = [customer]
                     # Remove customer from source route
+                    source_route = neighbor[source_idx] = list(source_route)
                     source_route.pop(customer_idx)
                     # Add the new route
                     neighbor.append(new_route)
+                    move = ('relocate_new', customer, -1)
                 else:
                     # Select a target route (different from source route)
                     available_targets = list(range(len(neighbor)))
@@ -290,16 +681,42 @@ class CVRP_SimulatedAnnealing:
                     target_route = neighbor[target_idx]
                     
                     # Check if capacity would be exceeded
-                    target_load = self.calculate_route_load(target_route)
-                    if target_load + self.demands[customer] > self.vehicle_capacity:
+                    target_state = source_state if target_idx == source_idx else self.route_states.get(target_route)
+                    if target_idx != source_idx and target_state.load + self.demands[customer] > self.vehicle_capacity:
                         continue  # Skip this attempt
                     
-                    # Remove customer from source route
-                    source_route.pop(customer_idx)
-                    
                     # Insert customer into target route at random position
                     insert_pos = random.randint(0, len(target_route))
-                    target_route.insert(insert_pos, customer)
+                    
+                    if target_idx == source_idx:
+                        # Single-route solution: move the customer within its route
+                        if self.has_route_constraints:
+                            moved = list(target_route)
+                            moved.pop(customer_idx)
+                            moved.insert(insert_pos, customer)
+                            if self.route_violation(moved) > self._state_violation(source_state) + 1e-9:
+                                continue  # Skip this attempt
+                        
+                        source_route = neighbor[source_idx] = list(source_route)
+                        source_route.pop(customer_idx)
+                        source_route.insert(insert_pos, customer)
+                        move = ('relocate', customer, source_route[insert_pos - 1] if insert_pos > 0 else self.depot)
+                    else:
+                        # Check time windows and route limits
+                        if self.has_route_constraints and not self._changes_allowed([
+                            (source_state, source_recipe),
+                            (target_state, lambda c: (c.prefix(insert_pos), c.customer(customer),
+                                                      c.suffix(insert_pos)))
+                        ]):
+                            continue  # Skip this attempt
+                        
+                        # Remove customer from source route
+                        source_route = neighbor[source_idx] = list(source_route)
+                        source_route.pop(customer_idx)
+                        
+                        target_route = neighbor[target_idx] = list(target_route)
+                        target_route.insert(insert_pos, customer)
+                        move = ('relocate', customer, target_route[insert_pos - 1] if insert_pos > 0 else self.depot)
             
             elif move_type == "2opt" and any(len(route) >= 3 for route in neighbor):
                 # Perform 2-opt move (reverse a segment within a route)
@@ -313,8 +730,17 @@ class CVRP_SimulatedAnnealing:
                 # Select two positions for reversal
                 i, j = sorted(random.sample(range(len(route)), 2))
                 
+                # Check time windows and route limits
+                if self.has_route_constraints and not self._changes_allowed([
+                    (self.route_states.get(route),
+                     lambda c: (c.prefix(i), c.reversed_inner(i, j), c.suffix(j + 1)))
+                ]):
+                    continue  # Skip this attempt
+                
                 # Reverse the segment
+                route = neighbor[route_idx] = list(route)
                 route[i:j+1] = reversed(route[i:j+1])
+                move = ('2opt', route[i], route[j])
             
             elif move_type == "route_swap" and len(neighbor) >= 2:
                 # Swap two entire routes
@@ -323,17 +749,25 @@ class CVRP_SimulatedAnnealing:
                 
                 i, j = random.sample(range(len(neighbor)), 2)
                 neighbor[i], neighbor[j] = neighbor[j], neighbor[i]
+                move = ('route_swap', -1, -1)
             
             # Clean up empty routes
             neighbor = [route for route in neighbor if route]
             
+            # Per-vehicle limits depend on route positions, so check the whole neighbor
+            if (self.has_route_constraints and not self.uniform_route_limits and
+                    self.calculate_violation(neighbor) > self.current_violation + 1e-9):
+                continue  # Skip this attempt
+            
             # Validate the solution (no duplicates, all customers served)
             if self.is_valid_solution(neighbor):
+                self.last_move = move
                 return neighbor
         
         # If we couldn't generate a valid neighbor after max attempts
         # Return the current solution as a fallback
-        return copy.deepcopy(self.current_solution)
+        self.last_move = ('none', -1, -1)
+        return list(self.current_solution)
     
     def solve(self, callback=None):
         """
@@ -348,51 +782,101 @@ class CVRP_SimulatedAnnealing:
         - cost_history: List of best costs at each temperature
         - temp_history: List of temperatures
         """
-        temperature = self.initial_temperature
-        iteration = 0
-        
         # Ensure we start with a valid solution
         if not self.is_valid_solution(self.current_solution):
             customers = list(range(self.num_nodes))
             customers.remove(self.depot)
             self.initialize_fallback_solution(customers)
         
+        acceptance = self.acceptance
+        acceptance.start(self.current_cost)
+        temperature = acceptance.temperature
+        
+        # Opt-in move trace (closed in the finally below)
+        trace = TraceRecorder(self.trace_path, capacity=self.trace_capacity) if self.trace_path else None
+        try:
+            self._anneal(acceptance, temperature, trace, callback)
+        finally:
+            if trace is not None:
+                trace.close()
+        
+        # Final validation of best solution
+        if not self.is_valid_solution(self.best_solution):
+            print("Warning: Final solution validation failed. Attempting repair.")
+            self.best_solution = self.repair_solution(self.best_solution)
+            self.best_cost = self.calculate_total_distance(self.best_solution)
+        
+        return self.best_solution, self.best_cost, self.cost_history, self.temp_history
+    
+    def _anneal(self, acceptance, temperature, trace, callback):
+        """Main loop of solve(): propose, accept or reject, cool down"""
+        iteration = 0
+        step = 0
+        
+        # The starting solution is the first elite candidate
+        if self.elite_pool is not None and self.current_violation <= 1e-9:
+            self.elite_pool.consider(self.current_solution, self.current_cost)
+        
         # Record initial state
         self.cost_history.append(self.best_cost)
         self.temp_history.append(temperature)
         
-        # Main loop - continue until final temperature or max iterations
-        while temperature > self.final_temperature and iteration < self.max_iterations:
+        # Main loop - continue until the acceptance schedule ends (final temperature) or max iterations
+        while not acceptance.finished() and iteration < self.max_iterations:
             iteration += 1
             
             # Perform several iterations at each temperature
             for inner_iter in range(self.iterations_per_temp):
+                # Stop as soon as cancellation is requested, keeping the best so far
+                if self.is_cancel_requested():
+                    break
+                
                 # Generate a neighboring solution
                 neighbor = self.generate_neighbor()
                 
                 # Calculate the cost of the new solution
                 neighbor_cost = self.calculate_total_distance(neighbor)
                 
-                # Calculate cost difference
-                delta_cost = neighbor_cost - self.current_cost
+                # Accept the new solution according to the acceptance criterion
+                accepted = acceptance.accept(self.current_cost, neighbor_cost)
+                if trace is not None:
+                    step += 1
+                    trace.record(step, *self.last_move, neighbor_cost - self.current_cost, accepted, temperature)
                 
-                # Accept the new solution if it's better or with a probability
-                if delta_cost < 0 or random.random() < math.exp(-delta_cost / temperature):
+                if accepted:
                     self.current_solution = neighbor
                     self.current_cost = neighbor_cost
                     
-                    # Update best solution if current is better
-                    if self.current_cost < self.best_cost:
+                    # Forget cached states of routes that left the solution
+                    if len(self.route_states) > 4 * len(neighbor) + 16:
+                        self.route_states.prune(neighbor)
+                    
+                    # Moves never increase the violation, so it only needs recomputing here
+                    if self.has_route_constraints:
+                        self.current_violation = self.calculate_violation(neighbor)
+                    
+                    # Update best solution if current is better (less violation first)
+                    if ((self.current_violation, self.current_cost) <
+                            (self.best_violation, self.best_cost)):
                         self.best_solution = copy.deepcopy(self.current_solution)
                         self.best_cost = self.current_cost
+                        self.best_violation = self.current_violation
+                    
+                    # Offer feasible solutions to the elite pool
+                    if self.elite_pool is not None and self.current_violation <= 1e-9:
+                        self.elite_pool.consider(self.current_solution, self.current_cost)
                 
                 # Call callback if provided
                 if callback and inner_iter % 10 == 0:  # Reduce callback frequency to avoid overhead
                     progress = min(100, int((iteration / self.max_iterations) * 100))
                     callback(iteration, inner_iter, temperature, self.best_cost, progress)
             
-            # Cool down the temperature
-            temperature *= self.cooling_rate
+            if self.cancelled:
+                break
+            
+            # Cool down the temperature (or the criterion's own control value)
+            acceptance.step()
+            temperature = acceptance.temperature
             
             # Record history
             self.cost_history.append(self.best_cost)
@@ -402,13 +886,6 @@ class CVRP_SimulatedAnnealing:
             if callback:
                 progress = min(100, int((iteration / self.max_iterations) * 100))
                 callback(iteration, self.iterations_per_temp, temperature, self.best_cost, progress)
-        
-        # Final validation of best solution
-        if not self.is_valid_solution(self.best_solution):
-            print("Warning: Final solution validation failed. Attempting repair.")
-            self.repair_solution(self.best_solution)
-        
-        return self.best_solution, self.best_cost, self.cost_history, self.temp_history
     
     def repair_solution(self, solution):
         """Attempt to repair an invalid solution by removing duplicates and reassigning missing customers"""
@@ -460,50 +937,44 @@ class CVRP_SimulatedAnnealing:
                 best_route.append(customer)
         
         # Clean up empty routes
-        return [route for route in solution if route]
-    
-    def get_solution_details(self, company_names=None):
-        """
-        Get detailed information about the solution
+        solution = [route for route in solution if route]
         
-        Parameters:
-        - company_names: Optional list of names for each node
+        # Still overloaded or too many routes: re-split the routes' concatenated order
+        if (len(solution) > self.max_vehicles or
+                any(self.calculate_route_load(route) > self.vehicle_capacity for route in solution)):
+            solution = self.split_giant_tour([customer for route in solution for customer in route])
         
-        Returns:
-        - Dictionary with solution details
-        """
-        routes = self.best_solution
-        total_distance = self.best_cost
-        
-        solution_details = {
-            'total_distance': total_distance,
-            'routes': []
-        }
-        
-        for i, route in enumerate(routes):
-            route_demand = self.calculate_route_load(route)
-            route_distance = self.calculate_route_distance(route)
-            
-            route_with_depot = [self.depot] + route + [self.depot]
-            
-            # Use company names if available
-            if company_names:
-                route_display = [
-                    {'index': node, 'name': company_names[node]} 
-                    for node in route_with_depot
-                ]
-            else:
-                route_display = [
-                    {'index': node, 'name': f"Node {node}"} 
-                    for node in route_with_depot
-                ]
-                
-            solution_details['routes'].append({
-                'id': i + 1,
-                'stops': route_display,
-                'load': route_demand,
-                'capacity': self.vehicle_capacity,
-                'distance': route_distance
-            })
-        
-        return solution_details
\ No newline at end of file
+        return solution
+    
+    def _extra_route_details(self, route, index):
+        """Extra per-route fields for get_solution_details"""
+        route_details = {}
+        
+        # Service start times and lateness when time windows are used
+        if self.time_windows is not None:
+            start_times, lateness = self.time_windows.route_schedule(route)
+            route_details['start_times'] = start_times
+            route_details['lateness'] = lateness
+        
+        # Route duration and this vehicle's limits when route limits are used
+        state = self.route_states.build(route)
+        if state.time is not None:
+            route_details['duration'] = state.time.total[2]
+        elif state.duration is not None:
+            route_details['duration'] = state.duration.total
+        if self.max_route_durations is not None:
+            route_details['max_duration'] = self._limit(self.max_route_durations, index)
+        if self.max_route_distances is not None:
+            route_details['max_distance'] = self._limit(self.max_route_distances, index)
+        
+        return route_details
+    
+    def _extra_solution_details(self, routes):
+        """Extra solution-level fields for get_solution_details"""
+        solution_details = {}
+        if self.time_windows is not None:
+            solution_details['time_window_violation'] = sum(
+                self.time_windows.route_schedule(route)[1] for route in routes)
+        if self.has_route_constraints:
+            solution_details['constraint_violation'] = self.calculate_violation(routes)
+        return solution_details
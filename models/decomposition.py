@@ -0,0 +1,202 @@
+"""
+Sweep decomposition for large CVRP instances.
+
+Customers are ordered by their polar angle around the depot and cut into
+sectors of roughly `cluster_size` customers. Each sector is solved as an
+independent small CVRP with simulated annealing on its own sub-matrix, and
+the sector routes are joined and polished with a 2-opt pass per route.
+Every sub-problem is small, so the search time grows about linearly with
+the number of customers instead of the SA neighbourhood slowing down on one
+huge solution.
+"""
+
+import math
+import numpy as np
+from models.cvrp import CVRPSolverBase, CVRP_SimulatedAnnealing
+
+
+def two_opt_route(distance_matrix, depot, route):
+    """
+    Improve a single route with first-improvement 2-opt
+
+    Parameters:
+    - distance_matrix: 2D array of distances
+    - depot: Index of the depot node
+    - route: List of customer indices (depot excluded)
+
+    Returns:
+    - The improved route (a new list)
+    """
+    tour = [depot] + list(route) + [depot]
+    improved = True
+    while improved:
+        improved = False
+
+        # Forward / backward arc sums, so reversals are priced correctly on asymmetric matrices
+        forward = [0.0]
+        backward = [0.0]
+        for a, b in zip(tour, tour[1:]):
+            forward.append(forward[-1] + distance_matrix[a][b])
+            backward.append(backward[-1] + distance_matrix[b][a])
+
+        for i in range(1, len(tour) - 2):
+            for j in range(i + 1, len(tour) - 1):
+                a, b = tour[i - 1], tour[i]
+                c, d = tour[j], tour[j + 1]
+                delta = (distance_matrix[a][c] + distance_matrix[b][d] -
+                         distance_matrix[a][b] - distance_matrix[c][d] +
+                         (backward[j] - backward[i]) - (forward[j] - forward[i]))
+                if delta < -1e-9:
+                    tour[i:j + 1] = reversed(tour[i:j + 1])
+                    improved = True
+                    break
+            if improved:
+                break
+    return tour[1:-1]
+
+
+class CVRP_SweepDecomposition(CVRPSolverBase):
+    def __init__(self, distance_matrix, demands, depot, vehicle_capacity, coordinates,
+                 max_vehicles=5, cancel_event=None, cluster_size=100, sa_params=None):
+        """
+        Initialize the sweep decomposition solver
+
+        Parameters:
+        - distance_matrix: 2D array of distances between nodes
+        - demands: Array of customer demands (demand[depot] should be 0)
+        - depot: Index of the depot node
+        - vehicle_capacity: Maximum capacity of each vehicle
+        - coordinates: List of (x, y) or (lat, lng) per node, used for the angular sweep
+        - max_vehicles: Maximum number of vehicles (routes) over all sectors
+        - cancel_event: Optional threading.Event (checked by every sector solve)
+        - cluster_size: Target number of customers per sector
+        - sa_params: Optional keyword arguments for the per-sector SA solver
+        """
+        super().__init__(distance_matrix, demands, depot, vehicle_capacity, max_vehicles, cancel_event)
+        self.coordinates = coordinates
+        self.cluster_size = max(1, int(cluster_size))
+        self.sa_params = dict(sa_params or {})
+
+    def sweep_sectors(self):
+        """Split the customers into angular sectors around the depot"""
+        depot_x, depot_y = self.coordinates[self.depot][:2]
+        customers = sorted(
+            self.customers(),
+            key=lambda c: math.atan2(self.coordinates[c][1] - depot_y, self.coordinates[c][0] - depot_x)
+        )
+        if not customers:
+            return []
+
+        # Start the sweep after the widest angular gap so no natural cluster is cut in two
+        angles = [math.atan2(self.coordinates[c][1] - depot_y, self.coordinates[c][0] - depot_x) for c in customers]
+        gaps = [(angles[(k + 1) % len(angles)] - angles[k]) % (2 * math.pi) for k in range(len(angles))]
+        start = (int(np.argmax(gaps)) + 1) % len(customers)
+        customers = customers[start:] + customers[:start]
+
+        num_sectors = max(1, round(len(customers) / self.cluster_size))
+        return [list(sector) for sector in np.array_split(customers, num_sectors) if len(sector)]
+
+    def _sector_vehicles(self, sectors):
+        """
+        Share the fleet between sectors in proportion to their load
+        
+        Every sector gets at least what its load needs by capacity; the rest of the
+        fleet is handed out by largest remainder, so the total never exceeds max_vehicles.
+        
+        Raises:
+        - ValueError if the sectors' capacity minimums alone exceed the fleet
+        """
+        loads = [sum(self.demands[c] for c in sector) for sector in sectors]
+        total_load = sum(loads) or 1
+        needed = [max(1, math.ceil(load / self.vehicle_capacity)) for load in loads]
+        spare = self.max_vehicles - sum(needed)
+        if spare < 0:
+            raise ValueError(f"Sectors need at least {sum(needed)} vehicles, the fleet has {self.max_vehicles}")
+        
+        # Proportional shares above the minimums, scaled down to the spare vehicles
+        extra = [max(0.0, self.max_vehicles * load / total_load - minimum) for load, minimum in zip(loads, needed)]
+        total_extra = sum(extra)
+        if total_extra > spare:
+            extra = [share * spare / total_extra for share in extra]
+        
+        vehicles = [minimum + math.floor(share) for minimum, share in zip(needed, extra)]
+        leftover = min(spare, round(sum(extra))) - sum(math.floor(share) for share in extra)
+        by_remainder = sorted(range(len(sectors)), key=lambda k: extra[k] - math.floor(extra[k]), reverse=True)
+        for k in by_remainder[:max(0, leftover)]:
+            vehicles[k] += 1
+        return vehicles
+
+    def solve(self, callback=None):
+        """
+        Solve every sector, then polish the joined routes
+
+        Parameters:
+        - callback: Optional progress function, same signature as the SA callback
+
+        Returns:
+        - best_solution, best_cost, cost_history, temp_history (as for the SA solver)
+        
+        Raises:
+        - ValueError if the sectors cannot be served within max_vehicles
+        """
+        sectors = self.sweep_sectors()
+        vehicles = self._sector_vehicles(sectors)
+
+        routes = []
+        for index, (sector, sector_vehicles) in enumerate(zip(sectors, vehicles)):
+            if self.is_cancel_requested():
+                # Unsolved sectors keep a simple capacity-split order so every customer is served
+                routes.extend(self._greedy_routes(sector))
+                continue
+
+            nodes = [self.depot] + sector
+            sub_matrix = np.asarray(self.distance_matrix[np.ix_(nodes, nodes)], dtype=np.float64)
+            sub_demands = [self.demands[node] for node in nodes]
+
+            sub_solver = CVRP_SimulatedAnnealing(
+                sub_matrix, sub_demands, 0, self.vehicle_capacity,
+                max_vehicles=sector_vehicles,
+                cancel_event=self.cancel_event,
+                persist_preprocessing=False,
+                **self.sa_params
+            )
+
+            def sector_progress(iteration, inner_iter, temperature, best_cost, progress, index=index):
+                if callback:
+                    overall = int((index * 100 + progress) / len(sectors))
+                    callback(iteration, inner_iter, temperature, best_cost, overall)
+
+            sub_routes, _, _, _ = sub_solver.solve(callback=sector_progress)
+            if sub_solver.cancelled:
+                self.cancelled = True
+
+            routes.extend([nodes[k] for k in route] for route in sub_routes if route)
+            self.cost_history.append(self.calculate_total_distance(routes))
+            self.temp_history.append(0.0)
+
+        # Local search on the joined solution
+        routes = [two_opt_route(self.distance_matrix, self.depot, route) for route in routes]
+
+        self.best_solution = routes
+        self.best_cost = self.calculate_total_distance(routes)
+        self.cost_history.append(self.best_cost)
+        self.temp_history.append(0.0)
+
+        if callback:
+            callback(len(sectors), 0, 0.0, self.best_cost, 100)
+
+        return self.best_solution, self.best_cost, self.cost_history, self.temp_history
+
+    def _greedy_routes(self, sector):
+        """Split a sector in sweep order whenever capacity runs out"""
+        routes = []
+        current_route, current_load = [], 0
+        for customer in sector:
+            if current_route and current_load + self.demands[customer] > self.vehicle_capacity:
+                routes.append(current_route)
+                current_route, current_load = [], 0
+            current_route.append(customer)
+            current_load += self.demands[customer]
+        if current_route:
+            routes.append(current_route)
+        return routes
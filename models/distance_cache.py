@@ -0,0 +1,206 @@
+"""
+Persistent element cache for Google Distance Matrix results.
+
+Most stops recur from day to day, so most origin/destination pairs of a new
+matrix were already paid for. Every element the API resolves is stored in a
+local SQLite database keyed by (rounded origin, rounded destination, travel
+mode), and the Google batcher only requests the pairs that are missing or
+older than the TTL.
+
+Coordinates are rounded to CACHE_COORDINATE_DECIMALS (5 decimals, about a
+meter), so the same address geocoded twice hits the same entry. The
+database runs in WAL mode: readers never block the writer, and several
+workers can share one file.
+"""
+
+import os
+import time
+import sqlite3
+import tempfile
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger('distance_cache')
+
+DISTANCE_CACHE_PATH = os.getenv('DISTANCE_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'cvrp_distance_cache.sqlite3'))
+DISTANCE_CACHE_TTL_SECONDS = int(os.getenv('DISTANCE_CACHE_TTL_SECONDS', 30 * 24 * 3600))
+DISTANCE_CACHE_ENABLED = os.getenv('DISTANCE_CACHE_ENABLED', '1') not in ('0', 'false', 'False')
+
+# Decimal places kept of lat/lng in cache keys (1e-5 degrees is about 1.1 m)
+CACHE_COORDINATE_DECIMALS = 5
+
+# Keys per IN (...) list, well below SQLite's bound-variable limit
+_QUERY_CHUNK = 400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS elements (
+    origin TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    distance REAL NOT NULL,
+    duration REAL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (origin, destination, mode)
+) WITHOUT ROWID
+"""
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+class DistanceCache:
+    """SQLite-backed cache of (origin, destination, mode) -> distance elements"""
+
+    def __init__(self, path=None, ttl_seconds=None, decimals=CACHE_COORDINATE_DECIMALS):
+        """
+        Parameters:
+        - path: SQLite database file (defaults to DISTANCE_CACHE_PATH)
+        - ttl_seconds: Age after which an element counts as missing (defaults to DISTANCE_CACHE_TTL_SECONDS)
+        - decimals: Decimal places of lat/lng kept in the keys
+        """
+        self.path = path or DISTANCE_CACHE_PATH
+        self.ttl_seconds = DISTANCE_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.decimals = decimals
+        self.hits = 0
+        self.misses = 0
+
+        # sqlite3 connections must stay in their thread; Flask serves requests from several
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(_SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def key(self, point):
+        """Cache key of a (lat, lng) point"""
+        return f"{float(point[0]):.{self.decimals}f},{float(point[1]):.{self.decimals}f}"
+
+    def lookup(self, origins, destinations, mode='driving', column='distance'):
+        """
+        Cached distances (or durations) between every origin and destination
+
+        Parameters:
+        - origins: List of (lat, lng) per matrix row
+        - destinations: List of (lat, lng) per matrix column
+        - mode: Travel mode
+        - column: 'distance' (meters) or 'duration' (seconds)
+
+        Returns:
+        - len(origins) x len(destinations) array of values, NaN where not cached (or expired)
+        """
+        if column not in ('distance', 'duration'):
+            raise ValueError(f"Unknown cache column '{column}'")
+        result = np.full((len(origins), len(destinations)), np.nan)
+        origin_rows = _positions([self.key(point) for point in origins])
+        destination_cols = _positions([self.key(point) for point in destinations])
+        cutoff = time.time() - self.ttl_seconds
+
+        origin_keys = list(origin_rows)
+        destination_keys = list(destination_cols)
+        try:
+            connection = self._connection()
+            for o in range(0, len(origin_keys), _QUERY_CHUNK):
+                origin_chunk = origin_keys[o:o + _QUERY_CHUNK]
+                for d in range(0, len(destination_keys), _QUERY_CHUNK):
+                    destination_chunk = destination_keys[d:d + _QUERY_CHUNK]
+                    query = (f"SELECT origin, destination, {column} FROM elements "
+                             f"WHERE mode = ? AND fetched_at >= ? "
+                             f"AND origin IN ({','.join('?' * len(origin_chunk))}) "
+                             f"AND destination IN ({','.join('?' * len(destination_chunk))})")
+                    for origin, destination, value in connection.execute(
+                            query, [mode, cutoff, *origin_chunk, *destination_chunk]):
+                        if value is not None:
+                            result[np.ix_(origin_rows[origin], destination_cols[destination])] = value
+        except sqlite3.Error as e:
+            logger.warning(f"Distance cache lookup failed, treating all pairs as missing: {str(e)}")
+            result[:] = np.nan
+
+        found = int(np.count_nonzero(~np.isnan(result)))
+        self.hits += found
+        self.misses += result.size - found
+        return result
+
+    def store(self, elements, mode='driving'):
+        """
+        Store resolved elements
+
+        Parameters:
+        - elements: Iterable of (origin (lat, lng), destination (lat, lng), distance, duration)
+        - mode: Travel mode
+
+        Returns:
+        - Number of elements written
+        """
+        now = time.time()
+        rows = [(self.key(origin), self.key(destination), mode, float(distance),
+                 None if duration is None else float(duration), now)
+                for origin, destination, distance, duration in elements]
+        if not rows:
+            return 0
+
+        try:
+            with self._connection() as connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO elements (origin, destination, mode, distance, duration, fetched_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not write {len(rows)} elements to the distance cache: {str(e)}")
+            return 0
+        return len(rows)
+
+    def purge_expired(self):
+        """Delete elements older than the TTL, returns the number removed"""
+        try:
+            with self._connection() as connection:
+                cursor = connection.execute("DELETE FROM elements WHERE fetched_at < ?",
+                                            (time.time() - self.ttl_seconds,))
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.warning(f"Could not purge the distance cache: {str(e)}")
+            return 0
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM elements").fetchone()[0]
+
+    def close(self):
+        """Close this thread's connection"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+def _positions(keys):
+    """Map every distinct key to the list of positions it occurs at (duplicate stops share a key)"""
+    positions = {}
+    for index, key in enumerate(keys):
+        positions.setdefault(key, []).append(index)
+    return positions
+
+
+def get_default_cache():
+    """The process-wide cache at DISTANCE_CACHE_PATH, or None when disabled or unavailable"""
+    global _default_cache
+    if not DISTANCE_CACHE_ENABLED:
+        return None
+
+    with _default_cache_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = DistanceCache()
+                _default_cache.purge_expired()
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Distance cache unavailable at {DISTANCE_CACHE_PATH}: {str(e)}")
+                return None
+        return _default_cache
@@ -1,21 +1,164 @@
 """
 Distance Matrix calculation module for CVRP Solver.
 Provides functions to calculate distance matrices using either:
-1. Simple Euclidean distance (straight-line)
-2. Google Maps Distance Matrix API (real-world travel distances)
+1. Straight-line metrics: Euclidean (coordinate units), haversine or
+   equirectangular (meters, coordinates as lat/lng degrees)
+2. Google Maps Distance Matrix API (real-world travel distances), fetched
+   concurrently under the API quota (models.google_matrix), with resolved
+   elements kept in a persistent cache (models.distance_cache)
+3. Local road networks (models.road_network): a CSR road graph searched
+   with Dijkstra, or a locally run OSRM table service
+
+compute_backend_distance_matrix picks one of these by name; further
+backends can be added with register_distance_backend.
+
+The straight-line metrics share one engine (compute_distance_matrix): whole
+blocks of rows are computed by broadcasting, with the block height chosen so
+the temporaries stay within DISTANCE_BLOCK_BYTES however large the matrix.
+
+Large matrices can be written to a disk-backed np.memmap instead of RAM,
+so several big jobs fit in one worker and other processes can read the
+same matrix through the OS page cache. Symmetric matrices can also be kept
+as a condensed (optionally integer-quantized) upper triangle.
 """
 
 import numpy as np
-import requests
 import time
 import os
+import uuid
+import tempfile
 import logging
-from math import ceil
+from models.distance_cache import get_default_cache
+from models.google_matrix import (fetch_google_batches, run_coroutine, plan_requests, estimate_requests,
+                                  MAX_ORIGINS)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('distance_matrix')
 
+# Largest value representable by quantized condensed storage
+QUANTIZED_MAX = np.iinfo(np.uint32).max
+
+# Memory-mapped storage settings
+MEMMAP_DIR = os.getenv('DISTANCE_MEMMAP_DIR', os.path.join(tempfile.gettempdir(), 'cvrp_distance_matrices'))
+MEMMAP_THRESHOLD_BYTES = int(os.getenv('DISTANCE_MEMMAP_THRESHOLD_BYTES', 256 * 1024 * 1024))
+MEMMAP_MAX_AGE_SECONDS = int(os.getenv('DISTANCE_MEMMAP_MAX_AGE_SECONDS', 24 * 3600))
+MEMMAP_BLOCK_BYTES = 64 * 1024 * 1024  # Scratch memory used per row block
+
+# Straight-line metrics of the distance engine
+METRICS = ('euclidean', 'haversine', 'equirectangular')
+EARTH_RADIUS_M = 6371000
+DISTANCE_BLOCK_BYTES = int(os.getenv('DISTANCE_BLOCK_BYTES', 8 * 1024 * 1024))  # Scratch memory per row block
+
+# Google results are road meters, so failed elements fall back to great-circle meters
+FALLBACK_METRIC = 'haversine'
+
+# Travel modes whose distances are near-symmetric: one direction per pair is requested by default
+SYMMETRIC_MODES = ('walking', 'bicycling')
+
+# Hybrid symmetry: reverse directions spot-checked per stop, and the relative difference
+# above which a stop's pairs are requested in both directions
+HYBRID_SAMPLE_NEIGHBORS = 2
+HYBRID_ASYMMETRY_THRESHOLD = 0.1
+
+# Travel times are in minutes, the unit of the time_window_start, time_window_end and
+# service_time columns. Pairs without a cached Google duration are driven at this speed.
+TRAVEL_SPEED_KMH = float(os.getenv('TRAVEL_SPEED_KMH', 40))
+
+# float64 temporaries of block size alive at once while computing a block, per metric
+_METRIC_TEMPORARIES = {'haversine': 3, 'equirectangular': 3}
+
+# Column layout of prepared geographic points: per-point trig values, so a
+# block needs only products (angle-difference identities) plus one arcsin
+_LAT, _LON, _COS_LAT, _SIN_HALF_LAT, _COS_HALF_LAT, _SIN_HALF_LON, _COS_HALF_LON = range(7)
+
+def _metric_block(origins, destinations, metric):
+    """
+    Distances from every origin to every destination, by broadcasting
+    
+    Parameters:
+    - origins, destinations: Points prepared by _metric_points
+    - metric: One of METRICS
+    
+    Returns:
+    - len(origins) x len(destinations) array
+    """
+    if metric == 'haversine':
+        o, d = origins.T[:, :, None], destinations.T[:, None, :]
+        # sin((b - a) / 2) = sin(b/2) cos(a/2) - cos(b/2) sin(a/2)
+        sin_dlat = d[_SIN_HALF_LAT] * o[_COS_HALF_LAT] - d[_COS_HALF_LAT] * o[_SIN_HALF_LAT]
+        sin_dlon = d[_SIN_HALF_LON] * o[_COS_HALF_LON] - d[_COS_HALF_LON] * o[_SIN_HALF_LON]
+        a = np.square(sin_dlat, out=sin_dlat)
+        np.square(sin_dlon, out=sin_dlon)
+        sin_dlon *= o[_COS_LAT] * d[_COS_LAT]
+        a += sin_dlon
+        np.clip(a, 0.0, 1.0, out=a)
+        return (2 * EARTH_RADIUS_M) * np.arcsin(np.sqrt(a, out=a), out=a)
+    
+    if metric == 'equirectangular':
+        # Flat-earth approximation around each pair's mean latitude, within
+        # 0.1% of haversine below ~100 km.
+        # cos((a + b) / 2) = cos(a/2) cos(b/2) - sin(a/2) sin(b/2)
+        o, d = origins.T[:, :, None], destinations.T[:, None, :]
+        x = d[_COS_HALF_LAT] * o[_COS_HALF_LAT] - d[_SIN_HALF_LAT] * o[_SIN_HALF_LAT]
+        x *= d[_LON] - o[_LON]
+        y = d[_LAT] - o[_LAT]
+        return EARTH_RADIUS_M * np.hypot(x, y, out=x)
+    
+    if metric == 'euclidean':
+        diff = origins[:, None, :] - destinations[None, :, :]
+        return np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+    
+    raise ValueError(f"Unknown distance metric '{metric}', expected one of {METRICS}")
+
+def _metric_points(coordinates, metric):
+    """Coordinates as the float array _metric_block expects for a metric"""
+    points = np.asarray(coordinates, dtype=np.float64)
+    if points.ndim == 1:
+        points = points.reshape(1, -1)
+    if metric == 'euclidean':
+        return points
+    if metric not in METRICS:
+        raise ValueError(f"Unknown distance metric '{metric}', expected one of {METRICS}")
+    
+    lat, lon = np.radians(points[:, 0]), np.radians(points[:, 1])
+    return np.column_stack([lat, lon, np.cos(lat), np.sin(lat / 2), np.cos(lat / 2),
+                            np.sin(lon / 2), np.cos(lon / 2)])
+
+def compute_distance_matrix(coordinates, metric='euclidean', destinations=None, out=None, dtype=np.float64):
+    """
+    Compute a straight-line distance matrix in bounded-memory row blocks
+    
+    Parameters:
+    - coordinates: List of (x, y) or (lat, lng) per node (the origins)
+    - metric: 'euclidean' (coordinate units), 'haversine' or 'equirectangular'
+      (meters, coordinates in degrees)
+    - destinations: Optional coordinates of the columns (default: the origins)
+    - out: Optional preallocated 2D array or memmap to fill
+    - dtype: dtype of the matrix when out is not given
+    
+    Returns:
+    - 2D numpy array (or out) of distances
+    """
+    origins = _metric_points(coordinates, metric)
+    columns = origins if destinations is None else _metric_points(destinations, metric)
+    num_rows, num_cols = len(origins), len(columns)
+    if out is None:
+        out = np.empty((num_rows, num_cols), dtype=dtype)
+    if num_rows == 0 or num_cols == 0:
+        return out
+    
+    temporaries = _METRIC_TEMPORARIES.get(metric, origins.shape[1] + 1)
+    block = max(1, DISTANCE_BLOCK_BYTES // (num_cols * 8 * temporaries))
+    for start in range(0, num_rows, block):
+        end = min(start + block, num_rows)
+        out[start:end] = _metric_block(origins[start:end], columns, metric)
+    
+    # Exact zeros on the diagonal (rounding can leave ~1e-9 m for identical points)
+    if destinations is None:
+        np.fill_diagonal(out, 0)
+    return out
+
 def compute_euclidean_distance_matrix(coordinates):
     """
     Compute distance matrix using Euclidean distance (straight-line)
@@ -26,26 +169,33 @@ def compute_euclidean_distance_matrix(coordinates):
     Returns:
     - 2D numpy array of distances
     """
-    num_nodes = len(coordinates)
-    distance_matrix = np.zeros((num_nodes, num_nodes))
-    for i in range(num_nodes):
-        for j in range(num_nodes):
-            distance_matrix[i, j] = np.sqrt(np.sum((coordinates[i] - coordinates[j])**2))
-    return distance_matrix
+    return compute_distance_matrix(coordinates, 'euclidean')
 
-def compute_google_distance_matrix(coordinates, api_key, batch_size=10, delay=1.0, mode="driving", 
-                                   max_retries=3, use_euclidean_fallback=True):
+def compute_google_distance_matrix(coordinates, api_key, batch_size=MAX_ORIGINS, delay=1.0, mode="driving", 
+                                   max_retries=3, use_euclidean_fallback=True, cache=True, base_url=None,
+                                   elements_per_second=None, max_concurrency=None, symmetric=None,
+                                   asymmetry_threshold=HYBRID_ASYMMETRY_THRESHOLD):
     """
-    Compute distance matrix using Google Distance Matrix API with batching to handle rate limits
+    Compute distance matrix using the Google Distance Matrix API, batches fetched concurrently
     
     Parameters:
     - coordinates: List of (lat, lng) tuples
     - api_key: Google Maps API key (required)
-    - batch_size: Maximum number of origins/destinations per request (max 25 allowed by Google)
-    - delay: Time to wait between API calls in seconds
+    - batch_size: Maximum number of origins/destinations per request (max 25 allowed by Google;
+      requests are packed up to 100 elements)
+    - delay: Base backoff in seconds before retrying a failed batch (doubled per attempt)
     - mode: Travel mode (driving, walking, bicycling, transit)
-    - max_retries: Number of retries if API call fails
-    - use_euclidean_fallback: Whether to fall back to Euclidean distance if API call fails
+    - max_retries: Number of attempts per batch
+    - use_euclidean_fallback: Whether to fall back to straight-line (haversine) distance if API call fails
+    - cache: DistanceCache to read and fill, True for the shared default cache, or None/False for none
+    - base_url: Optional endpoint URL (e.g. a local mock server)
+    - elements_per_second: Element quota of the rate limiter (defaults to GOOGLE_ELEMENTS_PER_SECOND)
+    - max_concurrency: Requests in flight at once (defaults to GOOGLE_MAX_CONCURRENCY)
+    - symmetric: True to request only one direction per pair and mirror it, 'hybrid' to also
+      request both directions around stops where a sampled check finds asymmetry, False for
+      every directed pair; None picks True for SYMMETRIC_MODES (walking, bicycling)
+    - asymmetry_threshold: Relative difference between directions above which a hybrid
+      sample pair counts as asymmetric
     
     Returns:
     - 2D numpy array of distances in meters
@@ -54,140 +204,557 @@ def compute_google_distance_matrix(coordinates, api_key, batch_size=10, delay=1.
     distance_matrix = np.zeros((num_nodes, num_nodes))
     
     if api_key is None or api_key.strip() == "":
-        logger.warning("No Google Maps API key provided, falling back to Euclidean distance")
-        return compute_euclidean_distance_matrix(coordinates)
-    
-    # Calculate number of batches needed
-    num_batches = ceil(num_nodes / batch_size)
-    total_batches = num_batches * num_batches
-    current_batch = 0
-    
-    logger.info(f"Computing distance matrix for {num_nodes} nodes using Google Maps API")
-    logger.info(f"Split into {total_batches} batches with {delay}s delay between batches")
-    
-    # Track API usage
-    api_calls = 0
-    elements_requested = 0
-    
-    # For each batch of origins
-    for i in range(num_batches):
-        # Get batch of origins
-        origin_start = i * batch_size
-        origin_end = min((i + 1) * batch_size, num_nodes)
-        origins_batch = coordinates[origin_start:origin_end]
-        origin_count = len(origins_batch)
+        logger.warning("No Google Maps API key provided, falling back to straight-line distance")
+        return compute_distance_matrix(coordinates, FALLBACK_METRIC)
+    
+    if symmetric is None:
+        symmetric = mode in SYMMETRIC_MODES
+    if symmetric not in (True, False, 'hybrid'):
+        raise ValueError(f"symmetric must be True, False or 'hybrid', got {symmetric!r}")
+    
+    # Pairs resolved on earlier runs come from the element cache; only the rest is requested.
+    # known: filled in distance_matrix, resolved: real API distances (cached or fetched)
+    if cache is True:
+        cache = get_default_cache()
+    elif cache is False:
+        cache = None
+    resolved = np.zeros((num_nodes, num_nodes), dtype=bool)
+    if cache is not None:
+        cached = cache.lookup(coordinates, coordinates, mode)
+        resolved = ~np.isnan(cached)
+        distance_matrix[resolved] = cached[resolved]
+        logger.info(f"Distance cache: {int(resolved.sum())}/{resolved.size} elements cached")
+    
+    # The diagonal is zero by definition and never requested
+    np.fill_diagonal(resolved, True)
+    known = resolved.copy()
+    
+    fetch = {
+        'api_key': api_key, 'mode': mode, 'batch_size': batch_size, 'delay': delay,
+        'max_retries': max_retries, 'use_euclidean_fallback': use_euclidean_fallback, 'cache': cache,
+        'base_url': base_url, 'elements_per_second': elements_per_second, 'max_concurrency': max_concurrency
+    }
+    start_time = time.time()
+    
+    if not symmetric:
+        _fetch_google_pairs(coordinates, distance_matrix, known, resolved, ~known, 'all pairs', fetch)
+    else:
+        # One direction per pair, unless either direction is known already
+        request = np.triu(~(known | known.T), k=1)
+        sample = None
+        if symmetric == 'hybrid':
+            # Spot-check the reverse direction of every stop's nearest-neighbour pairs
+            sample = _asymmetry_sample(coordinates)
+            request |= sample & ~known
+        _fetch_google_pairs(coordinates, distance_matrix, known, resolved, request,
+                            'one direction per pair', fetch)
         
-        # For each batch of destinations
-        for j in range(num_batches):
-            current_batch += 1
-            # Get batch of destinations
-            dest_start = j * batch_size
-            dest_end = min((j + 1) * batch_size, num_nodes)
-            dests_batch = coordinates[dest_start:dest_end]
-            dest_count = len(dests_batch)
-            
-            # Log progress
-            logger.info(f"Processing batch {current_batch}/{total_batches}: {origin_count}x{dest_count} elements")
-            
-            # Keep track of elements for quota calculation
-            elements_in_batch = origin_count * dest_count
-            elements_requested += elements_in_batch
-            
-            # Format coordinates for API
-            origins_str = "|".join([f"{lat},{lng}" for lat, lng in origins_batch])
-            dests_str = "|".join([f"{lat},{lng}" for lat, lng in dests_batch])
-            
-            retry_count = 0
-            success = False
-            
-            while retry_count < max_retries and not success:
-                try:
-                    # Make API request
-                    url = "https://maps.googleapis.com/maps/api/distancematrix/json"
-                    params = {
-                        "origins": origins_str,
-                        "destinations": dests_str,
-                        "mode": mode,
-                        "key": api_key
-                    }
-                    
-                    # Log API call (but not the key)
-                    logger.info(f"Making API call: {elements_in_batch} elements, mode={mode}")
-                    
-                    # Increment API call counter
-                    api_calls += 1
-                    
-                    # Make the request
-                    response = requests.get(url, params=params)
-                    data = response.json()
-                    
-                    # Check if the request was successful
-                    if data["status"] != "OK":
-                        logger.error(f"API error: {data['status']}")
-                        if "error_message" in data:
-                            logger.error(f"Error message: {data['error_message']}")
-                        
-                        # Check specific error types
-                        if data["status"] == "OVER_QUERY_LIMIT":
-                            # Exponential backoff
-                            sleep_time = delay * (2 ** retry_count)
-                            logger.warning(f"Rate limit exceeded. Retrying in {sleep_time} seconds")
-                            time.sleep(sleep_time)
-                            retry_count += 1
-                            continue
-                        
-                        # For other errors, fall back to Euclidean distance
-                        if use_euclidean_fallback:
-                            logger.warning(f"Falling back to Euclidean distance for batch {current_batch}")
-                            _use_euclidean_for_batch(distance_matrix, origins_batch, dests_batch, 
-                                                   origin_start, dest_start)
-                    else:
-                        # Process the results
-                        for origin_idx, row in enumerate(data["rows"]):
-                            for dest_idx, element in enumerate(row["elements"]):
-                                i_idx = origin_start + origin_idx
-                                j_idx = dest_start + dest_idx
-                                
-                                if element["status"] == "OK":
-                                    # Use distance value in meters
-                                    distance_matrix[i_idx, j_idx] = element["distance"]["value"]
-                                else:
-                                    logger.warning(f"No route from {origin_idx} to {dest_idx}: {element['status']}")
-                                    # If route not found, fall back to Euclidean
-                                    origin = origins_batch[origin_idx]
-                                    dest = dests_batch[dest_idx]
-                                    distance_matrix[i_idx, j_idx] = np.sqrt(np.sum((np.array(origin) - np.array(dest))**2))
-                    
-                    success = True  # Mark as success to exit retry loop
-                    
-                except Exception as e:
-                    logger.error(f"Error making API request: {e}")
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        # Exponential backoff
-                        sleep_time = delay * (2 ** retry_count)
-                        logger.warning(f"Retrying in {sleep_time} seconds")
-                        time.sleep(sleep_time)
-                    elif use_euclidean_fallback:
-                        # Fall back to Euclidean distance for this batch
-                        logger.warning(f"Falling back to Euclidean distance for batch {current_batch}")
-                        _use_euclidean_for_batch(distance_matrix, origins_batch, dests_batch, 
-                                               origin_start, dest_start)
-                        success = True  # Exit retry loop
-            
-            # Wait between API calls to avoid hitting rate limits
-            if current_batch < total_batches:
-                logger.info(f"Waiting {delay} seconds before next batch")
-                time.sleep(delay)
-    
-    logger.info(f"Distance matrix computation complete. API calls: {api_calls}, Elements: {elements_requested}")
+        if symmetric == 'hybrid':
+            asymmetric = _asymmetric_stops(distance_matrix, resolved, sample, asymmetry_threshold)
+            logger.info(f"Hybrid symmetry: {int(asymmetric.sum())}/{num_nodes} stops asymmetric "
+                        f"above {asymmetry_threshold:.0%}")
+            request = ~known & (asymmetric[:, None] | asymmetric[None, :])
+            _fetch_google_pairs(coordinates, distance_matrix, known, resolved, request,
+                                'both directions around asymmetric stops', fetch)
+        
+        if symmetric == 'hybrid':
+            # Directed values stay where both directions were fetched; mirror the rest
+            mirror = ~known & known.T
+        else:
+            # Exactly symmetric: the upper triangle wins wherever it is known
+            upper = np.triu(known, k=1)
+            mirror = upper.T | (~known & known.T)
+        distance_matrix[mirror] = distance_matrix.T[mirror]
+        known |= mirror
+    
+    logger.info(f"Distance matrix computation complete in {time.time() - start_time:.1f}s")
     return distance_matrix
 
-def _use_euclidean_for_batch(distance_matrix, origins_batch, dests_batch, origin_start, dest_start):
-    """Helper function to calculate Euclidean distances for a batch"""
-    for origin_idx, origin in enumerate(origins_batch):
-        for dest_idx, dest in enumerate(dests_batch):
-            i_idx = origin_start + origin_idx
-            j_idx = dest_start + dest_idx
-            # Calculate Euclidean distance as fallback
-            distance_matrix[i_idx, j_idx] = np.sqrt(np.sum((np.array(origin) - np.array(dest))**2))
\ No newline at end of file
+def _fetch_google_pairs(coordinates, distance_matrix, known, resolved, request, label, fetch):
+    """
+    Request a set of directed pairs and write the results into the matrix
+    
+    Parameters:
+    - coordinates: List of (lat, lng) tuples
+    - distance_matrix: Matrix to fill
+    - known, resolved: Boolean masks updated in place (filled at all / with a real API distance)
+    - request: Boolean mask of the pairs to request (the diagonal is never requested)
+    - label: Description of the phase for the log
+    - fetch: API and batching options of compute_google_distance_matrix
+    """
+    num_nodes = len(coordinates)
+    request = np.array(request, dtype=bool)
+    np.fill_diagonal(request, False)
+    if not request.any():
+        return
+    
+    batches = plan_requests(request, max_origins=fetch['batch_size'], max_destinations=fetch['batch_size'])
+    estimate = estimate_requests(batches, needed=int(request.sum()),
+                                 elements_per_second=fetch['elements_per_second'],
+                                 max_concurrency=fetch['max_concurrency'])
+    logger.info(f"Computing distance matrix for {num_nodes} nodes using Google Maps API ({label}): "
+                f"{estimate['requests']} requests, {estimate['elements']} billed elements "
+                f"({estimate['wasted_elements']} beyond the missing pairs), mode={fetch['mode']}, "
+                f"estimated cost ${estimate['cost']:.2f}, estimated time {estimate['seconds']:.1f}s")
+    
+    responses = run_coroutine(fetch_google_batches(
+        coordinates, batches, fetch['api_key'], mode=fetch['mode'], base_url=fetch['base_url'],
+        elements_per_second=fetch['elements_per_second'], max_concurrency=fetch['max_concurrency'],
+        max_retries=fetch['max_retries'], backoff=fetch['delay']))
+    
+    # Process the results; only real routes go into the cache
+    elements = []
+    for batch_number, ((origin_indices, dest_indices), data) in enumerate(zip(batches, responses), start=1):
+        if data is None or data.get("status") != "OK":
+            if fetch['use_euclidean_fallback']:
+                logger.warning(f"Falling back to straight-line distance for batch {batch_number}")
+                # Pairs of the block already holding real distances (e.g. cached) keep them
+                filled = _fill_fallback_batch(distance_matrix, coordinates, origin_indices, dest_indices,
+                                              mask=~resolved[np.ix_(origin_indices, dest_indices)])
+                known[np.ix_(origin_indices, dest_indices)] |= filled
+            continue
+        
+        for origin_idx, row in enumerate(data["rows"]):
+            for dest_idx, element in enumerate(row["elements"]):
+                i_idx = origin_indices[origin_idx]
+                j_idx = dest_indices[dest_idx]
+                
+                if element["status"] == "OK":
+                    # Use distance value in meters
+                    distance_matrix[i_idx, j_idx] = element["distance"]["value"]
+                    resolved[i_idx, j_idx] = known[i_idx, j_idx] = True
+                    elements.append((coordinates[i_idx], coordinates[j_idx], element["distance"]["value"],
+                                     element.get("duration", {}).get("value")))
+                elif not resolved[i_idx, j_idx]:
+                    logger.warning(f"No route from {i_idx} to {j_idx}: {element['status']}")
+                    # If route not found, fall back to straight-line distance (a cached
+                    # road distance of the pair is kept instead)
+                    distance_matrix[i_idx, j_idx] = point_distances(
+                        coordinates[i_idx], [coordinates[j_idx]], FALLBACK_METRIC)[0]
+                    known[i_idx, j_idx] = True
+    
+    if fetch['cache'] is not None:
+        fetch['cache'].store(elements, fetch['mode'])
+    
+    failed = sum(1 for data in responses if data is None or data.get("status") != "OK")
+    logger.info(f"Fetched {label}: API calls: {len(batches)}, Elements: {estimate['elements']}, "
+                f"Failed batches: {failed}")
+
+def _asymmetry_sample(coordinates, neighbors=HYBRID_SAMPLE_NEIGHBORS):
+    """
+    Reverse-direction pairs to spot-check for asymmetry
+    
+    For every stop and each of its nearest straight-line neighbours, the pair's
+    lower-triangle direction (the one a symmetric fetch does not request).
+    Short trips show one-way streets and turn restrictions most clearly.
+    
+    Returns:
+    - Boolean mask of the sampled directed pairs
+    """
+    num_nodes = len(coordinates)
+    sample = np.zeros((num_nodes, num_nodes), dtype=bool)
+    if num_nodes < 2:
+        return sample
+    
+    k = min(neighbors, num_nodes - 1)
+    for start in range(0, num_nodes, 256):
+        rows = np.arange(start, min(start + 256, num_nodes))
+        distances = compute_distance_matrix([coordinates[i] for i in rows], FALLBACK_METRIC,
+                                            destinations=coordinates)
+        distances[np.arange(len(rows)), rows] = np.inf
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        origins = np.repeat(rows, k)
+        destinations = nearest.ravel()
+        sample[np.maximum(origins, destinations), np.minimum(origins, destinations)] = True
+    return sample
+
+def _asymmetric_stops(distance_matrix, resolved, sample, threshold):
+    """
+    Stops whose sampled pairs are mostly asymmetric
+    
+    A pair's two directions differ by more than threshold (relative) when one
+    of its stops sits behind one-way streets; requiring most of a stop's pairs
+    keeps the innocent neighbours of such a stop out.
+    """
+    rows, cols = np.nonzero(sample & resolved & resolved.T)
+    forward = distance_matrix[rows, cols]
+    backward = distance_matrix[cols, rows]
+    difference = np.abs(forward - backward) / np.maximum(np.minimum(forward, backward), 1.0)
+    over = difference > threshold
+    
+    num_nodes = len(distance_matrix)
+    sampled = np.bincount(rows, minlength=num_nodes) + np.bincount(cols, minlength=num_nodes)
+    asymmetric = np.bincount(rows[over], minlength=num_nodes) + np.bincount(cols[over], minlength=num_nodes)
+    return asymmetric * 2 > sampled
+
+def _fill_fallback_batch(distance_matrix, coordinates, origin_indices, dest_indices, mask=None):
+    """
+    Helper function to fill a failed batch with straight-line distances
+    
+    Parameters:
+    - mask: Optional boolean block (origins x destinations), only True cells are written
+    
+    Returns:
+    - Boolean block of the cells written
+    """
+    block = np.ix_(origin_indices, dest_indices)
+    straight = compute_distance_matrix([coordinates[i] for i in origin_indices], FALLBACK_METRIC,
+                                       destinations=[coordinates[j] for j in dest_indices])
+    if mask is None:
+        mask = np.ones(straight.shape, dtype=bool)
+    distance_matrix[block] = np.where(mask, straight, distance_matrix[block])
+    return mask
+
+def point_distances(point, coordinates, metric='euclidean'):
+    """
+    Distances from one point to many, without building a matrix
+    
+    Parameters:
+    - point: (x, y) or (lat, lng) of the point
+    - coordinates: List of (x, y) or (lat, lng) per node
+    - metric: 'euclidean' (coordinate units) or 'haversine' (meters, coordinates in degrees)
+    
+    Returns:
+    - 1D numpy array of distances
+    """
+    points = np.asarray(coordinates, dtype=np.float64)[:, :2]
+    origin = np.asarray(point, dtype=np.float64)[:2]
+    return compute_distance_matrix([origin], metric, destinations=points)[0]
+
+def compute_duration_matrix(distance_matrix, coordinates=None, mode=None, cache=True, speed_kmh=None):
+    """
+    Travel times in minutes between all nodes
+    
+    Google element durations stored in the distance cache are used where available
+    (either direction of a pair, as the distances are mirrored); every other pair is
+    its distance in meters driven at speed_kmh.
+    
+    Parameters:
+    - distance_matrix: 2D array of distances in meters
+    - coordinates: Optional list of (lat, lng) tuples (needed for the cache lookup)
+    - mode: Google travel mode of the distances; None skips the cache (distances not from Google)
+    - cache: DistanceCache to read, True for the shared default cache, or None/False for none
+    - speed_kmh: Travel speed for pairs without a cached duration (defaults to TRAVEL_SPEED_KMH)
+    
+    Returns:
+    - 2D numpy array of travel times in minutes
+    """
+    speed_kmh = speed_kmh or TRAVEL_SPEED_KMH
+    durations = np.asarray(distance_matrix, dtype=np.float64) / (speed_kmh * 1000.0 / 60.0)
+    
+    if cache is True:
+        cache = get_default_cache()
+    elif cache is False:
+        cache = None
+    if mode is not None and cache is not None and coordinates is not None:
+        cached = cache.lookup(coordinates, coordinates, mode, column='duration')
+        cached = np.where(np.isnan(cached), cached.T, cached)
+        found = ~np.isnan(cached)
+        durations[found] = cached[found] / 60.0
+        logger.info(f"Duration matrix: {int(found.sum())}/{found.size} Google durations, "
+                    f"the rest at {speed_kmh:g} km/h")
+    
+    np.fill_diagonal(durations, 0)
+    return durations
+
+def should_use_memmap(num_nodes, dtype=np.float64):
+    """Check whether a num_nodes x num_nodes matrix is above the memmap size threshold"""
+    return num_nodes * num_nodes * np.dtype(dtype).itemsize > MEMMAP_THRESHOLD_BYTES
+
+def _block_rows(num_nodes, bytes_per_element):
+    """Number of matrix rows to compute per block so a block stays within MEMMAP_BLOCK_BYTES"""
+    return max(1, MEMMAP_BLOCK_BYTES // max(1, num_nodes * bytes_per_element))
+
+def _new_memmap(num_nodes, path=None, dtype=np.float64):
+    """Create a writable .npy-backed memmap, sweeping stale files from the memmap directory first"""
+    if path is None:
+        os.makedirs(MEMMAP_DIR, exist_ok=True)
+        cleanup_stale_memmaps()
+        path = os.path.join(MEMMAP_DIR, f"distance_{uuid.uuid4().hex}.npy")
+    
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(num_nodes, num_nodes))
+
+def create_memmap_distance_matrix(coordinates, path=None, dtype=np.float64, metric='euclidean'):
+    """
+    Compute a straight-line distance matrix straight into a disk-backed memmap
+    
+    Parameters:
+    - coordinates: List of (lat, lng) tuples
+    - path: Optional .npy file path (defaults to a new file in MEMMAP_DIR)
+    - dtype: Storage dtype of the matrix
+    - metric: One of METRICS
+    
+    Returns:
+    - Read-only np.memmap of distances
+    """
+    matrix = _new_memmap(len(coordinates), path, dtype)
+    
+    # Only one block of rows is ever held in RAM
+    compute_distance_matrix(coordinates, metric, out=matrix)
+    
+    return _reopen_read_only(matrix)
+
+def store_distance_matrix_memmap(distance_matrix, path=None, dtype=np.float64):
+    """
+    Spill an existing distance matrix (nested lists, array or CondensedDistanceMatrix)
+    to a disk-backed memmap, one block of rows at a time
+    
+    Parameters:
+    - distance_matrix: 2D list or array of distances, or a CondensedDistanceMatrix
+    - path: Optional .npy file path (defaults to a new file in MEMMAP_DIR)
+    - dtype: Storage dtype of the matrix
+    
+    Returns:
+    - Read-only np.memmap of distances
+    """
+    num_nodes = len(distance_matrix)
+    matrix = _new_memmap(num_nodes, path, dtype)
+    
+    block = _block_rows(num_nodes, np.dtype(dtype).itemsize)
+    for start in range(0, num_nodes, block):
+        end = min(start + block, num_nodes)
+        if isinstance(distance_matrix, CondensedDistanceMatrix):
+            matrix[start:end] = distance_matrix.rows(start, end, dtype)
+        else:
+            matrix[start:end] = np.asarray(distance_matrix[start:end], dtype=dtype)
+    
+    return _reopen_read_only(matrix)
+
+def is_memmap(matrix):
+    """Check whether an array is (a view of) a disk-backed memmap"""
+    while matrix is not None:
+        if isinstance(matrix, np.memmap):
+            return True
+        matrix = getattr(matrix, 'base', None)
+    return False
+
+def lookup_rows(matrix, purpose):
+    """
+    Nested Python lists of a matrix, for fast matrix[i][j] lookups in solver loops
+    
+    A disk-backed memmap is returned as it is (it supports the same indexing):
+    lists take about 4x the array in RAM, which the memmap is there to avoid.
+    
+    Parameters:
+    - matrix: 2D array of distances or travel times
+    - purpose: What the lists are for, for the log
+    """
+    if is_memmap(matrix):
+        logger.warning(f"Not copying the memory-mapped {len(matrix)}x{len(matrix)} matrix to lists "
+                       f"for {purpose}; using array lookups instead")
+        return matrix
+    return np.asarray(matrix, dtype=np.float64).tolist()
+
+def _reopen_read_only(matrix):
+    """Flush a writable memmap and reopen it read-only so pages are shared, never copied"""
+    path = matrix.filename
+    matrix.flush()
+    del matrix
+    return open_memmap_distance_matrix(path)
+
+def open_memmap_distance_matrix(path):
+    """Open a memmap distance matrix written by this module (e.g. from another process)"""
+    return np.load(path, mmap_mode='r')
+
+def release_memmap_distance_matrix(distance_matrix):
+    """
+    Delete the file behind a memmap distance matrix.
+    Safe to call while other references exist; the OS keeps mapped pages alive until unmapped.
+    In-RAM arrays are ignored.
+    """
+    path = getattr(distance_matrix, 'filename', None)
+    if not path:
+        return False
+    
+    try:
+        os.remove(path)
+        return True
+    except OSError as e:
+        logger.warning(f"Could not remove memmap file {path}: {e}")
+        return False
+
+def cleanup_stale_memmaps(max_age_seconds=None, directory=None):
+    """Remove memmap files older than max_age_seconds left behind by crashed or abandoned jobs"""
+    max_age_seconds = MEMMAP_MAX_AGE_SECONDS if max_age_seconds is None else max_age_seconds
+    directory = directory or MEMMAP_DIR
+    if not os.path.isdir(directory):
+        return 0
+    
+    removed = 0
+    cutoff = time.time() - max_age_seconds
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith('.npy') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    
+    if removed:
+        logger.info(f"Removed {removed} stale memmap distance matrices from {directory}")
+    return removed
+
+def compute_distance_matrix_auto(coordinates, metric='euclidean'):
+    """Compute a straight-line matrix in RAM, or as a memmap when it is above MEMMAP_THRESHOLD_BYTES"""
+    if should_use_memmap(len(coordinates)):
+        logger.info(f"Using memmap storage for {len(coordinates)}x{len(coordinates)} distance matrix")
+        return create_memmap_distance_matrix(coordinates, metric=metric)
+    return compute_distance_matrix(coordinates, metric)
+
+def compute_euclidean_distance_matrix_auto(coordinates):
+    """Compute a Euclidean matrix in RAM, or as a memmap when it is above MEMMAP_THRESHOLD_BYTES"""
+    return compute_distance_matrix_auto(coordinates, 'euclidean')
+
+
+def condensed_index(i, j, num_nodes):
+    """
+    Position of pair (i, j), i != j, in a condensed upper-triangle array.
+    Works elementwise on numpy arrays as well as on plain ints.
+    """
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    return num_nodes * i - (i * (i + 1)) // 2 + (j - i - 1)
+
+class CondensedDistanceMatrix:
+    """
+    Compact storage for a symmetric distance matrix.
+    Only the n*(n-1)/2 upper-triangle values are kept; with a resolution they are
+    stored as uint32 multiples of it (e.g. resolution=1.0 for whole meters).
+    np.asarray(condensed) expands to a dense matrix (int64 when quantized, so
+    delta costs stay exact) for the solver's hot paths.
+    """
+    
+    def __init__(self, values, num_nodes, resolution=None):
+        self.values = np.asarray(values, dtype=np.uint32 if resolution else np.float64)
+        self.num_nodes = num_nodes
+        self.resolution = resolution
+        
+        expected = num_nodes * (num_nodes - 1) // 2
+        if len(self.values) != expected:
+            raise ValueError(f"Expected {expected} condensed values for {num_nodes} nodes, got {len(self.values)}")
+    
+    @classmethod
+    def from_matrix(cls, distance_matrix, resolution=None):
+        """
+        Build from a dense symmetric matrix
+        
+        Parameters:
+        - distance_matrix: 2D list or array of distances
+        - resolution: Quantization step (e.g. 1.0 for meters); None keeps float64 values
+        """
+        matrix = np.asarray(distance_matrix, dtype=np.float64)
+        num_nodes = len(matrix)
+        rows, cols = np.triu_indices(num_nodes, k=1)
+        values = matrix[rows, cols]
+        
+        if resolution:
+            values = np.rint(values / resolution)
+            if values.size and values.max() > QUANTIZED_MAX:
+                raise ValueError("Distances too large for uint32 quantization at this resolution")
+        
+        return cls(values, num_nodes, resolution)
+    
+    def __len__(self):
+        return self.num_nodes
+    
+    def __getitem__(self, key):
+        """Look up a single distance: matrix[i, j]"""
+        i, j = key
+        if i == j:
+            return 0
+        value = self.values[condensed_index(i, j, self.num_nodes)]
+        return int(value) if self.resolution else float(value)
+    
+    def to_dense(self, dtype=None):
+        """Expand to a full symmetric matrix (in integer units when quantized)"""
+        if dtype is None:
+            dtype = np.int64 if self.resolution else np.float64
+        
+        matrix = np.zeros((self.num_nodes, self.num_nodes), dtype=dtype)
+        rows, cols = np.triu_indices(self.num_nodes, k=1)
+        matrix[rows, cols] = self.values
+        matrix[cols, rows] = self.values
+        return matrix
+    
+    def __array__(self, dtype=None, copy=None):
+        return self.to_dense(dtype)
+    
+    def rows(self, start, end, dtype=None):
+        """Dense rows start..end-1 (same units as to_dense), without expanding the whole matrix"""
+        if dtype is None:
+            dtype = np.int64 if self.resolution else np.float64
+        block = np.zeros((end - start, self.num_nodes), dtype=dtype)
+        if self.num_nodes < 2:
+            return block
+        i = np.arange(start, end)[:, None]
+        j = np.arange(self.num_nodes)[None, :]
+        off_diagonal = i != j
+        index = condensed_index(i, j, self.num_nodes)
+        block[off_diagonal] = self.values[index[off_diagonal]]
+        return block
+    
+    def to_distances(self):
+        """Expand to a dense float matrix in the original distance units"""
+        matrix = self.to_dense(np.float64)
+        if self.resolution:
+            matrix *= self.resolution
+        return matrix
+    
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+    
+    def to_dict(self):
+        """JSON-serializable form, suitable for session storage"""
+        return {
+            'num_nodes': self.num_nodes,
+            'resolution': self.resolution,
+            'values': self.values.tolist()
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['values'], data['num_nodes'], data.get('resolution'))
+
+
+# Distance backends by name: function(coordinates, **options) -> 2D array of distances
+_DISTANCE_BACKENDS = {}
+
+def register_distance_backend(name, function):
+    """Make a distance backend available to compute_backend_distance_matrix"""
+    _DISTANCE_BACKENDS[name] = function
+
+def compute_backend_distance_matrix(coordinates, backend='haversine', **options):
+    """
+    Compute a distance matrix with a named backend
+    
+    Parameters:
+    - coordinates: List of (lat, lng) tuples
+    - backend: 'euclidean', 'haversine', 'equirectangular', 'google', 'osrm', 'road_graph'
+      or a registered name
+    - options: Backend options (e.g. api_key and mode for 'google', base_url and profile
+      for 'osrm', path for 'road_graph')
+    
+    Returns:
+    - 2D numpy array of distances
+    """
+    if backend not in _DISTANCE_BACKENDS:
+        raise ValueError(f"Unknown distance backend '{backend}', expected one of {sorted(_DISTANCE_BACKENDS)}")
+    return _DISTANCE_BACKENDS[backend](coordinates, **options)
+
+def _osrm_backend(coordinates, base_url=None, profile='driving', max_table_size=None, **options):
+    from models.road_network import OSRMTableClient
+    client = OSRMTableClient(base_url=base_url, profile=profile, max_table_size=max_table_size)
+    return client.distance_matrix(coordinates)
+
+def _road_graph_backend(coordinates, path=None, parallel=None, max_workers=None, **options):
+    from models.road_network import get_road_graph
+    return get_road_graph(path).distance_matrix(coordinates, parallel=parallel, max_workers=max_workers)
+
+for _metric in METRICS:
+    register_distance_backend(_metric, lambda coordinates, _metric=_metric, **options:
+                              compute_distance_matrix(coordinates, _metric))
+register_distance_backend('google', lambda coordinates, api_key=None, **options:
+                          compute_google_distance_matrix(coordinates, api_key, **options))
+register_distance_backend('osrm', _osrm_backend)
+register_distance_backend('road_graph', _road_graph_backend)
@@ -0,0 +1,103 @@
+"""
+Elite solution pool for the CVRP solvers.
+
+Keeps a bounded set of good, mutually different solutions seen during a
+search, so alternative plans come out of a single solve. Solutions are
+deduplicated by a hash of their canonical form, and two solutions closer
+than `min_distance` (broken-pairs distance: the fraction of edges they do
+not share) are treated as the same plan, keeping only the cheaper one.
+"""
+
+import bisect
+
+
+def solution_key(routes):
+    """Canonical, order-independent key of a solution"""
+    return tuple(sorted(tuple(route) for route in routes if route))
+
+
+def solution_edges(routes, depot):
+    """Set of undirected edges (including depot links) used by a solution"""
+    edges = set()
+    for route in routes:
+        if not route:
+            continue
+        previous = depot
+        for customer in route:
+            edges.add((previous, customer) if previous < customer else (customer, previous))
+            previous = customer
+        edges.add((previous, depot) if previous < depot else (depot, previous))
+    return edges
+
+
+def broken_pairs_distance(edges_a, edges_b):
+    """Fraction of edges not shared by two solutions (0 = identical, 1 = disjoint)"""
+    size = max(len(edges_a), len(edges_b))
+    if size == 0:
+        return 0.0
+    return 1.0 - len(edges_a & edges_b) / size
+
+
+class ElitePool:
+    def __init__(self, depot, capacity=5, min_distance=0.1):
+        """
+        Parameters:
+        - depot: Index of the depot node
+        - capacity: Maximum number of solutions kept
+        - min_distance: Minimum broken-pairs distance between kept solutions
+        """
+        self.depot = depot
+        self.capacity = capacity
+        self.min_distance = min_distance
+
+        # Entries sorted by cost: (cost, key_hash, routes, edges)
+        self.entries = []
+        self.hashes = set()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def worst_cost(self):
+        return self.entries[-1][0] if self.entries else float('inf')
+
+    def consider(self, routes, cost):
+        """
+        Offer a solution to the pool
+
+        Returns:
+        - True if the solution was added
+        """
+        # Cheap rejection first: most candidates are not better than the worst elite
+        if len(self.entries) >= self.capacity and cost >= self.worst_cost():
+            return False
+
+        key_hash = hash(solution_key(routes))
+        if key_hash in self.hashes:
+            return False
+
+        edges = solution_edges(routes, self.depot)
+
+        # Too-similar elites are replaced only if the newcomer is cheaper than all of them
+        similar = [index for index, (_, _, _, other_edges) in enumerate(self.entries)
+                   if broken_pairs_distance(edges, other_edges) < self.min_distance]
+        if any(cost >= self.entries[index][0] for index in similar):
+            return False
+        for index in reversed(similar):
+            self._remove(index)
+
+        entry = (cost, key_hash, [list(route) for route in routes if route], edges)
+        bisect.insort(self.entries, entry, key=lambda item: item[0])
+        self.hashes.add(key_hash)
+
+        if len(self.entries) > self.capacity:
+            self._remove(len(self.entries) - 1)
+        return True
+
+    def _remove(self, index):
+        _, key_hash, _, _ = self.entries.pop(index)
+        self.hashes.discard(key_hash)
+
+    def top(self, k=None):
+        """Best k solutions as (cost, routes) pairs, cheapest first"""
+        entries = self.entries if k is None else self.entries[:k]
+        return [(cost, routes) for cost, _, routes, _ in entries]
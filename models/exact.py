@@ -0,0 +1,219 @@
+"""
+Exact CVRP solver for small instances.
+
+1. Held-Karp dynamic programming over all customer subsets gives the optimal
+   single-vehicle tour of every subset at once (vectorized with NumPy one
+   subset-size layer at a time).
+2. A set-partitioning DP over subsets picks the cheapest split of all
+   customers into at most max_vehicles capacity-feasible routes.
+
+Work grows as 3^n, so this is only used up to EXACT_MAX_CUSTOMERS customers,
+where it returns the provable optimum in milliseconds.
+"""
+
+import numpy as np
+from models.cvrp import CVRPSolverBase
+
+# Largest number of customers solved exactly (3^12 / 2 ~ 265k subset pairs)
+EXACT_MAX_CUSTOMERS = 12
+
+
+def popcounts(num_bits):
+    """Number of set bits of every mask 0 .. 2^num_bits - 1"""
+    counts = np.zeros(1 << num_bits, dtype=np.int64)
+    for bit in range(num_bits):
+        counts[1 << bit:1 << (bit + 1)] = counts[:1 << bit] + 1
+    return counts
+
+
+def held_karp_all_subsets(distance_matrix, start, nodes, allowed=None):
+    """
+    Shortest paths from `start` through every subset of `nodes`
+
+    Parameters:
+    - distance_matrix: 2D array of distances
+    - start: Node every path starts from
+    - nodes: List of node indices (bit k of a mask stands for nodes[k])
+    - allowed: Optional boolean array over masks; paths are only built for allowed masks
+      (it must be closed under taking subsets, e.g. "load <= capacity")
+
+    Returns:
+    - dp: (2^m, m) array, dp[S, j] = cheapest path start -> ... -> nodes[j] visiting exactly S
+    - parent: (2^m, m) array of the previous node position on that path (-1 at the start)
+    """
+    matrix = np.asarray(distance_matrix, dtype=np.float64)
+    m = len(nodes)
+    full = 1 << m
+    inner = matrix[np.ix_(nodes, nodes)]
+
+    dp = np.full((full, m), np.inf)
+    parent = np.full((full, m), -1, dtype=np.int64)
+    for j in range(m):
+        dp[1 << j, j] = matrix[start, nodes[j]]
+
+    masks = np.arange(full)
+    sizes = popcounts(m)
+    if allowed is None:
+        allowed = np.ones(full, dtype=bool)
+
+    # All masks of one size depend only on the previous size, so each layer is vectorized
+    for size in range(2, m + 1):
+        layer = masks[(sizes == size) & allowed]
+        if len(layer) == 0:
+            break
+        for j in range(m):
+            ending = layer[(layer >> j) & 1 == 1]
+            if len(ending) == 0:
+                continue
+            candidates = dp[ending ^ (1 << j)] + inner[:, j]
+            best = np.argmin(candidates, axis=1)
+            dp[ending, j] = candidates[np.arange(len(ending)), best]
+            parent[ending, j] = best
+
+    return dp, parent
+
+
+def held_karp_path(parent, mask, last):
+    """Rebuild the node positions of a Held-Karp path ending at position `last`"""
+    path = []
+    while last >= 0:
+        path.append(last)
+        previous = parent[mask, last]
+        mask ^= 1 << last
+        last = previous
+    path.reverse()
+    return path
+
+
+def _disjoint_pairs(num_bits):
+    """Every pair of disjoint masks (A, B) over num_bits bits, as two arrays (3^num_bits pairs)"""
+    codes = np.arange(3 ** num_bits)
+    first = np.zeros_like(codes)
+    second = np.zeros_like(codes)
+    for bit in range(num_bits):
+        digit = codes % 3
+        first |= (digit == 1) << bit
+        second |= (digit == 2) << bit
+        codes = codes // 3
+    return first, second
+
+
+class CVRP_Exact(CVRPSolverBase):
+    def __init__(self, distance_matrix, demands, depot, vehicle_capacity, max_vehicles=5, cancel_event=None):
+        """
+        Initialize the exact CVRP solver (small instances only)
+
+        Parameters:
+        - distance_matrix: 2D array of distances between nodes
+        - demands: Array of customer demands (demand[depot] should be 0)
+        - depot: Index of the depot node
+        - vehicle_capacity: Maximum capacity of each vehicle
+        - max_vehicles: Maximum number of vehicles (routes)
+        - cancel_event: Optional threading.Event (checked between DP stages)
+        """
+        super().__init__(distance_matrix, demands, depot, vehicle_capacity, max_vehicles, cancel_event)
+
+        if len(self.customers()) > EXACT_MAX_CUSTOMERS:
+            raise ValueError(f"Exact solver supports at most {EXACT_MAX_CUSTOMERS} customers")
+
+    def solve(self, callback=None):
+        """
+        Solve to optimality
+
+        Parameters:
+        - callback: Optional progress function, same signature as the SA callback
+
+        Returns:
+        - best_solution, best_cost, cost_history, temp_history (as for the SA solver)
+
+        Raises:
+        - ValueError if no split into at most max_vehicles routes respects capacity
+        """
+        customers = self.customers()
+        m = len(customers)
+
+        if m == 0:
+            self.best_solution, self.best_cost = [], 0.0
+            self.cost_history, self.temp_history = [0.0], [0.0]
+            return self.best_solution, self.best_cost, self.cost_history, self.temp_history
+
+        full = 1 << m
+        masks = np.arange(full)
+
+        # Load of every subset; only capacity-feasible subsets can be routes
+        demand = np.array([self.demands[c] for c in customers], dtype=np.float64)
+        loads = np.zeros(full)
+        for bit in range(m):
+            loads[(masks >> bit) & 1 == 1] += demand[bit]
+        feasible = loads <= self.vehicle_capacity
+        if not feasible[1 << np.arange(m)].all():
+            raise ValueError("A customer's demand exceeds the vehicle capacity")
+
+        # Optimal single-route cost of every feasible subset
+        dp, parent = held_karp_all_subsets(self.distance_matrix, self.depot, customers, feasible)
+        closing = self.distance_matrix[np.array(customers), self.depot]
+        tour_cost = dp + closing
+        route_cost = tour_cost.min(axis=1)
+        route_cost[0] = np.inf
+        route_cost[~feasible] = np.inf
+
+        if callback:
+            callback(1, 0, 0.0, float('inf'), 50)
+
+        # Candidate (route T, rest R) pairs: the route holds the lowest customer of T | R,
+        # so every partition is generated exactly once
+        route_parts = []
+        rest_parts = []
+        for low in range(m):
+            upper_bits = m - low - 1
+            first, second = _disjoint_pairs(upper_bits)
+            route_parts.append(((first << (low + 1)) | (1 << low)))
+            rest_parts.append(second << (low + 1))
+        route_masks = np.concatenate(route_parts)
+        rest_masks = np.concatenate(rest_parts)
+        keep = np.isfinite(route_cost[route_masks])
+        route_masks, rest_masks = route_masks[keep], rest_masks[keep]
+
+        union = route_masks | rest_masks
+        order = np.argsort(union, kind='stable')
+        route_masks, rest_masks, union = route_masks[order], rest_masks[order], union[order]
+        targets, starts = np.unique(union, return_index=True)
+
+        # best[v, S] = cheapest cover of S with exactly v routes
+        vehicles = min(self.max_vehicles, m)
+        best = np.full((vehicles + 1, full), np.inf)
+        best[0, 0] = 0.0
+        for v in range(1, vehicles + 1):
+            if self.is_cancel_requested():
+                break
+            candidates = route_cost[route_masks] + best[v - 1, rest_masks]
+            best[v, targets] = np.minimum.reduceat(candidates, starts)
+
+        all_customers = full - 1
+        used = int(np.argmin(best[:, all_customers]))
+        if not np.isfinite(best[used, all_customers]):
+            raise ValueError(f"No feasible solution with at most {self.max_vehicles} vehicles")
+
+        # Walk the partition back, one route at a time
+        routes = []
+        remaining = all_customers
+        for v in range(used, 0, -1):
+            pairs = np.nonzero(union == remaining)[0]
+            totals = route_cost[route_masks[pairs]] + best[v - 1, rest_masks[pairs]]
+            pick = pairs[np.argmin(totals)]
+            route_mask = int(route_masks[pick])
+
+            last = int(np.argmin(tour_cost[route_mask]))
+            positions = held_karp_path(parent, route_mask, last)
+            routes.append([customers[k] for k in positions])
+            remaining = int(rest_masks[pick])
+
+        self.best_solution = routes
+        self.best_cost = self.calculate_total_distance(routes)
+        self.cost_history = [self.best_cost]
+        self.temp_history = [0.0]
+
+        if callback:
+            callback(1, 0, 0.0, self.best_cost, 100)
+
+        return self.best_solution, self.best_cost, self.cost_history, self.temp_history
@@ -0,0 +1,279 @@
+"""
+Fleet-size minimization for the CVRP.
+
+Phase 1 of a solve when the question is "how few drivers do we need?":
+
+1. A bin-packing lower bound (Martello-Toth L2) on the number of routes,
+   computed from demands alone.
+2. First-fit decreasing packing gives a capacity-feasible start.
+3. Route elimination with an ejection pool (after Nagata & Braysy): remove
+   the lightest route, put its customers in the pool and re-insert them one
+   at a time. A customer that fits nowhere is squeezed in by ejecting one or
+   two customers from a route, choosing the ones that were ejected least
+   often so far (their penalty counters), and the ejected customers join
+   the pool. Random load-changing swaps between routes diversify the search.
+   An empty pool means one route less; running out of iterations or time
+   restores the last feasible solution. Route versions let the best
+   insertion positions be cached (InsertionCache), so each pool insertion
+   only rescans the routes changed since the customer was last tried.
+
+The search stops as soon as the route count reaches the lower bound, in
+which case the fleet size is proven minimal.
+"""
+
+import math
+import time
+import random
+import itertools
+from collections import deque, defaultdict
+from models.cvrp import CVRPSolverBase
+from models.insertion_cache import InsertionCache
+from models.distance_matrix import lookup_rows
+
+
+def bin_packing_lower_bound(demands, capacity):
+    """
+    Martello-Toth L2 lower bound on the number of bins (routes) needed
+
+    Parameters:
+    - demands: Customer demands (depot excluded)
+    - capacity: Bin (vehicle) capacity
+
+    Returns:
+    - Lower bound on the number of routes
+    """
+    items = sorted((float(d) for d in demands if d > 0), reverse=True)
+    if not items:
+        return 0
+    capacity = float(capacity)
+    bound = math.ceil(sum(items) / capacity - 1e-9)
+
+    # Items above capacity can never share a route (and are infeasible alone), count them as one each
+    small = sorted({d for d in items if d <= capacity / 2})
+    for alpha in [0.0] + small:
+        large = [d for d in items if d > capacity - alpha]
+        medium = [d for d in items if capacity / 2 < d <= capacity - alpha]
+        rest = [d for d in items if alpha <= d <= capacity / 2]
+        free_in_medium = len(medium) * capacity - sum(medium)
+        extra = max(0, math.ceil((sum(rest) - free_in_medium) / capacity - 1e-9))
+        bound = max(bound, len(large) + len(medium) + extra)
+    return bound
+
+
+class CVRP_FleetMinimizer(CVRPSolverBase):
+    def __init__(self, distance_matrix, demands, depot, vehicle_capacity, max_vehicles=5,
+                 max_iterations=5000, time_limit=10.0, cancel_event=None, seed=None):
+        """
+        Initialize the fleet minimizer (capacity constraints only)
+
+        Parameters:
+        - distance_matrix: 2D array of distances between nodes
+        - demands: Array of customer demands (demand[depot] should be 0)
+        - depot: Index of the depot node
+        - vehicle_capacity: Maximum capacity of each vehicle
+        - max_vehicles: Fleet available (only reported; the search uses as few routes as it can)
+        - max_iterations: Pool insertions allowed per route elimination attempt
+        - time_limit: Overall time limit in seconds
+        - cancel_event: Optional threading.Event; when set, solve() stops early
+          and returns the smallest feasible fleet found so far
+        - seed: Optional random seed
+        """
+        super().__init__(distance_matrix, demands, depot, vehicle_capacity, max_vehicles, cancel_event)
+        self.max_iterations = max_iterations
+        self.time_limit = time_limit
+        self.rng = random.Random(seed)
+        self._d = lookup_rows(self.distance_matrix, 'fleet minimization')
+
+        self.lower_bound = bin_packing_lower_bound([demands[c] for c in self.customers()], vehicle_capacity)
+        self.num_routes = None
+
+    def first_fit_decreasing(self):
+        """Capacity-feasible start: pack customers by decreasing demand, then order each route greedily"""
+        bins = []
+        loads = []
+        for customer in sorted(self.customers(), key=lambda c: -self.demands[c]):
+            for index, load in enumerate(loads):
+                if load + self.demands[customer] <= self.vehicle_capacity:
+                    bins[index].append(customer)
+                    loads[index] += self.demands[customer]
+                    break
+            else:
+                bins.append([customer])
+                loads.append(self.demands[customer])
+        return [self._nearest_neighbor_order(route) for route in bins]
+
+    def _nearest_neighbor_order(self, stops):
+        d = self._d
+        remaining = set(stops)
+        route = []
+        current = self.depot
+        while remaining:
+            current = min(remaining, key=lambda c: d[current][c])
+            route.append(current)
+            remaining.remove(current)
+        return route
+
+    def _insertion(self, route, customer):
+        """Cheapest insertion position and cost of a customer into a route"""
+        d = self._d
+        best_position, best_cost = 0, float('inf')
+        previous = self.depot
+        for position, following in enumerate(route + [self.depot]):
+            cost = d[previous][customer] + d[customer][following] - d[previous][following]
+            if cost < best_cost:
+                best_position, best_cost = position, cost
+            previous = following
+        return best_position, best_cost
+
+    def _best_feasible_insertion(self, routes, loads, versions, cache, customer):
+        best = None
+        for r, route in enumerate(routes):
+            if loads[r] + self.demands[customer] <= self.vehicle_capacity:
+                cost, position, _, _ = cache.get(customer, versions[r], route)
+                if best is None or cost < best[2]:
+                    best = (r, position, cost)
+        return best
+
+    def _best_ejection(self, routes, loads, customer, penalty):
+        """
+        Route and set of one or two customers whose ejection lets `customer` in,
+        minimizing the summed penalty counters (then the number ejected)
+        """
+        demand = self.demands[customer]
+        best = None
+        for r, route in enumerate(routes):
+            excess = loads[r] + demand - self.vehicle_capacity
+            for i, a in enumerate(route):
+                if self.demands[a] >= excess:
+                    score = (penalty[a], 1)
+                    if best is None or score < best[0]:
+                        best = (score, r, [a])
+                    continue
+                for b in route[i + 1:]:
+                    if self.demands[a] + self.demands[b] >= excess:
+                        score = (penalty[a] + penalty[b], 2)
+                        if best is None or score < best[0]:
+                            best = (score, r, [a, b])
+        return best
+
+    def _perturb(self, routes, loads, changed, attempts=10):
+        """Random capacity-feasible swaps between routes, changing their loads (changed routes are reported)"""
+        if len(routes) < 2:
+            return
+        for _ in range(attempts):
+            r1, r2 = self.rng.sample(range(len(routes)), 2)
+            if not routes[r1] or not routes[r2]:
+                continue
+            i = self.rng.randrange(len(routes[r1]))
+            j = self.rng.randrange(len(routes[r2]))
+            a, b = routes[r1][i], routes[r2][j]
+            shift = self.demands[b] - self.demands[a]
+            if loads[r1] + shift <= self.vehicle_capacity and loads[r2] - shift <= self.vehicle_capacity:
+                routes[r1][i], routes[r2][j] = b, a
+                loads[r1] += shift
+                loads[r2] -= shift
+                changed.update((r1, r2))
+
+    def eliminate_route(self, routes, deadline):
+        """
+        Try to remove one route
+
+        Returns:
+        - The new routes (one fewer) or None if the ejection pool could not be emptied
+        """
+        routes = [list(route) for route in routes]
+        loads = [self.calculate_route_load(route) for route in routes]
+        removed = min(range(len(routes)), key=lambda r: loads[r])
+        pool = deque(routes.pop(removed))
+        loads.pop(removed)
+        penalty = defaultdict(int)
+
+        # Every change of a route gives it a new version, which invalidates its cached insertions
+        counter = itertools.count()
+        versions = [next(counter) for _ in routes]
+        cache = InsertionCache(self.distance_matrix, self.depot)
+
+        def touch(r):
+            cache.retire(versions[r])
+            versions[r] = next(counter)
+
+        for _ in range(self.max_iterations):
+            if not pool:
+                return routes
+            if time.time() > deadline or self.is_cancel_requested():
+                return None
+
+            customer = pool.popleft()
+            insertion = self._best_feasible_insertion(routes, loads, versions, cache, customer)
+            if insertion is not None:
+                r, position, _ = insertion
+                routes[r].insert(position, customer)
+                loads[r] += self.demands[customer]
+                touch(r)
+                continue
+
+            # Squeeze: eject the least-penalized customers that make room
+            penalty[customer] += 1
+            ejection = self._best_ejection(routes, loads, customer, penalty)
+            if ejection is None:
+                return None
+            _, r, ejected = ejection
+            for other in ejected:
+                routes[r].remove(other)
+                loads[r] -= self.demands[other]
+                pool.append(other)
+            position, _ = self._insertion(routes[r], customer)
+            routes[r].insert(position, customer)
+            loads[r] += self.demands[customer]
+            touch(r)
+
+            changed = set()
+            self._perturb(routes, loads, changed)
+            for r in changed:
+                touch(r)
+
+        return routes if not pool else None
+
+    def solve(self, callback=None):
+        """
+        Minimize the number of routes
+
+        Parameters:
+        - callback: Optional progress function, same signature as the SA callback
+
+        Returns:
+        - best_solution, best_cost, cost_history, temp_history (as for the SA solver);
+          the route count is in num_routes and the lower bound in lower_bound
+        """
+        deadline = time.time() + self.time_limit if self.time_limit else float('inf')
+        routes = self.first_fit_decreasing()
+        self.cost_history.append(self.calculate_total_distance(routes))
+        self.temp_history.append(0.0)
+
+        attempt = 0
+        while len(routes) > self.lower_bound and not self.is_cancel_requested():
+            attempt += 1
+            reduced = self.eliminate_route(routes, deadline)
+            if reduced is None:
+                break
+            routes = [route for route in reduced if route]
+            self.cost_history.append(self.calculate_total_distance(routes))
+            self.temp_history.append(0.0)
+            if callback:
+                callback(attempt, 0, 0.0, self.cost_history[-1], 50)
+
+        self.best_solution = [self._nearest_neighbor_order(route) for route in routes]
+        self.best_cost = self.calculate_total_distance(self.best_solution)
+        self.num_routes = len(self.best_solution)
+
+        if callback:
+            callback(attempt, 0, 0.0, self.best_cost, 100)
+
+        return self.best_solution, self.best_cost, self.cost_history, self.temp_history
+
+    def _extra_solution_details(self, routes):
+        return {
+            'fleet_size': len(routes),
+            'fleet_lower_bound': self.lower_bound,
+            'fleet_proven_minimal': len(routes) <= self.lower_bound
+        }
@@ -0,0 +1,314 @@
+"""
+Concurrent Google Distance Matrix fetching.
+
+Batches are requested concurrently with aiohttp instead of one after another
+with a fixed sleep in between. The pace comes from a token bucket sized to
+the API quota in elements per second. A batch waits until the bucket holds
+its element count, so latency is set by the quota and not by sleep calls.
+At most GOOGLE_MAX_CONCURRENCY requests are in flight at once.
+
+Each batch retries on its own, with exponential backoff and jitter. It
+retries on rate limiting (OVER_QUERY_LIMIT, HTTP 429), on server errors and
+on network errors. Other API errors are returned to the caller, which falls
+back to straight-line distances.
+
+GOOGLE_MATRIX_URL or the base_url argument points the client elsewhere,
+for example at a local mock server in tests.
+
+plan_requests packs the pairs still needed into as few requests as the
+per-request limits allow (25 origins, 25 destinations, 100 elements). The
+diagonal and cached pairs are not requested. estimate_requests prices a
+plan before it is sent.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import aiohttp
+import numpy as np
+
+logger = logging.getLogger('google_matrix')
+
+GOOGLE_MATRIX_URL = os.getenv('GOOGLE_MATRIX_URL', 'https://maps.googleapis.com/maps/api/distancematrix/json')
+
+# Server-side quota: 60,000 elements per minute
+GOOGLE_ELEMENTS_PER_SECOND = float(os.getenv('GOOGLE_ELEMENTS_PER_SECOND', 1000))
+GOOGLE_MAX_CONCURRENCY = int(os.getenv('GOOGLE_MAX_CONCURRENCY', 8))
+GOOGLE_REQUEST_TIMEOUT_SECONDS = float(os.getenv('GOOGLE_REQUEST_TIMEOUT_SECONDS', 30))
+
+# Per-request limits of the Distance Matrix API
+MAX_ORIGINS = 25
+MAX_DESTINATIONS = 25
+MAX_ELEMENTS = 100
+
+# Used for the pre-flight estimate only
+GOOGLE_PRICE_PER_1000_ELEMENTS = float(os.getenv('GOOGLE_PRICE_PER_1000_ELEMENTS', 5.0))
+GOOGLE_REQUEST_LATENCY_SECONDS = float(os.getenv('GOOGLE_REQUEST_LATENCY_SECONDS', 0.4))
+
+# Request statuses worth retrying (anything else is final)
+RETRY_STATUSES = ('OVER_QUERY_LIMIT', 'UNKNOWN_ERROR')
+RETRY_HTTP_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter for asyncio tasks
+
+    Tokens refill continuously at `rate` per second, up to `capacity`.
+    acquire(n) waits until n tokens are available. Requests larger than
+    the capacity are allowed once the bucket is full, then leave it in debt.
+    Callers are served first come, first served.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Parameters:
+        - rate: Tokens added per second
+        - capacity: Largest burst (defaults to one second of tokens)
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens=1):
+        # The lock is created lazily so it binds to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            needed = min(float(tokens), self.capacity)
+            self._refill()
+            while self.tokens < needed:
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+
+def _tile_rows(missing, rows, height, max_destinations, max_elements):
+    """Tiles for rows taken `height` at a time, each block with only the columns it still lacks"""
+    width = min(max_destinations, max_elements // height)
+    tiles = []
+    for start in range(0, len(rows), height):
+        block = rows[start:start + height]
+        columns = np.flatnonzero(missing[block].any(axis=0))
+        for column_start in range(0, len(columns), width):
+            tiles.append((block, columns[column_start:column_start + width]))
+    return tiles
+
+
+def _best_tiling(missing, rows, max_origins, max_destinations, max_elements):
+    """Tiling of the rows over every block height, fewest requests first, then fewest billed elements"""
+    best, best_key = [], None
+    for height in range(1, min(max_origins, max_elements, len(rows)) + 1):
+        tiles = _tile_rows(missing, rows, height, max_destinations, max_elements)
+        key = (len(tiles), sum(len(o) * len(d) for o, d in tiles))
+        if best_key is None or key < best_key:
+            best, best_key = tiles, key
+    return best, best_key
+
+
+def plan_requests(missing, max_origins=MAX_ORIGINS, max_destinations=MAX_DESTINATIONS, max_elements=MAX_ELEMENTS):
+    """
+    Pack the missing pairs of a matrix into Distance Matrix requests
+
+    Every element of a request is billed, so a request is an origin block
+    times the destinations that block still lacks. Rows with the same
+    missing columns are blocked together: all rows of a fresh matrix, or
+    the known stops that only lack the new ones. The block height is
+    chosen per group to fill the 100-element limit.
+    The packing that needs the fewest requests (then billed elements) wins:
+    grouped, or one height over all rows in signature order.
+
+    Parameters:
+    - missing: Boolean matrix, True where the distance still has to be requested
+      (the diagonal is never requested)
+    - max_origins, max_destinations, max_elements: Per-request limits
+
+    Returns:
+    - List of (origin_indices, destination_indices) lists
+    """
+    missing = np.array(missing, dtype=bool)
+    np.fill_diagonal(missing, False)
+    rows = np.flatnonzero(missing.any(axis=1))
+    if not len(rows):
+        return []
+
+    # A row's own (never requested) diagonal should not split groups. It is filled in
+    # three ways: as missing (rows of a fresh matrix match), as present (known stops
+    # lacking the same new columns match) and as whatever most rows lack there.
+    column_mostly_missing = missing[:, rows].mean(axis=0) > 0.5
+    candidates = []
+    for diagonal in (True, False, column_mostly_missing):
+        signatures = missing[rows].copy()
+        signatures[np.arange(len(rows)), rows] = diagonal
+        packed = np.packbits(signatures, axis=1)
+
+        groups = {}
+        for row, signature in zip(rows, packed):
+            groups.setdefault(signature.tobytes(), []).append(row)
+
+        grouped, grouped_key = [], (0, 0)
+        for group_rows in groups.values():
+            tiles, key = _best_tiling(missing, np.array(group_rows), max_origins, max_destinations, max_elements)
+            grouped += tiles
+            grouped_key = (grouped_key[0] + key[0], grouped_key[1] + key[1])
+        candidates.append((grouped_key, grouped))
+
+        if len(groups) > 1:
+            ordered = np.array([row for group_rows in groups.values() for row in group_rows])
+            tiles, key = _best_tiling(missing, ordered, max_origins, max_destinations, max_elements)
+            candidates.append((key, tiles))
+
+    plan = min(candidates, key=lambda candidate: candidate[0])[1]
+    return [(origins.tolist(), destinations.tolist()) for origins, destinations in plan]
+
+
+def estimate_requests(batches, needed=None, elements_per_second=None, max_concurrency=None):
+    """
+    Cost and latency estimate of a request plan
+
+    Parameters:
+    - batches: List of (origin_indices, destination_indices) per request
+    - needed: Number of pairs actually missing (for the waste figure)
+    - elements_per_second: Element quota (defaults to GOOGLE_ELEMENTS_PER_SECOND)
+    - max_concurrency: Requests in flight at once (defaults to GOOGLE_MAX_CONCURRENCY)
+
+    Returns:
+    - Dictionary with requests, billed elements, wasted elements, cost and seconds
+    """
+    elements = sum(len(o) * len(d) for o, d in batches)
+    rate = elements_per_second or GOOGLE_ELEMENTS_PER_SECOND
+    concurrency = max_concurrency or GOOGLE_MAX_CONCURRENCY
+
+    # Bounded by the quota or by round trips, whichever is slower
+    quota_seconds = max(0.0, elements - rate) / rate
+    round_trip_seconds = -(-len(batches) // concurrency) * GOOGLE_REQUEST_LATENCY_SECONDS
+    return {
+        'requests': len(batches),
+        'elements': elements,
+        'wasted_elements': elements - needed if needed is not None else None,
+        'cost': elements / 1000.0 * GOOGLE_PRICE_PER_1000_ELEMENTS,
+        'seconds': max(quota_seconds, round_trip_seconds)
+    }
+
+
+def _batch_params(origins, destinations, mode, api_key):
+    return {
+        "origins": "|".join([f"{lat},{lng}" for lat, lng in origins]),
+        "destinations": "|".join([f"{lat},{lng}" for lat, lng in destinations]),
+        "mode": mode,
+        "key": api_key
+    }
+
+
+async def _fetch_batch(session, bucket, semaphore, url, params, elements, label, max_retries, backoff):
+    """
+    Request one batch, retrying transient failures
+
+    Returns:
+    - Parsed API response, or None if every attempt failed
+    """
+    for attempt in range(max_retries):
+        if attempt:
+            # Exponential backoff with jitter, so retries of concurrent batches spread out
+            sleep_time = backoff * (2 ** (attempt - 1)) * (1 + random.random())
+            logger.warning(f"Retrying batch {label} in {sleep_time:.1f} seconds")
+            await asyncio.sleep(sleep_time)
+
+        await bucket.acquire(elements)
+        try:
+            async with semaphore:
+                async with session.get(url, params=params) as response:
+                    if response.status in RETRY_HTTP_STATUSES:
+                        logger.warning(f"Batch {label}: HTTP {response.status}")
+                        continue
+                    response.raise_for_status()
+                    data = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"Error requesting batch {label}: {e!r}")
+            continue
+
+        status = data.get("status")
+        if status in RETRY_STATUSES:
+            logger.warning(f"Batch {label}: {status}")
+            continue
+        if status != "OK":
+            logger.error(f"API error for batch {label}: {status} {data.get('error_message', '')}")
+        return data
+
+    logger.error(f"Batch {label} failed after {max_retries} attempts")
+    return None
+
+
+async def fetch_google_batches(coordinates, batches, api_key, mode="driving", base_url=None,
+                               elements_per_second=None, max_concurrency=None, max_retries=3, backoff=1.0):
+    """
+    Fetch Distance Matrix batches concurrently
+
+    Parameters:
+    - coordinates: List of (lat, lng) tuples
+    - batches: List of (origin_indices, destination_indices) per request
+    - api_key: Google Maps API key
+    - mode: Travel mode
+    - base_url: Endpoint URL (defaults to GOOGLE_MATRIX_URL)
+    - elements_per_second: Quota for the token bucket (defaults to GOOGLE_ELEMENTS_PER_SECOND)
+    - max_concurrency: Requests in flight at once (defaults to GOOGLE_MAX_CONCURRENCY)
+    - max_retries: Attempts per batch
+    - backoff: Base backoff in seconds between attempts
+
+    Returns:
+    - List with the parsed response (or None on failure) per batch, in batch order
+    """
+    url = base_url or GOOGLE_MATRIX_URL
+    bucket = TokenBucket(elements_per_second or GOOGLE_ELEMENTS_PER_SECOND)
+    semaphore = asyncio.Semaphore(max_concurrency or GOOGLE_MAX_CONCURRENCY)
+    timeout = aiohttp.ClientTimeout(total=GOOGLE_REQUEST_TIMEOUT_SECONDS)
+
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        tasks = []
+        for number, (origin_indices, dest_indices) in enumerate(batches, start=1):
+            params = _batch_params([coordinates[i] for i in origin_indices],
+                                   [coordinates[j] for j in dest_indices], mode, api_key)
+            elements = len(origin_indices) * len(dest_indices)
+            tasks.append(_fetch_batch(session, bucket, semaphore, url, params, elements,
+                                      f"{number}/{len(batches)}", max_retries, backoff))
+        return await asyncio.gather(*tasks)
+
+
+def run_coroutine(coroutine):
+    """
+    Run a coroutine to completion from synchronous code
+
+    Flask request threads have no event loop, so asyncio.run is used. If the
+    caller is already inside a running loop, the coroutine runs on a
+    helper thread with its own loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    result = {}
+
+    def runner():
+        try:
+            result['value'] = asyncio.run(coroutine)
+        except BaseException as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=runner, daemon=True)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
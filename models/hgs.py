@@ -0,0 +1,349 @@
+"""
+Hybrid genetic search (HGS) for the CVRP.
+
+- Chromosome: a giant tour (permutation of all customers without depot visits)
+- Decoding: the linear-time Split (models/split.py) cuts a tour into the
+  cheapest capacity-feasible routes
+- Crossover: ordered crossover (OX) on giant tours
+- Education: granular relocate / swap local search plus 2-opt per route;
+  the improved routes are written back as the child's giant tour
+- Population management: biased fitness (cost rank plus diversity rank by
+  broken-pairs distance) decides who survives. Splitting the offspring
+  and the pairwise distance matrix are computed for the whole population in
+  batch with NumPy.
+
+Routes beyond max_vehicles are allowed during the search at a penalty per
+extra route; feasible solutions are preferred when reporting the best.
+"""
+
+import time
+import random
+import numpy as np
+from models.cvrp import CVRPSolverBase
+from models.elite_pool import ElitePool, solution_key
+from models.split import tour_arrays, linear_split, limited_split, routes_from_predecessors
+from models.decomposition import two_opt_route
+from models.distance_matrix import lookup_rows
+
+
+def ordered_crossover(parent_a, parent_b, rng):
+    """
+    OX crossover: copy a random slice of parent A, fill the rest in parent B's order
+
+    Parameters:
+    - parent_a, parent_b: Giant tours (1D integer arrays of the same customers)
+    - rng: random.Random instance
+
+    Returns:
+    - Child giant tour (1D integer array)
+    """
+    n = len(parent_a)
+    if n < 2:
+        return parent_a.copy()
+    start, end = sorted(rng.sample(range(n + 1), 2))
+    child = np.empty(n, dtype=parent_a.dtype)
+    child[start:end] = parent_a[start:end]
+
+    # Parent B's order, starting right after the copied slice
+    taken = set(parent_a[start:end].tolist())
+    order = np.roll(parent_b, -end)
+    fill = [c for c in order.tolist() if c not in taken]
+    positions = list(range(end, n)) + list(range(0, start))
+    child[positions] = fill
+    return child
+
+
+class Individual:
+    __slots__ = ('tour', 'routes', 'cost', 'penalized_cost', 'key')
+
+    def __init__(self, routes, cost, penalized_cost):
+        self.routes = routes
+        self.tour = np.array([c for route in routes for c in route], dtype=np.int64)
+        self.cost = cost
+        self.penalized_cost = penalized_cost
+        self.key = solution_key(routes)
+
+
+class CVRP_HybridGenetic(CVRPSolverBase):
+    def __init__(self, distance_matrix, demands, depot, vehicle_capacity, max_vehicles=5,
+                 population_size=25, offspring_per_generation=10, generations=100, time_limit=None,
+                 granularity=10, num_elite=5, num_close=5, cancel_event=None,
+                 elite_pool_size=0, elite_min_distance=0.1, seed=None, initial_solution=None):
+        """
+        Initialize the hybrid genetic search solver (capacity constraints only)
+
+        Parameters:
+        - distance_matrix: 2D array of distances between nodes
+        - demands: Array of customer demands (demand[depot] should be 0)
+        - depot: Index of the depot node
+        - vehicle_capacity: Maximum capacity of each vehicle
+        - max_vehicles: Maximum number of vehicles (routes)
+        - population_size: Number of individuals that survive each generation
+        - offspring_per_generation: Number of children bred per generation
+        - generations: Maximum number of generations
+        - time_limit: Optional time limit in seconds
+        - granularity: Number of nearest customers considered by the local search
+        - num_elite: Number of best individuals protected by the biased fitness
+        - num_close: Number of closest individuals used to measure diversity
+        - cancel_event: Optional threading.Event; when set, solve() stops early
+          and returns the best solution found so far
+        - elite_pool_size: Number of distinct good solutions to keep as alternatives (0 disables)
+        - elite_min_distance: Minimum fraction of differing edges between kept alternatives
+        - seed: Optional random seed
+        - initial_solution: Optional routes seeded into the first population
+          (e.g. from the fleet minimization phase)
+        """
+        super().__init__(distance_matrix, demands, depot, vehicle_capacity, max_vehicles, cancel_event)
+
+        self.population_size = max(2, population_size)
+        self.offspring_per_generation = max(1, offspring_per_generation)
+        self.generations = generations
+        self.time_limit = time_limit
+        self.num_elite = num_elite
+        self.num_close = num_close
+        self.rng = random.Random(seed)
+
+        self.customer_list = self.customers()
+        self.neighbors = self.get_instance_preprocessing(granularity).neighbor_lists(granularity)
+        self._d = lookup_rows(self.distance_matrix, 'the hybrid genetic search')
+
+        # An extra route costs at least as much as the longest depot round trip
+        depot_row = [self._d[depot][c] + self._d[c][depot] for c in self.customer_list]
+        self.fleet_penalty = max(depot_row) if depot_row else 0.0
+
+        self.elite_pool = ElitePool(depot, elite_pool_size, elite_min_distance) if elite_pool_size > 0 else None
+        self.initial_solution = [list(route) for route in initial_solution if route] if initial_solution else None
+        self.population = []
+        self._best_key = (True, float('inf'))
+
+    def penalized(self, routes, cost):
+        excess_routes = max(0, len(routes) - self.max_vehicles)
+        return cost + self.fleet_penalty * excess_routes
+
+    def decode_batch(self, tours):
+        """
+        Split a batch of giant tours at once (the position data is gathered with one NumPy call)
+        into at most max_vehicles routes where capacity allows
+
+        Returns:
+        - List of route lists, one per tour
+        """
+        tours = np.asarray(tours, dtype=np.int64)
+        from_depot, to_depot, cum, load_prefix = tour_arrays(self.distance_matrix, self.demands, self.depot, tours)
+        decoded = []
+        for row in range(len(tours)):
+            arrays = (from_depot[row], to_depot[row], cum[row], load_prefix[row], self.vehicle_capacity)
+            # Best split within the fleet; tours that need more routes are split freely and penalized
+            _, predecessor = limited_split(*arrays, self.max_vehicles)
+            if predecessor is None:
+                _, predecessor = linear_split(*arrays)
+            decoded.append(routes_from_predecessors(tours[row].tolist(), predecessor))
+        return decoded
+
+    def educate(self, routes):
+        """
+        Granular local search: improving relocate and swap moves with capacity kept
+        feasible, then 2-opt on every route, repeated until no move improves
+
+        Returns:
+        - The improved routes (empty routes removed)
+        """
+        d = self._d
+        depot = self.depot
+        demands = self.demands
+        capacity = self.vehicle_capacity
+        routes = [list(route) for route in routes]
+        loads = [sum(demands[c] for c in route) for route in routes]
+        where = {}
+
+        def index_route(r):
+            for position, customer in enumerate(routes[r]):
+                where[customer] = (r, position)
+
+        def around(r, position):
+            route = routes[r]
+            previous = route[position - 1] if position > 0 else depot
+            following = route[position + 1] if position + 1 < len(route) else depot
+            return previous, following
+
+        for r in range(len(routes)):
+            index_route(r)
+
+        order = list(self.customer_list)
+        improved = True
+        while improved:
+            improved = False
+            self.rng.shuffle(order)
+            for u in order:
+                for v in self.neighbors[u]:
+                    ru, pu = where[u]
+                    rv, pv = where[v]
+                    u_prev, u_next = around(ru, pu)
+                    v_prev, v_next = around(rv, pv)
+                    du = demands[u]
+                    inter = ru != rv
+
+                    # Relocate u right after v
+                    if v_next != u and (not inter or loads[rv] + du <= capacity):
+                        delta = (d[v][u] + d[u][v_next] - d[v][v_next] -
+                                 d[u_prev][u] - d[u][u_next] + d[u_prev][u_next])
+                        if delta < -1e-9:
+                            routes[ru].pop(pu)
+                            routes[rv].insert(routes[rv].index(v) + 1, u)
+                            loads[ru] -= du
+                            loads[rv] += du
+                            index_route(ru)
+                            index_route(rv)
+                            improved = True
+                            continue
+
+                    # Swap u and v between routes
+                    if inter:
+                        dv = demands[v]
+                        if loads[ru] - du + dv <= capacity and loads[rv] - dv + du <= capacity:
+                            delta = (d[u_prev][v] + d[v][u_next] - d[u_prev][u] - d[u][u_next] +
+                                     d[v_prev][u] + d[u][v_next] - d[v_prev][v] - d[v][v_next])
+                            if delta < -1e-9:
+                                routes[ru][pu] = v
+                                routes[rv][pv] = u
+                                loads[ru] += dv - du
+                                loads[rv] += du - dv
+                                where[u] = (rv, pv)
+                                where[v] = (ru, pu)
+                                improved = True
+
+            for r in range(len(routes)):
+                if len(routes[r]) > 2:
+                    polished = two_opt_route(d, depot, routes[r])
+                    if polished != routes[r]:
+                        routes[r] = polished
+                        index_route(r)
+
+        return [route for route in routes if route]
+
+    def make_individuals(self, tours):
+        """Decode and educate a batch of giant tours"""
+        individuals = []
+        for routes in self.decode_batch(tours):
+            routes = self.educate(routes)
+            cost = self.calculate_total_distance(routes)
+            individuals.append(Individual(routes, cost, self.penalized(routes, cost)))
+        return individuals
+
+    def biased_fitness(self, individuals):
+        """
+        Biased fitness of every individual (lower is better), computed in batch:
+        cost rank plus weighted diversity rank, where diversity is the mean
+        broken-pairs distance to the num_close closest individuals
+        """
+        size = len(individuals)
+        if size == 1:
+            return np.zeros(1)
+
+        # Successor / predecessor of every node per individual (route ends link to the depot)
+        successors = np.full((size, self.num_nodes), self.depot, dtype=np.int64)
+        predecessors = np.full((size, self.num_nodes), self.depot, dtype=np.int64)
+        for i, individual in enumerate(individuals):
+            for route in individual.routes:
+                successors[i, route[:-1]] = route[1:]
+                predecessors[i, route[1:]] = route[:-1]
+
+        customers = np.array(self.customer_list, dtype=np.int64)
+        succ = successors[:, customers]
+        pred = predecessors[:, customers]
+
+        # An edge of i is broken in j if it is neither j's successor nor predecessor link
+        broken = ((succ[:, None, :] != succ[None, :, :]) & (succ[:, None, :] != pred[None, :, :]))
+        distance = broken.mean(axis=2)
+        np.fill_diagonal(distance, np.inf)
+
+        close = min(self.num_close, size - 1)
+        diversity = np.sort(distance, axis=1)[:, :close].mean(axis=1)
+
+        costs = np.array([individual.penalized_cost for individual in individuals])
+        cost_rank = np.argsort(np.argsort(costs, kind='stable'), kind='stable')
+        diversity_rank = np.argsort(np.argsort(-diversity, kind='stable'), kind='stable')
+        weight = 1.0 - min(self.num_elite, size) / size
+        return (cost_rank + weight * diversity_rank) / (size - 1)
+
+    def select_survivors(self, individuals):
+        """Drop clones, then keep the population_size individuals with the best biased fitness"""
+        unique = {}
+        for individual in sorted(individuals, key=lambda ind: ind.penalized_cost):
+            unique.setdefault(individual.key, individual)
+        individuals = list(unique.values())
+
+        while len(individuals) > self.population_size:
+            fitness = self.biased_fitness(individuals)
+            individuals.pop(int(np.argmax(fitness)))
+        return individuals
+
+    def tournament(self, fitness):
+        a, b = self.rng.randrange(len(fitness)), self.rng.randrange(len(fitness))
+        return self.population[a if fitness[a] <= fitness[b] else b]
+
+    def _update_best(self, individuals):
+        """Track the best individual, feasible fleet size first"""
+        for individual in individuals:
+            infeasible = len(individual.routes) > self.max_vehicles
+            if (infeasible, individual.penalized_cost) < self._best_key:
+                self._best_key = (infeasible, individual.penalized_cost)
+                self.best_solution = [list(route) for route in individual.routes]
+                self.best_cost = individual.cost
+            if not infeasible and self.elite_pool is not None:
+                self.elite_pool.consider(individual.routes, individual.cost)
+
+    def solve(self, callback=None):
+        """
+        Run the hybrid genetic search
+
+        Parameters:
+        - callback: Optional progress function, same signature as the SA callback
+
+        Returns:
+        - best_solution, best_cost, cost_history, temp_history (as for the SA solver)
+        """
+        start_time = time.time()
+        customers = np.array(self.customer_list, dtype=np.int64)
+        if len(customers) == 0:
+            self.best_solution, self.best_cost = [], 0.0
+            self.cost_history, self.temp_history = [0.0], [0.0]
+            return self.best_solution, self.best_cost, self.cost_history, self.temp_history
+
+        # Random giant tours, decoded and educated
+        np_rng = np.random.default_rng(self.rng.randrange(2 ** 32))
+        tours = np.array([np_rng.permutation(customers) for _ in range(self.population_size)])
+        individuals = self.make_individuals(tours)
+        if self.initial_solution is not None:
+            routes = self.educate(self.initial_solution)
+            cost = self.calculate_total_distance(routes)
+            individuals.append(Individual(routes, cost, self.penalized(routes, cost)))
+        self.population = self.select_survivors(individuals)
+        self._update_best(self.population)
+        self.cost_history.append(self.best_cost)
+        self.temp_history.append(0.0)
+
+        for generation in range(1, self.generations + 1):
+            if self.is_cancel_requested():
+                break
+            if self.time_limit is not None and time.time() - start_time > self.time_limit:
+                break
+
+            fitness = self.biased_fitness(self.population)
+            children = np.array([
+                ordered_crossover(self.tournament(fitness).tour, self.tournament(fitness).tour, self.rng)
+                for _ in range(self.offspring_per_generation)
+            ])
+            offspring = self.make_individuals(children)
+            self._update_best(offspring)
+            self.population = self.select_survivors(self.population + offspring)
+
+            self.cost_history.append(self.best_cost)
+            self.temp_history.append(0.0)
+            if callback:
+                progress = min(100, int(generation / self.generations * 100))
+                if self.time_limit:
+                    progress = max(progress, min(100, int((time.time() - start_time) / self.time_limit * 100)))
+                callback(generation, 0, 0.0, self.best_cost, progress)
+
+        return self.best_solution, self.best_cost, self.cost_history, self.temp_history
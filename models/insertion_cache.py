@@ -0,0 +1,81 @@
+"""
+Best-insertion cache for relocate-style moves.
+
+Finding where a customer fits best in a route means scanning every position
+of the route. Most of those scans repeat work: between two evaluations only
+the routes touched by the last accepted move have changed. Every route
+therefore carries a version number that changes whenever the route does,
+and the best and second-best insertion positions of a customer are cached
+per (customer, route version), as in the SWAP* neighbourhood (Vidal 2022).
+A lookup only rescans the route if its version is new.
+
+Versions must be unique over all routes of a solution (a global counter),
+so that an entry can never be mistaken for one of another route.
+"""
+
+import numpy as np
+
+
+class InsertionCache:
+    """
+    Best and second-best insertion of customers into routes, per route version
+
+    Entries are (best_cost, best_position, second_cost, second_position);
+    a position p means inserting before route[p] (p = len(route): at the end),
+    as for list.insert. Missing second choices have cost inf and position None.
+    """
+
+    def __init__(self, distance_matrix, depot):
+        """
+        Parameters:
+        - distance_matrix: 2D array of distances between nodes
+        - depot: Index of the depot node
+        """
+        self.distance_matrix = np.asarray(distance_matrix)
+        self.depot = depot
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def scan(self, customer, route):
+        """Insertion costs of a customer at every position of a route, best two kept"""
+        tour = np.array([self.depot] + list(route) + [self.depot], dtype=np.int64)
+        costs = (self.distance_matrix[tour[:-1], customer] + self.distance_matrix[customer, tour[1:]] -
+                 self.distance_matrix[tour[:-1], tour[1:]])
+        if len(costs) == 1:
+            return (float(costs[0]), 0, float('inf'), None)
+
+        first, second = np.argpartition(costs, 1)[:2]
+        if costs[second] < costs[first]:
+            first, second = second, first
+        return (float(costs[first]), int(first), float(costs[second]), int(second))
+
+    def get(self, customer, version, route):
+        """
+        Cached best and second-best insertion of a customer into a route
+
+        Parameters:
+        - customer: Node index
+        - version: Current version of the route
+        - route: The route (list of customer indices), only scanned on a cache miss
+
+        Returns:
+        - (best_cost, best_position, second_cost, second_position)
+        """
+        entries = self._entries.get(version)
+        if entries is None:
+            entries = self._entries[version] = {}
+        entry = entries.get(customer)
+        if entry is None:
+            self.misses += 1
+            entry = entries[customer] = self.scan(customer, route)
+        else:
+            self.hits += 1
+        return entry
+
+    def retire(self, version):
+        """Drop the entries of a route version that no longer exists"""
+        self._entries.pop(version, None)
+
+    def clear(self):
+        self._entries.clear()
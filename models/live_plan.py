@@ -0,0 +1,423 @@
+"""
+Live edits of a solved plan.
+
+Orders that arrive after the morning plan was solved are inserted into the
+existing routes instead of re-solving the whole instance:
+
+1. Best insertion: every route keeps its depot-to-depot tour and arc costs
+   as arrays plus a version number, and the best and second-best position of
+   a customer in a route are cached per route version (InsertionCache), so
+   only routes changed by the last edit or move are rescanned. The cheapest
+   capacity-feasible position over all routes wins (a new route is opened
+   only while the fleet has an unused vehicle).
+2. Bounded re-optimization: the edited customer and its nearest routed
+   neighbours are relocated between routes while that pays off (at most
+   max_moves moves), then the touched routes are re-sequenced with the
+   route polisher.
+
+Removing a customer frees capacity on its route, so the same bounded step
+runs around the removed customer's neighbours. Customers keep their node
+index for the whole life of the plan; removed nodes stay in the matrix but
+are no longer visited. A plan is not thread-safe, callers serialize edits.
+"""
+
+import itertools
+import numpy as np
+from models.cvrp import CVRPSolverBase
+from models.polish import polish_solution
+from models.insertion_cache import InsertionCache
+from models.distance_matrix import point_distances
+
+# Nearest routed customers reconsidered around every edit
+LIVE_NEIGHBORS = 10
+
+# Improving relocations allowed per edit
+LIVE_MAX_MOVES = 20
+
+# Nodes sampled to calibrate distance estimates for new customers
+LIVE_CALIBRATION_NODES = 200
+
+
+class LivePlan(CVRPSolverBase):
+    def __init__(self, distance_matrix, demands, depot, vehicle_capacity, max_vehicles, routes,
+                 coordinates=None, company_names=None, neighbors=LIVE_NEIGHBORS, max_moves=LIVE_MAX_MOVES):
+        """
+        Initialize an editable plan from a solved one (capacity constraints only)
+
+        Parameters:
+        - distance_matrix: 2D array of distances between nodes
+        - demands: Array of customer demands (demand[depot] should be 0)
+        - depot: Index of the depot node
+        - vehicle_capacity: Maximum capacity of each vehicle
+        - max_vehicles: Vehicles available, new routes are opened only below this count
+        - routes: The solved routes (lists of customer indices, depot excluded)
+        - coordinates: Optional node coordinates, used to estimate distances of new customers
+        - company_names: Optional list of names for each node
+        - neighbors: Nearest routed customers reconsidered around every edit
+        - max_moves: Improving relocations allowed per edit
+        """
+        num_nodes = len(distance_matrix)
+
+        # The matrix grows with every inserted customer; keep spare rows so most inserts don't copy it
+        self._matrix = np.zeros((num_nodes + max(16, num_nodes // 8),) * 2)
+        self._matrix[:num_nodes, :num_nodes] = np.asarray(distance_matrix, dtype=np.float64)
+        super().__init__(self._matrix[:num_nodes, :num_nodes], list(demands), depot, vehicle_capacity, max_vehicles)
+
+        self.coordinates = [list(point) for point in coordinates] if coordinates is not None else None
+        self.company_names = list(company_names) if company_names else None
+        self.neighbors = neighbors
+        self.max_moves = max_moves
+        self.removed = set()
+        self.edits = 0
+
+        # Cached route structures: tour with depot ends, its arc costs and load, plus a
+        # version number that changes whenever the route does
+        self.routes = []
+        self.route_versions = []
+        self._tours = []
+        self._arcs = []
+        self._loads = []
+        self._versions = itertools.count()
+        self._route_of = {}
+        self._insertions = InsertionCache(self.distance_matrix, depot)
+        self._distance_estimate = None
+
+        for route in routes:
+            if route:
+                self._append_route(list(route))
+        self._update_best()
+
+    def customers(self):
+        """Customers currently in the plan (removed ones excluded)"""
+        return [node for node in range(self.num_nodes) if node != self.depot and node not in self.removed]
+
+    # Route cache -----------------------------------------------------------
+
+    def _append_route(self, route):
+        self.routes.append(None)
+        self.route_versions.append(None)
+        self._tours.append(None)
+        self._arcs.append(None)
+        self._loads.append(None)
+        self._set_route(len(self.routes) - 1, route)
+
+    def _set_route(self, r, route):
+        """Replace route r and refresh its cached structures"""
+        tour = np.array([self.depot] + route + [self.depot], dtype=np.int64)
+        self.routes[r] = route
+        self._tours[r] = tour
+        self._arcs[r] = self.distance_matrix[tour[:-1], tour[1:]]
+        self._loads[r] = self.calculate_route_load(route)
+        if self.route_versions[r] is not None:
+            self._insertions.retire(self.route_versions[r])
+        self.route_versions[r] = next(self._versions)
+        for customer in route:
+            self._route_of[customer] = r
+
+    def _drop_empty_routes(self):
+        keep = [r for r, route in enumerate(self.routes) if route]
+        if len(keep) == len(self.routes):
+            return
+        for r, route in enumerate(self.routes):
+            if not route:
+                self._insertions.retire(self.route_versions[r])
+        for name in ('routes', 'route_versions', '_tours', '_arcs', '_loads'):
+            values = getattr(self, name)
+            setattr(self, name, [values[r] for r in keep])
+        self._route_of = {customer: r for r, route in enumerate(self.routes) for customer in route}
+
+    def _update_best(self):
+        self.best_solution = [list(route) for route in self.routes]
+        self.best_cost = float(sum(arcs.sum() for arcs in self._arcs))
+
+    # Insertion -------------------------------------------------------------
+
+    def _route_insertions(self, customer, exclude=None):
+        """Cached (route, best_cost, best_position, second_cost, second_position) of every route with room"""
+        demand = self.demands[customer]
+        for r in range(len(self.routes)):
+            if r == exclude or not self.routes[r] or self._loads[r] + demand > self.vehicle_capacity:
+                continue
+            yield (r,) + self._insertions.get(customer, self.route_versions[r], self.routes[r])
+
+    def _new_route_insertion(self, customer):
+        """(route index, position, cost) of opening a new route, or None if no vehicle is free"""
+        if (sum(1 for route in self.routes if route) < self.max_vehicles and
+                self.demands[customer] <= self.vehicle_capacity):
+            cost = float(self.distance_matrix[self.depot, customer] + self.distance_matrix[customer, self.depot])
+            return (len(self.routes), 0, cost)
+        return None
+
+    def best_insertion(self, customer, exclude=None):
+        """
+        Cheapest capacity-feasible insertion of a customer
+
+        Parameters:
+        - customer: Node index
+        - exclude: Optional route index to skip (the customer's own route when relocating)
+
+        Returns:
+        - (route index, position, cost increase) or None; a route index equal to
+          len(routes) means opening a new route
+        """
+        best = None
+        for r, best_cost, best_position, _, _ in self._route_insertions(customer, exclude):
+            if best is None or best_cost < best[2]:
+                best = (r, best_position, best_cost)
+
+        new_route = self._new_route_insertion(customer)
+        if new_route is not None and (best is None or new_route[2] < best[2]):
+            best = new_route
+        return best
+
+    def insertion_options(self, customer, k=2):
+        """The k cheapest capacity-feasible insertions of a customer, as (route index, position, cost)"""
+        options = []
+        for r, best_cost, best_position, second_cost, second_position in self._route_insertions(customer):
+            options.append((r, best_position, best_cost))
+            if second_position is not None:
+                options.append((r, second_position, second_cost))
+        new_route = self._new_route_insertion(customer)
+        if new_route is not None:
+            options.append(new_route)
+        options.sort(key=lambda option: option[2])
+        return options[:k]
+
+    def _insert(self, customer, r, position):
+        if r == len(self.routes):
+            self._append_route([customer])
+        else:
+            route = list(self.routes[r])
+            route.insert(position, customer)
+            self._set_route(r, route)
+
+    def _remove(self, customer):
+        """Take a customer out of its route; returns the route index and the cost decrease"""
+        r = self._route_of.pop(customer)
+        route = list(self.routes[r])
+        k = route.index(customer)
+        previous = route[k - 1] if k > 0 else self.depot
+        following = route[k + 1] if k + 1 < len(route) else self.depot
+        gain = (self.distance_matrix[previous, customer] + self.distance_matrix[customer, following] -
+                self.distance_matrix[previous, following])
+        del route[k]
+        self._set_route(r, route)
+        return r, float(gain)
+
+    # New nodes -------------------------------------------------------------
+
+    def estimate_distances(self, point):
+        """
+        Distances between a new point and every node, estimated from coordinates
+
+        The metric (Euclidean or haversine) and a scale factor are calibrated once
+        against the depot row of the matrix, so road-distance matrices get a
+        road/crow-fly detour factor instead of straight-line distances. Nodes
+        inserted without coordinates are reached through the cheapest node that
+        has coordinates, using the matrix for the last leg.
+
+        Returns:
+        - distances_from (point -> node) and distances_to (node -> point) arrays
+        """
+        if self.coordinates is None:
+            raise ValueError("This plan has no coordinates; pass the new customer's distances explicitly")
+
+        located = np.array([node for node in range(min(len(self.coordinates), self.num_nodes))
+                            if self.coordinates[node] is not None], dtype=np.int64)
+        if self.depot not in located:
+            raise ValueError("The depot has no coordinates; pass the new customer's distances explicitly")
+
+        if self._distance_estimate is None:
+            sample = [node for node in located.tolist() if node != self.depot]
+            sample = sample[:LIVE_CALIBRATION_NODES]
+            actual = np.asarray(self.distance_matrix[self.depot, sample], dtype=np.float64)
+            best = None
+            for metric in ('euclidean', 'haversine'):
+                estimate = point_distances(self.coordinates[self.depot], [self.coordinates[node] for node in sample], metric)
+                usable = estimate > 1e-9
+                if not usable.any():
+                    continue
+                ratios = actual[usable] / estimate[usable]
+                scale = float(np.median(ratios))
+                spread = float(np.std(ratios) / scale) if scale > 0 else float('inf')
+                if best is None or spread < best[0]:
+                    best = (spread, metric, scale if scale > 0 else 1.0)
+            self._distance_estimate = (best[1], best[2]) if best else ('euclidean', 1.0)
+
+        metric, scale = self._distance_estimate
+        estimate = scale * point_distances(point, [self.coordinates[node] for node in located], metric)
+        distances_from = np.empty(self.num_nodes)
+        distances_from[located] = estimate
+        distances_to = distances_from.copy()
+
+        unlocated = np.setdiff1d(np.arange(self.num_nodes), located)
+        if len(unlocated):
+            distances_from[unlocated] = np.min(
+                estimate[:, None] + self.distance_matrix[np.ix_(located, unlocated)], axis=0)
+            distances_to[unlocated] = np.min(
+                self.distance_matrix[np.ix_(unlocated, located)] + estimate[None, :], axis=1)
+        return distances_from, distances_to
+
+    def add_node(self, demand, coordinate=None, name=None, distances_from=None, distances_to=None):
+        """
+        Append a node to the plan's matrix (it is not routed yet)
+
+        Parameters:
+        - demand: Demand of the new customer
+        - coordinate: Optional (x, y) or (lat, lng) of the new customer
+        - name: Optional display name
+        - distances_from / distances_to: Optional distances from / to every existing node;
+          estimated from the coordinates when not given
+
+        Returns:
+        - The new node index
+        """
+        node = self.num_nodes
+        if distances_from is None or distances_to is None:
+            if coordinate is None:
+                raise ValueError("A new customer needs coordinates or explicit distances")
+            estimated_from, estimated_to = self.estimate_distances(coordinate)
+            distances_from = estimated_from if distances_from is None else distances_from
+            distances_to = estimated_to if distances_to is None else distances_to
+        distances_from = np.asarray(distances_from, dtype=np.float64)
+        distances_to = np.asarray(distances_to, dtype=np.float64)
+        if len(distances_from) != node or len(distances_to) != node:
+            raise ValueError(f"Expected {node} distances for the new customer")
+
+        if node == len(self._matrix):
+            grown = np.zeros((2 * node,) * 2)
+            grown[:node, :node] = self._matrix[:node, :node]
+            self._matrix = grown
+        self._matrix[node, :node] = distances_from
+        self._matrix[:node, node] = distances_to
+        self._matrix[node, node] = 0.0
+
+        self.num_nodes = node + 1
+        self.distance_matrix = self._matrix[:self.num_nodes, :self.num_nodes]
+        self._insertions.distance_matrix = self.distance_matrix
+        self.demands.append(demand)
+        if self.coordinates is not None:
+            self.coordinates.append(list(coordinate) if coordinate is not None else None)
+        if self.company_names is not None:
+            self.company_names.append(name or f"Customer {node}")
+
+        # Tours index the matrix directly, arc caches stay valid
+        return node
+
+    # Edits -----------------------------------------------------------------
+
+    def _nearest_routed(self, node):
+        """The routed customers closest to a node (in either direction)"""
+        routed = np.fromiter(self._route_of.keys(), dtype=np.int64, count=len(self._route_of))
+        routed = routed[routed != node]
+        if not len(routed):
+            return []
+        distances = np.minimum(self.distance_matrix[node, routed], self.distance_matrix[routed, node])
+        k = min(self.neighbors, len(routed))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        return routed[nearest[np.argsort(distances[nearest])]].tolist()
+
+    def _reoptimize(self, candidates, touched):
+        """Relocate candidates between routes while that pays off, then polish the touched routes"""
+        moves = 0
+        improved = True
+        while improved and moves < self.max_moves:
+            improved = False
+            for customer in candidates:
+                if customer not in self._route_of:
+                    continue
+                r = self._route_of[customer]
+                route = self.routes[r]
+                k = route.index(customer)
+                previous = route[k - 1] if k > 0 else self.depot
+                following = route[k + 1] if k + 1 < len(route) else self.depot
+                gain = (self.distance_matrix[previous, customer] + self.distance_matrix[customer, following] -
+                        self.distance_matrix[previous, following])
+
+                best = self.best_insertion(customer, exclude=r)
+                if best is not None and best[2] < gain - 1e-9:
+                    self._remove(customer)
+                    self._insert(customer, best[0], best[1])
+                    touched.update((r, best[0]))
+                    moves += 1
+                    improved = True
+                    if moves >= self.max_moves:
+                        break
+
+        # Polish the routes that changed (empty routes are dropped afterwards)
+        touched = sorted(r for r in touched if r < len(self.routes) and self.routes[r])
+        polished = polish_solution(self.distance_matrix, self.depot, [self.routes[r] for r in touched], parallel=False)
+        for r, route in zip(touched, polished):
+            if route != self.routes[r]:
+                self._set_route(r, route)
+
+        self._drop_empty_routes()
+        self._update_best()
+        return moves
+
+    def insert_customer(self, customer):
+        """
+        Route a customer (already in the matrix) at its best position, then re-optimize around it
+
+        Returns:
+        - Dictionary with the route (1-based id), insertion cost, relocations made and new plan cost
+        """
+        if customer in self._route_of:
+            raise ValueError(f"Customer {customer} is already routed")
+        if customer == self.depot or not 0 <= customer < self.num_nodes:
+            raise ValueError(f"Invalid customer index {customer}")
+
+        options = self.insertion_options(customer)
+        if not options:
+            raise ValueError("No vehicle has enough spare capacity for this order")
+        r, position, insertion_cost = options[0]
+
+        # Runner-up slot, reported to the dispatcher as the alternative
+        alternative = None
+        if len(options) > 1:
+            alternative = {
+                'route': options[1][0] + 1 if options[1][0] < len(self.routes) else 'new',
+                'position': options[1][1],
+                'insertion_cost': options[1][2]
+            }
+        self._insert(customer, r, position)
+        self.removed.discard(customer)
+
+        moves = self._reoptimize([customer] + self._nearest_routed(customer), {r})
+        self.edits += 1
+        return {
+            'customer': customer,
+            'route': self._route_of[customer] + 1,
+            'insertion_cost': insertion_cost,
+            'alternative': alternative,
+            'relocations': moves,
+            'cost': self.best_cost
+        }
+
+    def remove_customer(self, customer):
+        """
+        Take a customer out of the plan, then re-optimize around the freed capacity
+
+        Returns:
+        - Dictionary with the saving, relocations made and new plan cost
+        """
+        if customer not in self._route_of:
+            raise ValueError(f"Customer {customer} is not in the plan")
+
+        r, saving = self._remove(customer)
+        self.removed.add(customer)
+
+        moves = self._reoptimize(self._nearest_routed(customer), {r})
+        self.edits += 1
+        return {
+            'customer': customer,
+            'removal_saving': saving,
+            'relocations': moves,
+            'cost': self.best_cost
+        }
+
+    def _extra_solution_details(self, routes):
+        return {
+            'live_edits': self.edits,
+            'removed_customers': sorted(self.removed)
+        }
@@ -0,0 +1,451 @@
+"""
+Multi-depot CVRP.
+
+Every route starts and ends at one of several depots. The problem is solved
+in three steps:
+
+1. Assignment: every customer goes to a depot. The cost of a customer at a
+   depot is the out-and-back distance, computed for all pairs at once.
+   'nearest' takes the cheapest depot; 'regret' assigns customers in
+   decreasing order of regret (second cheapest minus cheapest depot) to the
+   cheapest depot whose fleet still has capacity for them.
+2. Per-depot solves: each depot with its customers is an ordinary CVRP,
+   solved with simulated annealing on its own sub-matrix. Sub-problems are
+   independent, so they run in parallel worker processes.
+3. Inter-depot exchange: customers are relocated to routes of another depot
+   that serve their nearest neighbours whenever that is cheaper, which
+   rebalances the border between depots. Customers of an overloaded route
+   (a depot whose fleet was too tight for its solve) may move to any
+   neighbouring route with room, even at a cost. Every route is then polished.
+"""
+
+import os
+import time
+import random
+import logging
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from models.cvrp import CVRPSolverBase, CVRP_SimulatedAnnealing
+from models.polish import polish_solution
+from models.split import split_tour
+
+logger = logging.getLogger(__name__)
+
+# Below this many customers in total the process pool costs more than it saves
+MULTI_DEPOT_PARALLEL_MIN_CUSTOMERS = 100
+
+# Nearest customers whose routes are tried in the exchange pass
+EXCHANGE_NEIGHBORS = 10
+
+
+def assign_customers(distance_matrix, demands, depots, customers, rule='regret', depot_capacities=None):
+    """
+    Assign customers to depots
+
+    Parameters:
+    - distance_matrix: 2D array of distances between nodes
+    - demands: Array of node demands
+    - depots: List of depot indices
+    - customers: List of customer indices
+    - rule: 'nearest' or 'regret'
+    - depot_capacities: Optional total load each depot's fleet can carry (used by 'regret')
+
+    Returns:
+    - Array with the depot position (index into depots) of every customer
+    """
+    matrix = np.asarray(distance_matrix)
+    depots = np.asarray(depots, dtype=np.int64)
+    customers = np.asarray(customers, dtype=np.int64)
+    if not len(customers):
+        return np.zeros(0, dtype=np.int64)
+
+    # Out-and-back cost of every (depot, customer) pair
+    costs = np.asarray(matrix[np.ix_(depots, customers)], dtype=np.float64) + \
+        np.asarray(matrix[np.ix_(customers, depots)], dtype=np.float64).T
+    nearest = np.argmin(costs, axis=0)
+    if rule == 'nearest' or len(depots) == 1 or depot_capacities is None:
+        return nearest
+    if rule != 'regret':
+        raise ValueError(f"Unknown depot assignment rule '{rule}'")
+
+    ordered = np.sort(costs, axis=0)
+    regret = ordered[1] - ordered[0]
+    preferences = np.argsort(costs, axis=0)
+    demand = np.asarray(demands, dtype=np.float64)[customers]
+
+    remaining = np.asarray(depot_capacities, dtype=np.float64).copy()
+    assignment = nearest.copy()
+    for k in np.argsort(-regret, kind='stable'):
+        for depot in preferences[:, k]:
+            if remaining[depot] >= demand[k]:
+                break
+        else:
+            # No fleet has room left: the depot with the most spare capacity takes it
+            depot = int(np.argmax(remaining))
+        assignment[k] = depot
+        remaining[depot] -= demand[k]
+    return assignment
+
+
+# Cancel event shared with the worker processes, set by _init_depot_worker
+_worker_cancel_event = None
+
+
+def _init_depot_worker(cancel_event):
+    """Worker initializer: keep the pool's cancel event for the SA solves"""
+    global _worker_cancel_event
+    _worker_cancel_event = cancel_event
+
+
+def _solve_depot_task(task):
+    """Worker entry point: solve one depot's sub-problem (node 0 = depot), returns its routes"""
+    sub_matrix, sub_demands, vehicle_capacity, vehicles, sa_params, seed = task
+    if seed is not None:
+        random.seed(seed)
+    solver = CVRP_SimulatedAnnealing(sub_matrix, sub_demands, 0, vehicle_capacity, max_vehicles=vehicles,
+                                     cancel_event=_worker_cancel_event, persist_preprocessing=False, **sa_params)
+    routes, _, _, _ = solver.solve()
+    return [route for route in routes if route]
+
+
+class CVRP_MultiDepot(CVRPSolverBase):
+    def __init__(self, distance_matrix, demands, depots, vehicle_capacity, max_vehicles=5,
+                 depot_vehicles=None, assignment_rule='regret', cancel_event=None, sa_params=None,
+                 parallel=None, max_workers=None, exchange_passes=3, seed=None):
+        """
+        Initialize the multi-depot solver (capacity constraints only)
+
+        Parameters:
+        - distance_matrix: 2D array of distances between nodes
+        - demands: Array of node demands (0 for every depot)
+        - depots: List of depot indices
+        - vehicle_capacity: Maximum capacity of each vehicle
+        - max_vehicles: Total fleet, split evenly over the depots unless depot_vehicles is given
+        - depot_vehicles: Optional list with the number of vehicles at each depot
+        - assignment_rule: 'regret' (capacity-aware) or 'nearest'
+        - cancel_event: Optional threading.Event; when set, solve() stops early
+          and unsolved depots keep a simple capacity split
+        - sa_params: Optional keyword arguments for the per-depot SA solvers
+        - parallel: Force (True) or disable (False) worker processes; by default they are
+          used with several CPUs and enough customers
+        - max_workers: Optional process pool size (defaults to the CPU count)
+        - exchange_passes: Maximum passes of the inter-depot exchange
+        - seed: Optional random seed (each depot solve gets seed + its position)
+        """
+        depots = [int(depot) for depot in depots]
+        if not depots:
+            raise ValueError("At least one depot is required")
+        super().__init__(distance_matrix, demands, depots[0], vehicle_capacity, max_vehicles, cancel_event)
+        self.depots = depots
+        self._depot_set = set(depots)
+
+        # Every depot needs a vehicle, and the depot fleets may not add up to more than max_vehicles
+        if len(depots) > max_vehicles:
+            raise ValueError(f"{len(depots)} depots need at least {len(depots)} vehicles, "
+                             f"but max_vehicles is {max_vehicles}")
+        if depot_vehicles is None:
+            share, extra = divmod(max_vehicles, len(depots))
+            depot_vehicles = [share + (1 if k < extra else 0) for k in range(len(depots))]
+        if len(depot_vehicles) != len(depots):
+            raise ValueError("depot_vehicles needs one value per depot")
+        depot_vehicles = [int(vehicles) for vehicles in depot_vehicles]
+        if min(depot_vehicles) < 1:
+            raise ValueError("Every depot needs at least one vehicle")
+        if sum(depot_vehicles) > max_vehicles:
+            raise ValueError(f"depot_vehicles add up to {sum(depot_vehicles)} vehicles, "
+                             f"but max_vehicles is {max_vehicles}")
+        self.depot_vehicles = depot_vehicles
+
+        self.assignment_rule = assignment_rule
+        self.sa_params = dict(sa_params or {})
+        self.parallel = parallel
+        self.max_workers = max_workers
+        self.exchange_passes = exchange_passes
+        self.seed = seed
+
+        # Customer -> depot it is served from, and the depot of every route
+        self.depot_of = {}
+        self.route_depots = []
+
+    def customers(self):
+        """All customer indices (every node except the depots)"""
+        return [node for node in range(self.num_nodes) if node not in self._depot_set]
+
+    def is_valid_solution(self, routes):
+        """Every customer served exactly once, no depot inside a route"""
+        served = [customer for route in routes for customer in route]
+        return len(served) == len(set(served)) and sorted(served) == self.customers()
+
+    def route_depot(self, route):
+        return self.depot_of.get(route[0], self.depot) if route else self.depot
+
+    def calculate_route_distance(self, route):
+        if not route:
+            return 0
+        depot = self.route_depot(route)
+        distance = self.distance_matrix[depot][route[0]]
+        for i in range(len(route) - 1):
+            distance += self.distance_matrix[route[i]][route[i + 1]]
+        distance += self.distance_matrix[route[-1]][depot]
+        return distance
+
+    def assign(self):
+        """Assign every customer to a depot; returns the customer lists per depot"""
+        customers = self.customers()
+        capacities = [vehicles * self.vehicle_capacity for vehicles in self.depot_vehicles]
+        assignment = assign_customers(self.distance_matrix, self.demands, self.depots, customers,
+                                      self.assignment_rule, capacities)
+        groups = [[] for _ in self.depots]
+        for customer, position in zip(customers, assignment.tolist()):
+            groups[position].append(customer)
+            self.depot_of[customer] = self.depots[position]
+        return groups
+
+    def _depot_task(self, position, group):
+        nodes = [self.depots[position]] + group
+        sub_matrix = np.asarray(self.distance_matrix[np.ix_(nodes, nodes)], dtype=np.float64)
+        sub_demands = [self.demands[node] for node in nodes]
+        seed = self.seed + position if self.seed is not None else None
+        return nodes, (sub_matrix, sub_demands, self.vehicle_capacity, self.depot_vehicles[position],
+                       self.sa_params, seed)
+
+    def _fallback_routes(self, position, group):
+        """Capacity split of a depot's customers in farthest-first order (used for unsolved depots)"""
+        depot = self.depots[position]
+        order = sorted(group, key=lambda c: -self.distance_matrix[depot][c])
+        routes, _ = split_tour(self.distance_matrix, self.demands, depot, self.vehicle_capacity,
+                               order, max_routes=self.depot_vehicles[position])
+        return routes
+
+    def solve_depots(self, groups, callback=None):
+        """
+        Solve every depot's sub-problem, in worker processes when worthwhile
+
+        Returns:
+        - List with the routes (global indices) of every depot
+        """
+        jobs = [(position, group) for position, group in enumerate(groups) if group]
+        results = {position: [] for position in range(len(groups))}
+        tasks = {position: self._depot_task(position, group) for position, group in jobs}
+
+        parallel = self.parallel
+        if parallel is None:
+            parallel = ((os.cpu_count() or 1) > 1 and len(jobs) > 1 and
+                        sum(len(group) for _, group in jobs) >= MULTI_DEPOT_PARALLEL_MIN_CUSTOMERS)
+
+        solved = {}
+        if parallel:
+            try:
+                workers = self.max_workers or min(len(jobs), os.cpu_count() or 1)
+                # Spawned, not forked: the solve runs on a Flask thread, and forking a threaded
+                # process can deadlock the child on locks held by other threads
+                context = multiprocessing.get_context('spawn')
+                worker_cancel = context.Event()
+                executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                               initializer=_init_depot_worker, initargs=(worker_cancel,))
+                try:
+                    futures = {executor.submit(_solve_depot_task, tasks[position][1]): position
+                               for position, _ in jobs}
+                    pending = set(futures)
+                    while pending:
+                        # Worker processes can't see the job's threading.Event, so poll it while
+                        # waiting and hand a cancel over to the workers' own event
+                        done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            solved[futures[future]] = future.result()
+                            if callback:
+                                callback(len(solved), 0, 0.0, 0.0, int(80 * len(solved) / len(jobs)))
+                        if pending and self.is_cancel_requested():
+                            worker_cancel.set()
+                            break
+                finally:
+                    # Running solves stop at their next iteration once worker_cancel is set
+                    executor.shutdown(wait=True, cancel_futures=True)
+            except (OSError, RuntimeError, NotImplementedError) as e:
+                # Some hosts (serverless, restricted sandboxes) cannot start processes
+                logger.warning(f"Parallel depot solves unavailable, solving sequentially: {str(e)}")
+                solved = {}
+                parallel = False
+
+        if not parallel:
+            for position, _ in jobs:
+                if self.is_cancel_requested():
+                    break
+                _, task = tasks[position]
+                sub_matrix, sub_demands, capacity, vehicles, sa_params, seed = task
+                if seed is not None:
+                    random.seed(seed)
+                sub_solver = CVRP_SimulatedAnnealing(sub_matrix, sub_demands, 0, capacity, max_vehicles=vehicles,
+                                                     cancel_event=self.cancel_event, persist_preprocessing=False,
+                                                     **sa_params)
+                sub_routes, _, _, _ = sub_solver.solve()
+                solved[position] = [route for route in sub_routes if route]
+                if callback:
+                    callback(len(solved), 0, 0.0, 0.0, int(80 * len(solved) / len(jobs)))
+
+        for position, group in jobs:
+            nodes = tasks[position][0]
+            if position in solved:
+                results[position] = [[nodes[k] for k in route] for route in solved[position]]
+            else:
+                results[position] = self._fallback_routes(position, group)
+        return [results[position] for position in range(len(groups))]
+
+    def _scan_route(self, customer, route, depot):
+        """Cheapest insertion position and cost of a customer into a route of the given depot"""
+        tour = np.array([depot] + route + [depot], dtype=np.int64)
+        costs = (self.distance_matrix[tour[:-1], customer] + self.distance_matrix[customer, tour[1:]] -
+                 self.distance_matrix[tour[:-1], tour[1:]])
+        position = int(np.argmin(costs))
+        return position, float(costs[position])
+
+    def exchange(self, routes, route_depots):
+        """
+        Inter-depot relocation: move customers into routes of another depot that serve
+        their nearest neighbours (or a new route there) when that is cheaper, and out of
+        overloaded routes whenever a neighbouring route has room
+
+        Returns:
+        - routes, route_depots (empty routes removed) and the number of moves made
+        """
+        d = self.distance_matrix
+        customers = np.array(self.customers(), dtype=np.int64)
+        if len(customers) < 2 or len(self.depots) < 2:
+            return routes, route_depots, 0
+
+        k = min(EXCHANGE_NEIGHBORS, len(customers) - 1)
+        route_of = {customer: r for r, route in enumerate(routes) for customer in route}
+        loads = [self.calculate_route_load(route) for route in routes]
+        counts = {depot: sum(1 for r, route in enumerate(routes) if route and route_depots[r] == depot)
+                  for depot in self.depots}
+
+        moves = 0
+        for _ in range(self.exchange_passes):
+            improved = False
+            for customer in customers.tolist():
+                if self.is_cancel_requested():
+                    return routes, route_depots, moves
+                r = route_of[customer]
+                route = routes[r]
+                depot = route_depots[r]
+                i = route.index(customer)
+                previous = route[i - 1] if i > 0 else depot
+                following = route[i + 1] if i + 1 < len(route) else depot
+                gain = d[previous][customer] + d[customer][following] - d[previous][following]
+
+                # Routes of other depots serving this customer's nearest neighbours; customers
+                # of an overloaded route may also move within their depot, whatever it costs
+                overloaded = loads[r] > self.vehicle_capacity
+                if overloaded:
+                    gain = float('inf')
+                row = d[customer, customers]
+                nearest = customers[np.argpartition(row, k)[:k + 1]]
+                targets = {route_of[other] for other in nearest.tolist()
+                           if route_of[other] != r and (overloaded or route_depots[route_of[other]] != depot)}
+
+                best = None
+                for t in targets:
+                    if loads[t] + self.demands[customer] > self.vehicle_capacity:
+                        continue
+                    position, cost = self._scan_route(customer, routes[t], route_depots[t])
+                    if best is None or cost < best[2]:
+                        best = (t, position, cost)
+
+                # A new route at a depot with a free vehicle
+                for position, other_depot in enumerate(self.depots):
+                    if ((other_depot == depot and not overloaded) or
+                            counts[other_depot] >= self.depot_vehicles[position]):
+                        continue
+                    cost = d[other_depot][customer] + d[customer][other_depot]
+                    if best is None or cost < best[2]:
+                        best = (None, other_depot, cost)
+
+                if best is None or best[2] >= gain - 1e-9:
+                    continue
+
+                route.pop(i)
+                loads[r] -= self.demands[customer]
+                if not route:
+                    counts[depot] -= 1
+                if best[0] is None:
+                    routes.append([customer])
+                    route_depots.append(best[1])
+                    loads.append(self.demands[customer])
+                    counts[best[1]] += 1
+                    route_of[customer] = len(routes) - 1
+                else:
+                    t, position, _ = best
+                    routes[t].insert(position, customer)
+                    loads[t] += self.demands[customer]
+                    route_of[customer] = t
+                self.depot_of[customer] = route_depots[route_of[customer]]
+                moves += 1
+                improved = True
+            if not improved:
+                break
+
+        kept = [r for r, route in enumerate(routes) if route]
+        return [routes[r] for r in kept], [route_depots[r] for r in kept], moves
+
+    def solve(self, callback=None):
+        """
+        Assign, solve every depot, exchange customers between depots and polish
+
+        Parameters:
+        - callback: Optional progress function, same signature as the SA callback
+
+        Returns:
+        - best_solution, best_cost, cost_history, temp_history (as for the SA solver);
+          the depot of every route is in route_depots
+        """
+        started = time.time()
+        groups = self.assign()
+        depot_routes = self.solve_depots(groups, callback)
+
+        routes, route_depots = [], []
+        for depot, group_routes in zip(self.depots, depot_routes):
+            for route in group_routes:
+                routes.append(list(route))
+                route_depots.append(depot)
+        self.cost_history.append(self.calculate_total_distance(routes))
+        self.temp_history.append(0.0)
+
+        routes, route_depots, moves = self.exchange(routes, route_depots)
+
+        # Re-sequence every route around its own depot
+        for depot in self.depots:
+            indices = [r for r, route_depot in enumerate(route_depots) if route_depot == depot]
+            polished = polish_solution(self.distance_matrix, depot, [routes[r] for r in indices])
+            for r, route in zip(indices, polished):
+                routes[r] = route
+
+        self.best_solution = routes
+        self.route_depots = route_depots
+        self.best_cost = self.calculate_total_distance(routes)
+        self.cost_history.append(self.best_cost)
+        self.temp_history.append(0.0)
+        logger.info(f"Multi-depot solve: {len(self.depots)} depots, {moves} inter-depot moves, "
+                    f"cost {self.best_cost:.2f} in {time.time() - started:.1f}s")
+
+        if callback:
+            callback(len(self.depots), 0, 0.0, self.best_cost, 100)
+
+        return self.best_solution, self.best_cost, self.cost_history, self.temp_history
+
+    def _extra_route_details(self, route, index):
+        return {'depot': self.route_depot(route)}
+
+    def _extra_solution_details(self, routes):
+        depots = []
+        for position, depot in enumerate(self.depots):
+            depot_routes = [route for route in routes if route and self.route_depot(route) == depot]
+            depots.append({
+                'depot': depot,
+                'vehicles': self.depot_vehicles[position],
+                'routes': len(depot_routes),
+                'customers': sum(len(route) for route in depot_routes),
+                'load': sum(self.calculate_route_load(route) for route in depot_routes),
+                'distance': self.calculate_total_distance(depot_routes)
+            })
+        return {'depots': depots}
@@ -0,0 +1,199 @@
+"""
+Route polishing: once customers are assigned to vehicles, every route is an
+independent TSP through the depot.
+
+- Routes with up to POLISH_EXACT_MAX_STOPS stops are re-sequenced optimally
+  with Held-Karp (the vectorized subset DP from models/exact.py).
+- Longer routes get 2-opt and Or-opt (moving chains of 1-3 stops) until no
+  move improves.
+
+Routes are independent, so they are polished in parallel across a process
+pool. Each worker only receives its route's sub-matrix, so the (possibly
+huge) full matrix is never pickled.
+"""
+
+import os
+import logging
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from models.exact import held_karp_all_subsets, held_karp_path
+from models.decomposition import two_opt_route
+
+logger = logging.getLogger(__name__)
+
+# Longest route re-sequenced exactly (2^12 * 12 DP states)
+POLISH_EXACT_MAX_STOPS = 12
+
+# A spawned pool takes about 0.4 s to start, so it is only used when polishing is
+# estimated to take longer than this sequentially
+POLISH_PARALLEL_MIN_SECONDS = 1.0
+
+# Measured sequential cost per unit of work: Held-Karp is 2^n * n^2, the 2-opt/Or-opt
+# loop about n^3 (a 12-stop route takes ~3 ms exactly, a 150-stop route ~0.5 s)
+HELD_KARP_SECONDS_PER_STATE = 5.5e-9
+LOCAL_SEARCH_SECONDS_PER_STEP = 1.5e-7
+
+
+def estimated_polish_seconds(routes):
+    """Estimated sequential polishing time of a list of routes, in seconds"""
+    seconds = 0.0
+    for route in routes:
+        n = len(route)
+        if n <= POLISH_EXACT_MAX_STOPS:
+            seconds += (1 << n) * n * n * HELD_KARP_SECONDS_PER_STATE
+        else:
+            seconds += n ** 3 * LOCAL_SEARCH_SECONDS_PER_STEP
+    return seconds
+
+
+def held_karp_route(matrix, stops):
+    """
+    Optimal order of the stops of one route
+
+    Parameters:
+    - matrix: 2D array of distances where node 0 is the depot
+    - stops: List of stop indices into matrix
+
+    Returns:
+    - The stops in optimal visiting order
+    """
+    if len(stops) < 3:
+        # One or two stops: compare both directions directly
+        if len(stops) == 2:
+            a, b = stops
+            if matrix[0][b] + matrix[b][a] + matrix[a][0] < matrix[0][a] + matrix[a][b] + matrix[b][0]:
+                return [b, a]
+        return list(stops)
+
+    dp, parent = held_karp_all_subsets(matrix, 0, stops)
+    full = (1 << len(stops)) - 1
+    closing = np.asarray(matrix, dtype=np.float64)[np.array(stops), 0]
+    last = int(np.argmin(dp[full] + closing))
+    return [stops[k] for k in held_karp_path(parent, full, last)]
+
+
+def or_opt_route(matrix, route, max_chain=3):
+    """
+    Improve a route by moving chains of up to max_chain consecutive stops elsewhere in it
+
+    Parameters:
+    - matrix: 2D array (or list of lists) of distances where node 0 is the depot
+    - route: List of stop indices (depot excluded)
+    - max_chain: Longest chain moved
+
+    Returns:
+    - The improved route (a new list)
+    """
+    tour = [0] + list(route) + [0]
+    improved = True
+    while improved:
+        improved = False
+        for length in range(1, max_chain + 1):
+            for i in range(1, len(tour) - length):
+                first, last = tour[i], tour[i + length - 1]
+                before, after = tour[i - 1], tour[i + length]
+                removal_gain = matrix[before][first] + matrix[last][after] - matrix[before][after]
+
+                for j in range(len(tour) - 1):
+                    # Insert between tour[j] and tour[j + 1], outside the chain and its old slot
+                    if i - 1 <= j <= i + length - 1:
+                        continue
+                    a, b = tour[j], tour[j + 1]
+                    insert_cost = matrix[a][first] + matrix[last][b] - matrix[a][b]
+                    if insert_cost - removal_gain < -1e-9:
+                        chain = tour[i:i + length]
+                        del tour[i:i + length]
+                        position = j + 1 if j < i else j + 1 - length
+                        tour[position:position] = chain
+                        improved = True
+                        break
+                if improved:
+                    break
+            if improved:
+                break
+    return tour[1:-1]
+
+
+def polish_sub_route(matrix, stops):
+    """
+    Polish one route given its sub-matrix (node 0 = depot, stops 1..k)
+
+    Returns:
+    - The stop indices (into the sub-matrix) in the new order
+    """
+    if len(stops) <= POLISH_EXACT_MAX_STOPS:
+        return held_karp_route(matrix, stops)
+
+    matrix = np.asarray(matrix, dtype=np.float64).tolist()
+    route = list(stops)
+    while True:
+        improved = or_opt_route(matrix, two_opt_route(matrix, 0, route))
+        if improved == route:
+            return route
+        route = improved
+
+
+def _route_cost(matrix, route):
+    tour = [0] + list(route) + [0]
+    return sum(matrix[a][b] for a, b in zip(tour, tour[1:]))
+
+
+def _polish_task(task):
+    """Worker entry point: returns the polished order or None if it is not cheaper"""
+    matrix, stops = task
+    polished = polish_sub_route(matrix, stops)
+    if _route_cost(matrix, polished) < _route_cost(matrix, stops) - 1e-9:
+        return polished
+    return None
+
+
+def polish_solution(distance_matrix, depot, routes, max_workers=None, parallel=None):
+    """
+    Re-sequence every route of a solution (customers never change routes)
+
+    Parameters:
+    - distance_matrix: 2D array of distances between nodes
+    - depot: Index of the depot node
+    - routes: List of routes (lists of customer indices, depot excluded)
+    - max_workers: Optional process pool size (defaults to the CPU count)
+    - parallel: Force (True) or disable (False) the process pool; by default it is
+      used only when there are several routes and enough estimated work to pay for its startup
+
+    Returns:
+    - List of polished routes (never longer than the originals)
+    """
+    matrix = np.asarray(distance_matrix)
+    tasks = []
+    for route in routes:
+        nodes = [depot] + list(route)
+        sub_matrix = np.asarray(matrix[np.ix_(nodes, nodes)], dtype=np.float64)
+        tasks.append((sub_matrix, list(range(1, len(nodes)))))
+
+    if parallel is None:
+        parallel = ((os.cpu_count() or 1) > 1 and len(routes) > 1 and
+                    estimated_polish_seconds(routes) >= POLISH_PARALLEL_MIN_SECONDS)
+
+    results = None
+    if parallel:
+        try:
+            workers = max_workers or min(len(tasks), os.cpu_count() or 1)
+            # Spawned, not forked: this runs on a Flask thread, and forking a threaded
+            # process can deadlock the child on locks held by other threads
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+                results = list(executor.map(_polish_task, tasks))
+        except (OSError, RuntimeError, NotImplementedError) as e:
+            # Some hosts (serverless, restricted sandboxes) cannot start processes
+            logger.warning(f"Parallel route polishing unavailable, polishing sequentially: {str(e)}")
+            results = None
+    if results is None:
+        results = [_polish_task(task) for task in tasks]
+
+    polished_routes = []
+    for route, polished in zip(routes, results):
+        if polished is None:
+            polished_routes.append(list(route))
+        else:
+            nodes = [depot] + list(route)
+            polished_routes.append([nodes[k] for k in polished])
+    return polished_routes
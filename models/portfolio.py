@@ -0,0 +1,140 @@
+"""
+Algorithm portfolio for the CVRP solvers.
+
+run_solver picks an engine (exact, sa, tabu, hgs, decomposition) and a
+parameter set from a few cheap instance features:
+- num_customers: number of customers
+- tightness: total demand / total fleet capacity (close to 1 = hard packing)
+- clustering: mean nearest-neighbour distance relative to a uniform random
+  layout of the same size (about 1 = uniform, well below 1 = clustered)
+- depot_centrality: mean depot-to-customer distance relative to the mean
+  customer-to-customer distance (below 1 = central depot, above = off-centre)
+- constrained: time windows or route limits are present (only SA handles them)
+- has_coordinates: node coordinates are available (needed for the sweep)
+
+The choice comes from the rules table in portfolio_rules.json, which is kept
+in the repo; its thresholds and parameter sets are hand-set. The first rule
+whose conditions all match wins.
+"""
+
+import os
+import json
+import math
+import random
+import numpy as np
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'portfolio_rules.json')
+
+# Rows sampled for the distance-based features (keeps them cheap on huge matrices)
+FEATURE_SAMPLE_SIZE = 200
+
+_rules_cache = None
+
+
+def load_rules(path=None):
+    """Load the rules table (the default table is read once and cached)"""
+    global _rules_cache
+    if path is not None:
+        with open(path) as f:
+            return json.load(f)['rules']
+    if _rules_cache is None:
+        with open(RULES_PATH) as f:
+            _rules_cache = json.load(f)['rules']
+    return _rules_cache
+
+
+def compute_instance_features(distance_matrix, demands, depot, vehicle_capacity, max_vehicles,
+                              coordinates=None, constrained=False):
+    """
+    Compute cheap instance features (at most FEATURE_SAMPLE_SIZE matrix rows are read)
+
+    Parameters:
+    - distance_matrix: 2D array of distances between nodes
+    - demands: Array of customer demands
+    - depot: Index of the depot node
+    - vehicle_capacity: Maximum capacity of each vehicle
+    - max_vehicles: Maximum number of vehicles
+    - coordinates: Optional list of node coordinates
+    - constrained: Whether time windows or route limits are used
+
+    Returns:
+    - Dictionary of feature values
+    """
+    num_nodes = len(distance_matrix)
+    customers = np.array([node for node in range(num_nodes) if node != depot], dtype=np.int64)
+    num_customers = len(customers)
+
+    total_demand = float(sum(demands[c] for c in customers))
+    fleet_capacity = float(vehicle_capacity) * max(1, max_vehicles)
+
+    features = {
+        'num_customers': num_customers,
+        'tightness': total_demand / fleet_capacity if fleet_capacity > 0 else float('inf'),
+        'clustering': 1.0,
+        'depot_centrality': 1.0,
+        'constrained': bool(constrained),
+        'has_coordinates': coordinates is not None and len(coordinates) == num_nodes
+    }
+    if num_customers < 2:
+        return features
+
+    # Sample customer rows; fixed seed so the same instance always gets the same features
+    rng = random.Random(num_customers)
+    sample = customers if num_customers <= FEATURE_SAMPLE_SIZE else np.array(
+        sorted(rng.sample(list(customers), FEATURE_SAMPLE_SIZE)), dtype=np.int64)
+
+    rows = np.asarray(distance_matrix[sample][:, customers], dtype=np.float64)
+    mean_distance = rows.sum() / (len(sample) * (num_customers - 1))
+    if mean_distance <= 0:
+        return features
+
+    # Ignore each customer's zero distance to itself when taking the nearest neighbour
+    own = np.searchsorted(customers, sample)
+    rows[np.arange(len(sample)), own] = np.inf
+    nearest = rows.min(axis=1).mean()
+
+    # Uniform points in a square: E[nearest] ~ 0.5 / sqrt(n), E[pairwise] ~ 0.5214 (unit side)
+    uniform_ratio = (0.5 / math.sqrt(num_customers)) / 0.5214
+    features['clustering'] = float((nearest / mean_distance) / uniform_ratio)
+
+    depot_row = np.asarray(distance_matrix[depot], dtype=np.float64)[customers]
+    features['depot_centrality'] = float(depot_row.mean() / mean_distance)
+
+    return features
+
+
+def _condition_matches(value, condition):
+    if isinstance(condition, dict):
+        if 'min' in condition and value < condition['min']:
+            return False
+        if 'max' in condition and value > condition['max']:
+            return False
+        return True
+    return value == condition
+
+
+def rule_matches(rule, features):
+    """Check whether every condition of a rule holds for the given features"""
+    return all(
+        name in features and _condition_matches(features[name], condition)
+        for name, condition in rule.get('when', {}).items()
+    )
+
+
+def select_engine(features, rules=None):
+    """
+    Pick the engine and parameter set for an instance
+
+    Parameters:
+    - features: Dictionary from compute_instance_features
+    - rules: Optional rules list (defaults to portfolio_rules.json)
+
+    Returns:
+    - engine: 'exact', 'sa', 'tabu', 'hgs' or 'decomposition'
+    - params: Dictionary of solver parameters from the rule
+    - rule_name: Name of the matching rule
+    """
+    for rule in (rules if rules is not None else load_rules()):
+        if rule_matches(rule, features):
+            return rule['engine'], dict(rule.get('params', {})), rule.get('name', '')
+    return 'sa', {}, 'fallback'
@@ -0,0 +1,277 @@
+"""
+Persistent instance preprocessing for the CVRP solvers.
+
+Everything that only depends on the instance - k-nearest-neighbour lists,
+the Clarke-Wright savings ranking, depot distance and angle orders, demand
+statistics - is computed once per distinct (distance matrix, demands, depot,
+coordinates) and reused by every later solve of the same customer base:
+re-solves, parameter tweaks, multi-start chains.
+
+Artifacts are keyed by a SHA-256 fingerprint of the instance content. They
+are kept in a small in-process LRU and written to PREPROCESS_CACHE_DIR as
+.npz files, so other workers and restarts reuse them too.
+"""
+
+import os
+import hashlib
+import tempfile
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger('preprocessing')
+
+PREPROCESS_CACHE_DIR = os.getenv('PREPROCESS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'cvrp_preprocessing'))
+PREPROCESS_MEMORY_ENTRIES = int(os.getenv('PREPROCESS_MEMORY_ENTRIES', 16))
+PREPROCESS_MAX_FILES = int(os.getenv('PREPROCESS_MAX_FILES', 500))
+
+# Neighbours stored per customer; solvers asking for fewer take a prefix of the list
+DEFAULT_NEIGHBORS = 20
+
+# Bump when the artifact layout changes so stale files are ignored
+PREPROCESS_VERSION = 1
+
+_memory_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def instance_fingerprint(distance_matrix, demands, depot, coordinates=None):
+    """
+    Content hash of an instance (row blocks are hashed, so memmapped matrices stay on disk)
+
+    Returns:
+    - Hex digest string
+    """
+    digest = hashlib.sha256()
+    digest.update(f"v{PREPROCESS_VERSION}:{len(distance_matrix)}:{depot}".encode())
+
+    block = max(1, (16 * 1024 * 1024) // (8 * max(1, len(distance_matrix))))
+    for start in range(0, len(distance_matrix), block):
+        rows = np.ascontiguousarray(np.asarray(distance_matrix[start:start + block], dtype=np.float64))
+        digest.update(rows.tobytes())
+
+    digest.update(np.ascontiguousarray(np.asarray(demands, dtype=np.float64)).tobytes())
+    if coordinates is not None:
+        digest.update(np.ascontiguousarray(np.asarray(coordinates, dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+class InstancePreprocessing:
+    """
+    Instance-only data shared by the solvers
+
+    Attributes:
+    - fingerprint: Content hash of the instance
+    - neighbors: (num_nodes, k) array, row c = nearest other customers of customer c
+      (the depot row is -1)
+    - savings_pairs: (m, 2) array of customer pairs (i, j), j among i's neighbours,
+      sorted by Clarke-Wright savings d(i,0) + d(0,j) - d(i,j), highest first
+    - savings: Savings value of every pair in savings_pairs
+    - depot_order: Customers sorted by distance from the depot, farthest first
+    - angle_order: Customers sorted by polar angle around the depot (None without coordinates)
+    - demand_stats: Dictionary with total, mean, max, min and std of customer demand
+    """
+
+    def __init__(self, fingerprint, neighbors, savings_pairs, savings, depot_order, angle_order, demand_stats):
+        self.fingerprint = fingerprint
+        self.neighbors = neighbors
+        self.savings_pairs = savings_pairs
+        self.savings = savings
+        self.depot_order = depot_order
+        self.angle_order = angle_order
+        self.demand_stats = demand_stats
+
+    def neighbor_lists(self, k):
+        """Dictionary customer -> its k nearest customers (nearest first)"""
+        k = min(k, self.neighbors.shape[1])
+        return {int(customer): self.neighbors[customer, :k].tolist() for customer in self.depot_order}
+
+    def to_arrays(self):
+        arrays = {
+            'neighbors': self.neighbors,
+            'savings_pairs': self.savings_pairs,
+            'savings': self.savings,
+            'depot_order': self.depot_order,
+            'demand_stats': np.array([self.demand_stats[key] for key in ('total', 'mean', 'max', 'min', 'std')])
+        }
+        if self.angle_order is not None:
+            arrays['angle_order'] = self.angle_order
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, fingerprint, arrays):
+        stats = arrays['demand_stats']
+        return cls(
+            fingerprint,
+            arrays['neighbors'],
+            arrays['savings_pairs'],
+            arrays['savings'],
+            arrays['depot_order'],
+            arrays['angle_order'] if 'angle_order' in arrays else None,
+            dict(zip(('total', 'mean', 'max', 'min', 'std'), (float(value) for value in stats)))
+        )
+
+
+def compute_preprocessing(distance_matrix, demands, depot, coordinates=None, k=DEFAULT_NEIGHBORS, fingerprint=None):
+    """
+    Compute the preprocessing artifact of an instance (no caching)
+
+    Parameters:
+    - distance_matrix: 2D array of distances between nodes
+    - demands: Array of node demands
+    - depot: Index of the depot node
+    - coordinates: Optional node coordinates (enables the angle order)
+    - k: Number of neighbours kept per customer
+    - fingerprint: Precomputed fingerprint, if available
+
+    Returns:
+    - InstancePreprocessing
+    """
+    num_nodes = len(distance_matrix)
+    fingerprint = fingerprint or instance_fingerprint(distance_matrix, demands, depot, coordinates)
+    customers = np.array([node for node in range(num_nodes) if node != depot], dtype=np.int64)
+    k = max(0, min(k, len(customers) - 1))
+
+    # k-NN lists, computed in row blocks
+    neighbors = np.full((num_nodes, k), -1, dtype=np.int64)
+    block = 256
+    for start in range(0, len(customers) if k > 0 else 0, block):
+        rows = customers[start:start + block]
+        distances = np.asarray(distance_matrix[rows][:, customers], dtype=np.float64)
+        distances[np.arange(len(rows)), np.arange(start, start + len(rows))] = np.inf
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(distances, nearest, axis=1).argsort(axis=1, kind='stable')
+        neighbors[rows] = customers[np.take_along_axis(nearest, order, axis=1)]
+
+    depot_distances = np.asarray(distance_matrix[depot], dtype=np.float64)
+    depot_return = np.asarray(distance_matrix[:, depot], dtype=np.float64)
+
+    # Savings d(i,0) + d(0,j) - d(i,j), restricted to neighbour pairs (the only ones worth merging)
+    if k > 0 and len(customers):
+        first = np.repeat(customers, k)
+        second = neighbors[customers].ravel()
+        pair_distances = np.asarray(distance_matrix[first, second], dtype=np.float64)
+        savings = depot_return[first] + depot_distances[second] - pair_distances
+        order = np.argsort(-savings, kind='stable')
+        savings_pairs = np.stack([first[order], second[order]], axis=1)
+        savings = savings[order]
+    else:
+        savings_pairs = np.zeros((0, 2), dtype=np.int64)
+        savings = np.zeros(0)
+
+    depot_order = customers[np.argsort(-depot_distances[customers], kind='stable')]
+
+    angle_order = None
+    if coordinates is not None and len(coordinates) == num_nodes:
+        points = np.asarray(coordinates, dtype=np.float64)
+        angles = np.arctan2(points[customers, 1] - points[depot, 1], points[customers, 0] - points[depot, 0])
+        angle_order = customers[np.argsort(angles, kind='stable')]
+
+    demand = np.asarray(demands, dtype=np.float64)[customers] if len(customers) else np.zeros(1)
+    demand_stats = {
+        'total': float(demand.sum()),
+        'mean': float(demand.mean()),
+        'max': float(demand.max()),
+        'min': float(demand.min()),
+        'std': float(demand.std())
+    }
+
+    return InstancePreprocessing(fingerprint, neighbors, savings_pairs, savings, depot_order, angle_order, demand_stats)
+
+
+def _cache_path(fingerprint, directory=None):
+    return os.path.join(directory or PREPROCESS_CACHE_DIR, f"{fingerprint}.npz")
+
+
+def _load_from_disk(fingerprint, directory=None):
+    path = _cache_path(fingerprint, directory)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as arrays:
+            return InstancePreprocessing.from_arrays(fingerprint, {name: arrays[name] for name in arrays.files})
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring unreadable preprocessing cache file {path}: {str(e)}")
+        return None
+
+
+def _save_to_disk(preprocessing, directory=None):
+    directory = directory or PREPROCESS_CACHE_DIR
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = _cache_path(preprocessing.fingerprint, directory)
+
+        # Write under a temporary name first so readers never see a partial file
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(temporary, **preprocessing.to_arrays())
+        os.replace(temporary, path)
+        _prune_disk_cache(directory)
+    except OSError as e:
+        logger.warning(f"Could not write preprocessing cache: {str(e)}")
+
+
+def _prune_disk_cache(directory):
+    """Keep at most PREPROCESS_MAX_FILES artifacts, dropping the least recently used"""
+    files = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.npz')]
+    if len(files) <= PREPROCESS_MAX_FILES:
+        return
+    files.sort(key=lambda path: os.path.getmtime(path))
+    for path in files[:len(files) - PREPROCESS_MAX_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_preprocessing(distance_matrix, demands, depot, coordinates=None, k=DEFAULT_NEIGHBORS, directory=None,
+                      persist=True):
+    """
+    Preprocessing artifact of an instance, from memory, disk or freshly computed
+
+    Parameters:
+    - distance_matrix: 2D array of distances between nodes
+    - demands: Array of node demands
+    - depot: Index of the depot node
+    - coordinates: Optional node coordinates
+    - k: Minimum number of neighbours needed per customer
+    - directory: Optional cache directory (defaults to PREPROCESS_CACHE_DIR)
+    - persist: False for one-off sub-instances (decomposition sectors, depot sub-problems):
+      the artifact is computed without fingerprinting and kept out of both cache tiers
+
+    Returns:
+    - InstancePreprocessing
+    """
+    if not persist:
+        return compute_preprocessing(distance_matrix, demands, depot, coordinates, max(k, DEFAULT_NEIGHBORS))
+
+    fingerprint = instance_fingerprint(distance_matrix, demands, depot, coordinates)
+    num_customers = len(distance_matrix) - 1
+    wanted = min(k, max(0, num_customers - 1))
+
+    with _cache_lock:
+        preprocessing = _memory_cache.get(fingerprint)
+        if preprocessing is not None:
+            _memory_cache.move_to_end(fingerprint)
+
+    if preprocessing is None:
+        preprocessing = _load_from_disk(fingerprint, directory)
+        if preprocessing is not None:
+            # Touch the file so the LRU pruning keeps artifacts that are still in use
+            try:
+                os.utime(_cache_path(fingerprint, directory))
+            except OSError:
+                pass
+
+    if preprocessing is None or preprocessing.neighbors.shape[1] < wanted:
+        preprocessing = compute_preprocessing(distance_matrix, demands, depot, coordinates,
+                                              max(k, DEFAULT_NEIGHBORS), fingerprint)
+        _save_to_disk(preprocessing, directory)
+
+    with _cache_lock:
+        _memory_cache[fingerprint] = preprocessing
+        _memory_cache.move_to_end(fingerprint)
+        while len(_memory_cache) > PREPROCESS_MEMORY_ENTRIES:
+            _memory_cache.popitem(last=False)
+
+    return preprocessing
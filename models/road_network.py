@@ -0,0 +1,443 @@
+"""
+Road-network distances computed locally, without per-element API costs.
+
+Two backends, both used through compute_backend_distance_matrix in
+models.distance_matrix:
+
+- RoadGraph: a road graph held as a compact CSR adjacency. Three arrays
+  hold the edge offsets per node, the edge targets and the edge lengths in
+  meters. The graph is built from an OSM XML extract (highway ways, oneway
+  tags) or from edge arrays, and stored as .npz. Stops snap to their
+  nearest graph node through a uniform grid. Matrix rows come from
+  Dijkstra searches that stop once every stop is settled. Sources are split
+  across a process pool, and each worker receives the graph once through
+  the pool initializer.
+- OSRMTableClient: the table service of a locally run OSRM (or compatible)
+  server. The matrix is tiled to the server's table size limit and the
+  tiles are requested concurrently. OSRM_URL or base_url points the client
+  at a stand-in server in tests.
+
+Pairs that cannot be routed fall back to straight-line distance.
+"""
+
+import os
+import heapq
+import asyncio
+import logging
+import multiprocessing
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ProcessPoolExecutor
+import aiohttp
+import numpy as np
+from models.distance_matrix import compute_distance_matrix, EARTH_RADIUS_M, FALLBACK_METRIC
+from models.google_matrix import run_coroutine
+
+logger = logging.getLogger('road_network')
+
+ROAD_GRAPH_PATH = os.getenv('ROAD_GRAPH_PATH')
+OSRM_URL = os.getenv('OSRM_URL', 'http://localhost:5000')
+
+# osrm-routed --max-table-size default
+OSRM_MAX_TABLE_SIZE = int(os.getenv('OSRM_MAX_TABLE_SIZE', 100))
+OSRM_MAX_CONCURRENCY = int(os.getenv('OSRM_MAX_CONCURRENCY', 4))
+OSRM_REQUEST_TIMEOUT_SECONDS = float(os.getenv('OSRM_REQUEST_TIMEOUT_SECONDS', 60))
+
+# Below this many distinct stops the process pool costs more than it saves
+ROAD_PARALLEL_MIN_SOURCES = 64
+
+# OSM highway types that carry vehicles (footways, paths and tracks are left out)
+ROAD_HIGHWAYS = frozenset([
+    'motorway', 'motorway_link', 'trunk', 'trunk_link', 'primary', 'primary_link',
+    'secondary', 'secondary_link', 'tertiary', 'tertiary_link', 'unclassified',
+    'residential', 'living_street', 'service', 'road'
+])
+
+# Snapping grid: average graph nodes per cell
+SNAP_NODES_PER_CELL = 8
+
+_graph_cache = {}
+
+
+def _edge_lengths(lat, lon, sources, targets):
+    """Great-circle length in meters of every edge (lat/lon in degrees per node)"""
+    lat1, lon1 = np.radians(lat[sources]), np.radians(lon[sources])
+    lat2, lon2 = np.radians(lat[targets]), np.radians(lon[targets])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class RoadGraph:
+    """Directed road graph in CSR form"""
+
+    def __init__(self, lat, lon, indptr, targets, lengths):
+        """
+        Parameters:
+        - lat, lon: Node coordinates in degrees
+        - indptr: Edges of node u are targets[indptr[u]:indptr[u + 1]]
+        - targets: Edge target nodes
+        - lengths: Edge lengths in meters
+        """
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self._grid = None
+
+    @property
+    def num_nodes(self):
+        return len(self.lat)
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    @classmethod
+    def from_edges(cls, lat, lon, sources, targets, lengths=None, oneway=None):
+        """
+        Build a graph from an edge list
+
+        Parameters:
+        - lat, lon: Node coordinates in degrees
+        - sources, targets: Edge endpoints (node indices)
+        - lengths: Optional edge lengths in meters (default: great-circle length)
+        - oneway: Optional boolean per edge; two-way edges (the default) are added in both directions
+
+        Returns:
+        - RoadGraph
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        if lengths is None:
+            lengths = _edge_lengths(lat, lon, sources, targets)
+        lengths = np.asarray(lengths, dtype=np.float64)
+
+        if oneway is None:
+            oneway = np.zeros(len(sources), dtype=bool)
+        twoway = ~np.asarray(oneway, dtype=bool)
+        all_sources = np.concatenate([sources, targets[twoway]])
+        all_targets = np.concatenate([targets, sources[twoway]])
+        all_lengths = np.concatenate([lengths, lengths[twoway]])
+
+        order = np.argsort(all_sources, kind='stable')
+        counts = np.bincount(all_sources, minlength=len(lat))
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        return cls(lat, lon, indptr, all_targets[order], all_lengths[order])
+
+    @classmethod
+    def from_osm_xml(cls, path, highways=ROAD_HIGHWAYS):
+        """
+        Build a graph from an OpenStreetMap XML extract (.osm)
+
+        Ways tagged with one of `highways` become edges between consecutive
+        nodes. oneway=yes/1/true and roundabouts are one-way, oneway=-1 runs
+        against the node order. Nodes not on a road are dropped.
+
+        Parameters:
+        - path: .osm file
+        - highways: Highway tag values to keep
+
+        Returns:
+        - RoadGraph
+        """
+        coordinates = {}
+        sources, targets, oneway = [], [], []
+
+        for _, element in ElementTree.iterparse(path, events=('end',)):
+            if element.tag == 'node':
+                coordinates[element.get('id')] = (float(element.get('lat')), float(element.get('lon')))
+            elif element.tag == 'way':
+                tags = {tag.get('k'): tag.get('v') for tag in element.findall('tag')}
+                if tags.get('highway') in highways:
+                    refs = [nd.get('ref') for nd in element.findall('nd')]
+                    direction = tags.get('oneway', '')
+                    if direction == '-1':
+                        refs.reverse()
+                    is_oneway = direction in ('yes', '1', 'true', '-1') or tags.get('junction') == 'roundabout'
+                    for a, b in zip(refs, refs[1:]):
+                        sources.append(a)
+                        targets.append(b)
+                        oneway.append(is_oneway)
+            if element.tag in ('node', 'way', 'relation'):
+                element.clear()
+
+        # Keep only road nodes (with known coordinates), renumbered densely
+        ids = sorted({ref for ref in sources + targets if ref in coordinates})
+        index = {ref: i for i, ref in enumerate(ids)}
+        keep = [k for k, (a, b) in enumerate(zip(sources, targets)) if a in index and b in index]
+        lat = np.array([coordinates[ref][0] for ref in ids])
+        lon = np.array([coordinates[ref][1] for ref in ids])
+
+        logger.info(f"Loaded road graph from {path}: {len(ids)} nodes, {len(keep)} road segments")
+        return cls.from_edges(lat, lon,
+                              [index[sources[k]] for k in keep], [index[targets[k]] for k in keep],
+                              oneway=[oneway[k] for k in keep])
+
+    def save(self, path):
+        np.savez(path, lat=self.lat, lon=self.lon, indptr=self.indptr, targets=self.targets, lengths=self.lengths)
+
+    @classmethod
+    def load(cls, path):
+        """Load a graph written by save() (or an .osm extract, by extension)"""
+        if path.endswith('.osm'):
+            return cls.from_osm_xml(path)
+        with np.load(path) as arrays:
+            return cls(arrays['lat'], arrays['lon'], arrays['indptr'], arrays['targets'], arrays['lengths'])
+
+    def _projected(self, lat, lon):
+        """Equirectangular projection around the graph's mean latitude (degrees, locally isotropic)"""
+        return np.column_stack([lat, lon * np.cos(np.radians(self._reference_lat))])
+
+    def _build_grid(self):
+        self._reference_lat = float(self.lat.mean())
+        points = self._projected(self.lat, self.lon)
+        low = points.min(axis=0)
+        extent = np.maximum(points.max(axis=0) - low, 1e-9)
+        cell = max(float(np.sqrt(extent[0] * extent[1] * SNAP_NODES_PER_CELL / max(1, self.num_nodes))), 1e-6)
+        shape = np.floor(extent / cell).astype(np.int64) + 1
+
+        cells = np.floor((points - low) / cell).astype(np.int64)
+        cell_ids = cells[:, 0] * shape[1] + cells[:, 1]
+        order = np.argsort(cell_ids, kind='stable')
+        self._grid = (points, low, cell, shape, order, cell_ids[order])
+
+    def snap(self, coordinates):
+        """
+        Nearest graph node of every (lat, lng) point
+
+        Returns:
+        - Array of node indices
+        - Array of snapping distances in meters (point to node)
+        """
+        if self._grid is None:
+            self._build_grid()
+        points, low, cell, shape, order, sorted_ids = self._grid
+
+        queries = np.asarray(coordinates, dtype=np.float64)[:, :2]
+        projected = self._projected(queries[:, 0], queries[:, 1])
+        nodes = np.empty(len(queries), dtype=np.int64)
+
+        for q, point in enumerate(projected):
+            row, col = np.floor((point - low) / cell).astype(np.int64)
+            radius, best, best_distance = 1, -1, np.inf
+            while True:
+                rows = np.arange(max(0, row - radius), min(shape[0], row + radius + 1))
+                cols = np.arange(max(0, col - radius), min(shape[1], col + radius + 1))
+                candidates = []
+                for r in rows:
+                    start = np.searchsorted(sorted_ids, r * shape[1] + cols[0]) if len(cols) else 0
+                    end = np.searchsorted(sorted_ids, r * shape[1] + cols[-1], side='right') if len(cols) else 0
+                    candidates.append(order[start:end])
+                candidates = np.concatenate(candidates) if candidates else np.empty(0, dtype=np.int64)
+                if len(candidates):
+                    distances = np.hypot(*(points[candidates] - point).T)
+                    k = int(np.argmin(distances))
+                    best, best_distance = int(candidates[k]), float(distances[k])
+
+                # Every node outside the searched square is more than radius cells away
+                covers_grid = (row - radius <= 0 and col - radius <= 0 and
+                               row + radius >= shape[0] - 1 and col + radius >= shape[1] - 1)
+                if best >= 0 and (best_distance <= radius * cell or covers_grid):
+                    break
+                radius += 1
+            nodes[q] = best
+
+        count = len(queries)
+        offsets = _edge_lengths(np.concatenate([queries[:, 0], self.lat[nodes]]),
+                                np.concatenate([queries[:, 1], self.lon[nodes]]),
+                                np.arange(count), np.arange(count, 2 * count))
+        return nodes, offsets
+
+    def distance_matrix(self, coordinates, parallel=None, max_workers=None):
+        """
+        Road distances between points, in meters
+
+        Each point is snapped to its nearest graph node and the snapping
+        distance is added at both ends. Unreachable pairs fall back to
+        straight-line distance.
+
+        Parameters:
+        - coordinates: List of (lat, lng) tuples
+        - parallel: Force (True) or disable (False) the process pool; by default it is
+          used only when there are enough distinct stops to pay for it
+        - max_workers: Optional process pool size (defaults to the CPU count)
+
+        Returns:
+        - 2D numpy array of distances
+        """
+        nodes, offsets = self.snap(coordinates)
+        stops, inverse = np.unique(nodes, return_inverse=True)
+        stops = stops.tolist()
+
+        if parallel is None:
+            parallel = (os.cpu_count() or 1) > 1 and len(stops) >= ROAD_PARALLEL_MIN_SOURCES
+
+        rows = None
+        if parallel:
+            try:
+                workers = max_workers or min(len(stops), os.cpu_count() or 1)
+                chunk = max(1, -(-len(stops) // (workers * 4)))
+                chunks = [stops[i:i + chunk] for i in range(0, len(stops), chunk)]
+                # Spawned, not forked: this runs on a Flask thread, and forking a threaded
+                # process can deadlock the child on locks held by other threads
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_road_worker,
+                                         initargs=(self.indptr, self.targets, self.lengths, stops)) as executor:
+                    rows = [row for block in executor.map(_road_worker_task, chunks) for row in block]
+            except (OSError, RuntimeError, NotImplementedError) as e:
+                # Some hosts (serverless, restricted sandboxes) cannot start processes
+                logger.warning(f"Parallel road distances unavailable, computing sequentially: {str(e)}")
+                rows = None
+        if rows is None:
+            _init_road_worker(self.indptr, self.targets, self.lengths, stops)
+            rows = _road_worker_task(stops)
+
+        road = np.asarray(rows, dtype=np.float64)[np.ix_(inverse, inverse)]
+        matrix = road + offsets[:, None] + offsets[None, :]
+
+        unreachable = ~np.isfinite(matrix)
+        if unreachable.any():
+            logger.warning(f"{int(unreachable.sum())} pairs not connected in the road graph, "
+                           f"using straight-line distance")
+            straight = compute_distance_matrix(coordinates, FALLBACK_METRIC)
+            matrix[unreachable] = straight[unreachable]
+        np.fill_diagonal(matrix, 0)
+        return matrix
+
+
+# Graph of a road worker process (set by the pool initializer)
+_worker_graph = None
+
+
+def _init_road_worker(indptr, targets, lengths, stops):
+    """Process pool initializer: plain lists are several times faster than arrays in the Dijkstra loop"""
+    global _worker_graph
+    _worker_graph = (indptr.tolist(), targets.tolist(), lengths.astype(np.float64).tolist(), list(stops))
+
+
+def _road_worker_task(sources):
+    """Distances from each source node to every stop (one row per source)"""
+    indptr, targets, lengths, stops = _worker_graph
+    return [_dijkstra_to_stops(indptr, targets, lengths, source, stops) for source in sources]
+
+
+def _dijkstra_to_stops(indptr, targets, lengths, source, stops):
+    """Single-source Dijkstra that stops once every stop is settled"""
+    inf = float('inf')
+    distance = [inf] * (len(indptr) - 1)
+    distance[source] = 0.0
+    pending = set(stops)
+    heap = [(0.0, source)]
+    heappush, heappop = heapq.heappush, heapq.heappop
+
+    while heap:
+        d, u = heappop(heap)
+        if d > distance[u]:
+            continue  # Stale entry, u was settled at a shorter distance
+        if u in pending:
+            pending.discard(u)
+            if not pending:
+                break
+        for e in range(indptr[u], indptr[u + 1]):
+            v = targets[e]
+            nd = d + lengths[e]
+            if nd < distance[v]:
+                distance[v] = nd
+                heappush(heap, (nd, v))
+
+    return [distance[stop] for stop in stops]
+
+
+def get_road_graph(path=None):
+    """Road graph at path (defaults to ROAD_GRAPH_PATH), loaded once per process"""
+    path = path or ROAD_GRAPH_PATH
+    if not path:
+        raise ValueError("No road graph configured (set ROAD_GRAPH_PATH)")
+    if path not in _graph_cache:
+        _graph_cache[path] = RoadGraph.load(path)
+    return _graph_cache[path]
+
+
+class OSRMTableClient:
+    """Client of an OSRM-compatible /table service"""
+
+    def __init__(self, base_url=None, profile='driving', max_table_size=None, max_concurrency=None):
+        """
+        Parameters:
+        - base_url: Server URL (defaults to OSRM_URL)
+        - profile: Routing profile in the URL
+        - max_table_size: Largest number of locations per request (the server's --max-table-size)
+        - max_concurrency: Requests in flight at once
+        """
+        self.base_url = (base_url or OSRM_URL).rstrip('/')
+        self.profile = profile
+        self.max_table_size = max(2, max_table_size or OSRM_MAX_TABLE_SIZE)
+        self.max_concurrency = max_concurrency or OSRM_MAX_CONCURRENCY
+
+    def _tiles(self, num_nodes):
+        """(sources, destinations) index blocks whose union fits the table size"""
+        if num_nodes <= self.max_table_size:
+            return [(list(range(num_nodes)), list(range(num_nodes)))]
+        block = self.max_table_size // 2
+        blocks = [list(range(start, min(start + block, num_nodes))) for start in range(0, num_nodes, block)]
+        return [(sources, destinations) for sources in blocks for destinations in blocks]
+
+    async def _fetch_tile(self, session, semaphore, coordinates, sources, destinations, max_retries=2):
+        # Each tile sends the union of its locations once
+        locations = sorted(set(sources) | set(destinations))
+        position = {node: k for k, node in enumerate(locations)}
+        url = (f"{self.base_url}/table/v1/{self.profile}/" +
+               ";".join(f"{coordinates[i][1]},{coordinates[i][0]}" for i in locations))
+        params = {
+            'sources': ";".join(str(position[i]) for i in sources),
+            'destinations': ";".join(str(position[j]) for j in destinations),
+            'annotations': 'distance'
+        }
+
+        for attempt in range(max_retries):
+            try:
+                async with semaphore:
+                    async with session.get(url, params=params) as response:
+                        data = await response.json(content_type=None)
+                if data.get('code') == 'Ok':
+                    return data['distances']
+                logger.error(f"OSRM table error: {data.get('code')} {data.get('message', '')}")
+                return None
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning(f"OSRM table request failed (attempt {attempt + 1}/{max_retries}): {e!r}")
+        return None
+
+    async def _fetch(self, coordinates, tiles):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        timeout = aiohttp.ClientTimeout(total=OSRM_REQUEST_TIMEOUT_SECONDS)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            return await asyncio.gather(*[self._fetch_tile(session, semaphore, coordinates, sources, destinations)
+                                          for sources, destinations in tiles])
+
+    def distance_matrix(self, coordinates):
+        """
+        Road distances between (lat, lng) points, in meters
+
+        Returns:
+        - 2D numpy array of distances (unroutable pairs and failed tiles fall back to straight-line distance)
+        """
+        num_nodes = len(coordinates)
+        matrix = np.full((num_nodes, num_nodes), np.nan)
+        tiles = self._tiles(num_nodes)
+        logger.info(f"Requesting {num_nodes}x{num_nodes} road distances from {self.base_url} in {len(tiles)} tables")
+
+        for (sources, destinations), distances in zip(tiles, run_coroutine(self._fetch(coordinates, tiles))):
+            if distances is None:
+                continue
+            block = np.array([[np.nan if d is None else d for d in row] for row in distances], dtype=np.float64)
+            matrix[np.ix_(sources, destinations)] = block
+
+        missing = np.isnan(matrix)
+        if missing.any():
+            logger.warning(f"{int(missing.sum())} pairs without an OSRM route, using straight-line distance")
+            straight = compute_distance_matrix(coordinates, FALLBACK_METRIC)
+            matrix[missing] = straight[missing]
+        np.fill_diagonal(matrix, 0)
+        return matrix
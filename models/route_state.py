@@ -0,0 +1,145 @@
+"""
+Per-route cached data for the CVRP solvers.
+
+Neighbor generation copies only the routes it changes, so an unchanged route
+keeps its list object and its cached state. A RouteState is therefore valid
+for as long as its route list is the same object and is not mutated in place.
+
+Route measures (time window segments, distance and duration prefix sums)
+share one interface: prefix(k) covers depot + route[:k], suffix(k) covers
+route[k:] + depot, at(k) is the k-th stop, customer(c) is a stop from
+another route, inner(a, b) / reversed_inner(a, b) cover route[a..b], and
+join(*segments) concatenates them. A move describes the new route as a
+"recipe" - a function mapping a measure cache to a list of segments - and
+every measure evaluates it in O(1).
+"""
+
+
+class RoutePrefixSums:
+    """
+    Prefix sums of an additive route measure (distance, or travel time plus
+    service time) along depot + route + depot.
+    Segments are (first node, last node, value) tuples.
+    """
+
+    def __init__(self, matrix, depot, route, node_values=None):
+        """
+        Parameters:
+        - matrix: 2D list of arc values (distances or travel times)
+        - depot: Index of the depot node
+        - route: List of customer indices (depot excluded)
+        - node_values: Optional per-node values added when a node is visited (e.g. service times)
+        """
+        self.matrix = matrix
+        self.depot = depot
+        self.route = route
+        self.node_values = node_values
+
+        extended = [depot] + route + [depot]
+        forward = [0.0]
+        backward = [0.0]
+        for a, b in zip(extended, extended[1:]):
+            if node_values is None:
+                forward.append(forward[-1] + matrix[a][b])
+                backward.append(backward[-1] + matrix[b][a])
+            else:
+                forward.append(forward[-1] + matrix[a][b] + node_values[b])
+                backward.append(backward[-1] + matrix[b][a] + node_values[a])
+
+        self.extended = extended
+        self.forward = forward
+        self.backward = backward
+        self.total = forward[-1]
+
+    def _value(self, node):
+        return 0.0 if self.node_values is None else self.node_values[node]
+
+    def prefix(self, k):
+        return (self.depot, self.extended[k], self.forward[k])
+
+    def suffix(self, k):
+        first = self.extended[k + 1]
+        return (first, self.depot, self.total - self.forward[k + 1] + self._value(first))
+
+    def at(self, k):
+        return self.customer(self.route[k])
+
+    def customer(self, node):
+        return (node, node, self._value(node))
+
+    def depot_segment(self):
+        return (self.depot, self.depot, 0.0)
+
+    def inner(self, a, b):
+        first = self.extended[a + 1]
+        return (first, self.extended[b + 1], self.forward[b + 1] - self.forward[a + 1] + self._value(first))
+
+    def reversed_inner(self, a, b):
+        first = self.extended[b + 1]
+        return (first, self.extended[a + 1], self.backward[b + 1] - self.backward[a + 1] + self._value(first))
+
+    def join(self, *segments):
+        """Total value of the route formed by the given segments"""
+        first, last, value = segments[0]
+        for next_first, next_last, next_value in segments[1:]:
+            value += self.matrix[last][next_first] + next_value
+            last = next_last
+        return value
+
+
+class RouteState:
+    __slots__ = ('route', 'load', 'time', 'distance', 'duration')
+
+    def __init__(self, route, demands, time_windows=None, distance_matrix=None,
+                 duration_matrix=None, service_times=None, depot=0):
+        """
+        Parameters:
+        - route: List of customer indices (depot excluded)
+        - demands: Array of customer demands
+        - time_windows: Optional TimeWindowData used to build forward/backward time segments
+        - distance_matrix: Optional 2D list of distances, for route distance prefix sums
+        - duration_matrix: Optional 2D list of travel times, for route duration prefix sums
+          (not needed with time windows, whose segments already carry durations)
+        - service_times: Optional per-node service times added to durations
+        - depot: Index of the depot node
+        """
+        self.route = route
+        self.load = sum(demands[customer] for customer in route)
+        self.time = time_windows.route_cache(route) if time_windows is not None else None
+        self.distance = RoutePrefixSums(distance_matrix, depot, route) if distance_matrix is not None else None
+        self.duration = (RoutePrefixSums(duration_matrix, depot, route, service_times)
+                         if duration_matrix is not None else None)
+
+
+class RouteStateCache:
+    """Map from route list objects to their RouteState, keyed by identity"""
+
+    def __init__(self, demands, time_windows=None, distance_matrix=None,
+                 duration_matrix=None, service_times=None, depot=0):
+        self.demands = demands
+        self.time_windows = time_windows
+        self.distance_matrix = distance_matrix
+        self.duration_matrix = duration_matrix
+        self.service_times = service_times
+        self.depot = depot
+        self._states = {}
+
+    def build(self, route):
+        """Compute a state without caching it (for routes that are still being changed)"""
+        return RouteState(route, self.demands, self.time_windows, self.distance_matrix,
+                          self.duration_matrix, self.service_times, self.depot)
+
+    def get(self, route):
+        state = self._states.get(id(route))
+        if state is None or state.route is not route:
+            state = self.build(route)
+            self._states[id(route)] = state
+        return state
+
+    def prune(self, solution):
+        """Drop states of routes that are no longer part of the given solution"""
+        keep = {id(route) for route in solution}
+        self._states = {key: state for key, state in self._states.items() if key in keep}
+
+    def __len__(self):
+        return len(self._states)
@@ -0,0 +1,256 @@
+"""
+Split: optimal segmentation of a giant tour into capacity-feasible routes.
+
+A giant tour is an ordering of all customers without depot visits. Split
+finds the cheapest way to cut it into consecutive routes (Prins 2004) as a
+shortest path over the tour positions. With the route cost written as
+from_depot[a] + cum[b] - cum[a] + to_depot[b], the predecessor term only
+depends on a, so candidate route starts are kept in a monotone deque and
+the whole Split runs in O(n) (Vidal 2016) instead of O(n^2).
+
+With a fleet-size limit K, the same deque sweep runs once per route count
+(O(nK)). If no capacity-feasible split into K routes exists, a penalized
+Split minimizes the overload first and the distance second, so callers
+never get more routes than they have vehicles.
+"""
+
+from collections import deque
+import numpy as np
+
+
+def tour_arrays(distance_matrix, demands, depot, tours):
+    """
+    Gather the per-position data Split needs, for one tour or a batch of tours at once
+
+    Parameters:
+    - distance_matrix: 2D array of distances
+    - demands: Array of node demands
+    - depot: Index of the depot node
+    - tours: 1D array (one tour) or 2D array (one tour per row) of customer indices
+
+    Returns:
+    - from_depot: distance depot -> tour[k]
+    - to_depot: distance tour[k] -> depot
+    - cum: distance along the tour from tour[0] to tour[k]
+    - load_prefix: total demand of tour[:k] (one column longer than the tour)
+    """
+    matrix = np.asarray(distance_matrix, dtype=np.float64)
+    tours = np.asarray(tours, dtype=np.int64)
+    demand = np.asarray(demands, dtype=np.float64)
+
+    from_depot = matrix[depot, tours]
+    to_depot = matrix[tours, depot]
+    arcs = matrix[tours[..., :-1], tours[..., 1:]]
+    cum = np.zeros(tours.shape)
+    np.cumsum(arcs, axis=-1, out=cum[..., 1:])
+    load_prefix = np.zeros(tours.shape[:-1] + (tours.shape[-1] + 1,))
+    np.cumsum(demand[tours], axis=-1, out=load_prefix[..., 1:])
+    return from_depot, to_depot, cum, load_prefix
+
+
+def linear_split(from_depot, to_depot, cum, load_prefix, capacity):
+    """
+    Optimal split of one tour without a fleet limit, in O(n)
+
+    Parameters:
+    - from_depot, to_depot, cum, load_prefix: 1D arrays from tour_arrays
+    - capacity: Vehicle capacity (a single customer above it still gets its own route)
+
+    Returns:
+    - cost: Total distance of the best split
+    - predecessor: predecessor[k] = start position of the route ending at position k - 1
+    """
+    n = len(from_depot)
+    from_depot = from_depot.tolist()
+    to_depot = to_depot.tolist()
+    cum = cum.tolist()
+    load_prefix = load_prefix.tolist()
+
+    potential = [0.0] + [float('inf')] * n
+    predecessor = [0] * (n + 1)
+
+    def start_value(a):
+        return potential[a] + from_depot[a] - cum[a]
+
+    starts = deque([0])
+    for b in range(n):
+        # Drop route starts that would overload a route ending at b
+        while len(starts) > 1 and load_prefix[b + 1] - load_prefix[starts[0]] > capacity:
+            starts.popleft()
+
+        a = starts[0]
+        potential[b + 1] = start_value(a) + cum[b] + to_depot[b]
+        predecessor[b + 1] = a
+
+        if b + 1 < n:
+            # A later start is feasible whenever an earlier one is, so it dominates if not worse
+            value = start_value(b + 1)
+            while starts and start_value(starts[-1]) >= value:
+                starts.pop()
+            starts.append(b + 1)
+
+    return potential[n], predecessor
+
+
+def limited_split(from_depot, to_depot, cum, load_prefix, capacity, max_routes):
+    """
+    Optimal split of one tour into at most max_routes capacity-feasible routes, in O(n * max_routes)
+
+    Parameters:
+    - from_depot, to_depot, cum, load_prefix: 1D arrays from tour_arrays
+    - capacity: Vehicle capacity
+    - max_routes: Maximum number of routes
+
+    Returns:
+    - cost: Total distance of the best split (inf if no feasible split exists)
+    - predecessor: predecessor[k] = start position of the route ending at position k - 1
+    """
+    n = len(from_depot)
+    from_depot = from_depot.tolist()
+    to_depot = to_depot.tolist()
+    cum = cum.tolist()
+    load_prefix = load_prefix.tolist()
+    max_routes = max(1, min(max_routes, n))
+
+    infinity = float('inf')
+    previous = [0.0] + [infinity] * n
+    layers = []
+    best_cost, best_layer = infinity, None
+
+    for _ in range(max_routes):
+        potential = [infinity] * (n + 1)
+        predecessor = [0] * (n + 1)
+        starts = deque()
+
+        for b in range(n):
+            # Position b can start a route if the previous layer reached it
+            if previous[b] < infinity:
+                value = previous[b] + from_depot[b] - cum[b]
+                while starts and previous[starts[-1]] + from_depot[starts[-1]] - cum[starts[-1]] >= value:
+                    starts.pop()
+                starts.append(b)
+
+            while starts and load_prefix[b + 1] - load_prefix[starts[0]] > capacity:
+                starts.popleft()
+            if not starts:
+                continue
+
+            a = starts[0]
+            potential[b + 1] = previous[a] + from_depot[a] - cum[a] + cum[b] + to_depot[b]
+            predecessor[b + 1] = a
+
+        layers.append(predecessor)
+        if potential[n] < best_cost:
+            best_cost, best_layer = potential[n], len(layers) - 1
+        previous = potential
+
+    if best_layer is None:
+        return infinity, None
+
+    # Walk the layers back: the route ending at position end belongs to layer `layer`
+    cuts = [0] * (n + 1)
+    end, layer = n, best_layer
+    while end > 0:
+        start = layers[layer][end]
+        cuts[end] = start
+        end, layer = start, layer - 1
+    return best_cost, cuts
+
+
+def penalized_split(from_depot, to_depot, cum, load_prefix, capacity, max_routes, overload_penalty=None):
+    """
+    Split into at most max_routes routes when capacity cannot be met: minimizes
+    distance + overload_penalty * total overload (O(n^2 * max_routes), vectorized per position)
+
+    Parameters:
+    - from_depot, to_depot, cum, load_prefix: 1D arrays from tour_arrays
+    - capacity: Vehicle capacity
+    - max_routes: Maximum number of routes
+    - overload_penalty: Cost per unit of overload (default: larger than any split's distance,
+      so the overload is minimized first)
+
+    Returns:
+    - cost: Total distance of the chosen split (without the penalty)
+    - predecessor: predecessor[k] = start position of the route ending at position k - 1
+    """
+    n = len(from_depot)
+    max_routes = max(1, min(max_routes, n))
+    if overload_penalty is None:
+        overload_penalty = float(from_depot.sum() + to_depot.sum() + cum[-1]) + 1.0
+
+    previous = np.full(n + 1, np.inf)
+    previous[0] = 0.0
+    layers = []
+    totals = []
+    for _ in range(max_routes):
+        potential = np.full(n + 1, np.inf)
+        predecessor = np.zeros(n + 1, dtype=np.int64)
+        start_value = previous[:n] + from_depot - cum
+        for b in range(n):
+            overload = np.maximum(load_prefix[b + 1] - load_prefix[:b + 1] - capacity, 0.0)
+            candidates = start_value[:b + 1] + overload_penalty * overload
+            a = int(np.argmin(candidates))
+            potential[b + 1] = candidates[a] + cum[b] + to_depot[b]
+            predecessor[b + 1] = a
+        layers.append(predecessor)
+        totals.append(potential[n])
+        previous = potential
+
+    best_layer = int(np.argmin(totals))
+    cuts = [0] * (n + 1)
+    end, layer = n, best_layer
+    while end > 0:
+        start = int(layers[layer][end])
+        cuts[end] = start
+        end, layer = start, layer - 1
+
+    # Report the plain distance of the chosen routes
+    distance = 0.0
+    end = n
+    while end > 0:
+        start = cuts[end]
+        distance += from_depot[start] + cum[end - 1] - cum[start] + to_depot[end - 1]
+        end = start
+    return float(distance), cuts
+
+
+def routes_from_predecessors(tour, predecessor):
+    """Cut the tour at the positions recorded by Split"""
+    routes = []
+    end = len(tour)
+    while end > 0:
+        start = predecessor[end]
+        routes.append([int(customer) for customer in tour[start:end]])
+        end = start
+    routes.reverse()
+    return routes
+
+
+def split_tour(distance_matrix, demands, depot, capacity, tour, max_routes=None):
+    """
+    Cut a giant tour into the cheapest sequence of capacity-feasible routes
+
+    Parameters:
+    - distance_matrix: 2D array of distances
+    - demands: Array of node demands
+    - depot: Index of the depot node
+    - capacity: Vehicle capacity
+    - tour: Ordered customer indices
+    - max_routes: Optional fleet-size limit; if capacity cannot be met with that many
+      routes, the overload is minimized instead (so routes may exceed capacity)
+
+    Returns:
+    - routes: List of routes (lists of customer indices)
+    - cost: Total distance of those routes
+    """
+    if len(tour) == 0:
+        return [], 0.0
+    arrays = tour_arrays(distance_matrix, demands, depot, tour)
+
+    if max_routes is None:
+        cost, predecessor = linear_split(*arrays, capacity)
+    else:
+        cost, predecessor = limited_split(*arrays, capacity, max_routes)
+        if predecessor is None:
+            cost, predecessor = penalized_split(*arrays, capacity, max_routes)
+    return routes_from_predecessors(list(tour), predecessor), cost
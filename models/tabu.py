@@ -0,0 +1,334 @@
+"""
+Granular tabu search for the CVRP.
+
+Every iteration evaluates the whole granular neighbourhood - relocate, swap
+and intra-route 2-opt moves between each customer and its `granularity`
+nearest customers - with O(1) delta costs, and applies the best admissible
+move, even if it is worsening. Moving a customer out of a route makes the
+attribute (customer, route) tabu for a randomized tenure, so the customer
+cannot return there; a tabu move is still allowed when it yields a new best
+solution (aspiration). Intra-route moves do not change any attribute and
+are only applied when they improve.
+
+Capacity overload is allowed during the search at a self-adjusting penalty,
+so the search can cross infeasible regions; only feasible solutions (or the
+least overloaded one, if none is found) are reported.
+"""
+
+import random
+import numpy as np
+from models.cvrp import CVRPSolverBase
+from models.elite_pool import ElitePool
+from models.distance_matrix import lookup_rows
+
+# The overload penalty never grows past this multiple of its starting value (it would
+# overflow to inf on a fleet too small for any feasible solution)
+MAX_PENALTY_FACTOR = 1e4
+
+
+class CVRP_TabuSearch(CVRPSolverBase):
+    def __init__(self, distance_matrix, demands, depot, vehicle_capacity, max_vehicles=5,
+                 max_iterations=1000, tenure=None, granularity=10, cancel_event=None,
+                 elite_pool_size=0, elite_min_distance=0.1, initial_solution=None):
+        """
+        Initialize the tabu search solver (capacity constraints only)
+
+        Parameters:
+        - distance_matrix: 2D array of distances between nodes
+        - demands: Array of customer demands (demand[depot] should be 0)
+        - depot: Index of the depot node
+        - vehicle_capacity: Maximum capacity of each vehicle
+        - max_vehicles: Maximum number of vehicles (routes)
+        - max_iterations: Number of moves to apply
+        - tenure: Base tabu tenure in iterations (default grows with the instance size);
+          each move draws its tenure from [tenure, 1.5 * tenure]
+        - granularity: Number of nearest customers each customer is paired with
+        - cancel_event: Optional threading.Event; when set, solve() stops early
+          and returns the best solution found so far
+        - elite_pool_size: Number of distinct good solutions to keep as alternatives (0 disables)
+        - elite_min_distance: Minimum fraction of differing edges between kept alternatives
+        - initial_solution: Optional starting routes (e.g. from the fleet minimization phase)
+        """
+        super().__init__(distance_matrix, demands, depot, vehicle_capacity, max_vehicles, cancel_event)
+
+        customers = self.customers()
+        self.max_iterations = max_iterations
+        self.tenure = tenure if tenure is not None else 7 + len(customers) // 10
+        self.granularity = granularity
+        self.neighbors = self.get_instance_preprocessing(granularity).neighbor_lists(granularity)
+
+        # Plain lists are much faster than NumPy for the scalar lookups of the move evaluation
+        self._d = lookup_rows(self.distance_matrix, 'tabu search')
+
+        self.elite_pool = ElitePool(depot, elite_pool_size, elite_min_distance) if elite_pool_size > 0 else None
+
+        # A fixed number of route slots (some may be empty) keeps route indices stable for the tabu list
+        initial_routes = [list(route) for route in initial_solution if route] if initial_solution is not None else None
+        slots = max(1, max_vehicles, len(initial_routes or []))
+        self.routes = [[] for _ in range(slots)]
+        self.route_of = {}
+        self.loads = [0] * len(self.routes)
+        self._forward = [[0.0] for _ in self.routes]
+        self._backward = [[0.0] for _ in self.routes]
+        self.tabu_until = {}
+
+        self.initialize_solution(customers, initial_routes)
+
+    def initialize_solution(self, customers, initial_routes=None):
+        """
+        Fill the route slots with the given routes, or split the farthest-first customer
+        order into them (overload only if the fleet is too small)
+        """
+        if initial_routes is None:
+            order = sorted(customers, key=lambda c: -self._d[self.depot][c])
+            initial_routes = self.split_giant_tour(order)
+        for slot, route in enumerate(initial_routes):
+            self.routes[slot] = route
+
+        for r in range(len(self.routes)):
+            self._refresh_route(r)
+
+    def _refresh_route(self, r):
+        """Recompute positions, load and forward/backward arc sums of one route"""
+        route = self.routes[r]
+        d = self._d
+        forward = [0.0]
+        backward = [0.0]
+        for position, customer in enumerate(route):
+            self.route_of[customer] = (r, position)
+            if position:
+                previous = route[position - 1]
+                forward.append(forward[-1] + d[previous][customer])
+                backward.append(backward[-1] + d[customer][previous])
+        self._forward[r] = forward
+        self._backward[r] = backward
+        self.loads[r] = sum(self.demands[customer] for customer in route)
+
+    def _excess(self, load):
+        return load - self.vehicle_capacity if load > self.vehicle_capacity else 0
+
+    def _neighbours_in_route(self, r, position):
+        route = self.routes[r]
+        previous = route[position - 1] if position > 0 else self.depot
+        following = route[position + 1] if position + 1 < len(route) else self.depot
+        return previous, following
+
+    def total_excess(self):
+        return sum(self._excess(load) for load in self.loads)
+
+    def _is_tabu(self, customer, r, iteration):
+        return self.tabu_until.get((customer, r), -1) > iteration
+
+    def evaluate_moves(self, iteration, current_cost, penalty):
+        """
+        Scan the granular neighbourhood
+
+        Returns:
+        - The best admissible move as (objective delta, cost delta, kind, args), or None
+        """
+        d = self._d
+        depot = self.depot
+        capacity_excess = self._excess
+        demands = self.demands
+        best_move = None
+        best_delta = float('inf')
+        empty_slot = next((r for r, route in enumerate(self.routes) if not route), None)
+        current_excess = self.total_excess()
+
+        def consider(delta_cost, delta_excess, tabu, inter, kind, args):
+            nonlocal best_move, best_delta
+            delta = delta_cost + penalty * delta_excess
+            if delta >= best_delta:
+                return
+            if not inter and delta >= -1e-9:
+                # Intra-route moves leave no tabu trace, so only improving ones are safe
+                return
+            if tabu:
+                # Aspiration: a tabu move is fine if it gives a new best feasible solution
+                if not (current_excess + delta_excess == 0 and current_cost + delta_cost < self.best_cost - 1e-9):
+                    return
+            best_delta = delta
+            best_move = (delta, delta_cost, kind, args)
+
+        for u in self.route_of:
+            ru, pu = self.route_of[u]
+            u_prev, u_next = self._neighbours_in_route(ru, pu)
+            removal_gain = d[u_prev][u] + d[u][u_next] - d[u_prev][u_next]
+            du = demands[u]
+            load_u = self.loads[ru]
+            excess_u = capacity_excess(load_u - du) - capacity_excess(load_u)
+
+            # Relocate u into an empty route
+            if empty_slot is not None and len(self.routes[ru]) > 1:
+                consider(d[depot][u] + d[u][depot] - removal_gain, excess_u,
+                         self._is_tabu(u, empty_slot, iteration), True,
+                         'relocate_new', (u, empty_slot))
+
+            for v in self.neighbors[u]:
+                rv, pv = self.route_of[v]
+                v_prev, v_next = self._neighbours_in_route(rv, pv)
+                inter = ru != rv
+
+                if inter:
+                    load_v = self.loads[rv]
+                    relocate_excess = excess_u + capacity_excess(load_v + du) - capacity_excess(load_v)
+                    tabu = self._is_tabu(u, rv, iteration)
+                else:
+                    relocate_excess = 0
+                    tabu = False
+
+                # Relocate u right after v
+                if v_next != u:
+                    insert_cost = d[v][u] + d[u][v_next] - d[v][v_next]
+                    consider(insert_cost - removal_gain, relocate_excess, tabu, inter,
+                             'relocate_after', (u, v))
+
+                # Relocate u right before v
+                if v_prev != u:
+                    insert_cost = d[v_prev][u] + d[u][v] - d[v_prev][v]
+                    consider(insert_cost - removal_gain, relocate_excess, tabu, inter,
+                             'relocate_before', (u, v))
+
+                if inter:
+                    # Swap u and v
+                    dv = demands[v]
+                    load_v = self.loads[rv]
+                    swap_excess = (capacity_excess(load_u - du + dv) - capacity_excess(load_u) +
+                                   capacity_excess(load_v - dv + du) - capacity_excess(load_v))
+                    swap_cost = (d[u_prev][v] + d[v][u_next] - d[u_prev][u] - d[u][u_next] +
+                                 d[v_prev][u] + d[u][v_next] - d[v_prev][v] - d[v][v_next])
+                    swap_tabu = self._is_tabu(u, rv, iteration) or self._is_tabu(v, ru, iteration)
+                    consider(swap_cost, swap_excess, swap_tabu, True, 'swap', (u, v))
+                else:
+                    # 2-opt: reverse the stretch between u and v so that u and v become adjacent
+                    route = self.routes[ru]
+                    if pu < pv:
+                        i, j = pu + 1, pv
+                        if i >= j:
+                            continue
+                        before, after = u, v_next
+                    else:
+                        i, j = pv, pu - 1
+                        if i >= j:
+                            continue
+                        before, after = v_prev, u
+                    forward, backward = self._forward[ru], self._backward[ru]
+                    first, last = route[i], route[j]
+                    delta_cost = (d[before][last] + d[first][after] - d[before][first] - d[last][after] +
+                                  (backward[j] - backward[i]) - (forward[j] - forward[i]))
+                    consider(delta_cost, 0, False, False, 'two_opt', (ru, i, j))
+
+        return best_move
+
+    def apply_move(self, kind, args, iteration):
+        """Apply a move and update the tabu list"""
+        touched = set()
+
+        if kind in ('relocate_after', 'relocate_before', 'relocate_new'):
+            u, target = args
+            r_from, p_from = self.route_of[u]
+            r_to = target if kind == 'relocate_new' else self.route_of[target][0]
+            self.routes[r_from].pop(p_from)
+
+            # The removal may shift positions, so insert relative to the target customer
+            route = self.routes[r_to]
+            if kind == 'relocate_new':
+                route.append(u)
+            elif kind == 'relocate_after':
+                route.insert(route.index(target) + 1, u)
+            else:
+                route.insert(route.index(target), u)
+
+            touched.update((r_from, r_to))
+            if r_from != r_to:
+                self._make_tabu(u, r_from, iteration)
+
+        elif kind == 'swap':
+            u, v = args
+            ru, pu = self.route_of[u]
+            rv, pv = self.route_of[v]
+            self.routes[ru][pu] = v
+            self.routes[rv][pv] = u
+            touched.update((ru, rv))
+            self._make_tabu(u, ru, iteration)
+            self._make_tabu(v, rv, iteration)
+
+        elif kind == 'two_opt':
+            r, i, j = args
+            self.routes[r][i:j + 1] = reversed(self.routes[r][i:j + 1])
+            touched.add(r)
+
+        for r in touched:
+            self._refresh_route(r)
+
+    def _make_tabu(self, customer, r, iteration):
+        self.tabu_until[(customer, r)] = iteration + random.randint(self.tenure, self.tenure + self.tenure // 2)
+
+    def current_routes(self):
+        return [list(route) for route in self.routes if route]
+
+    def solve(self, callback=None):
+        """
+        Run the tabu search
+
+        Parameters:
+        - callback: Optional progress function, same signature as the SA callback
+
+        Returns:
+        - best_solution, best_cost, cost_history, temp_history (as for the SA solver)
+        """
+        current_cost = self.calculate_total_distance(self.routes)
+        best_excess = self.total_excess()
+        self.best_solution = self.current_routes()
+        self.best_cost = current_cost if best_excess == 0 else float('inf')
+        fallback_cost = current_cost
+
+        # Overload penalty per unit of demand, adjusted to keep the search near the feasible boundary
+        penalty = float(np.max(self.distance_matrix)) / max(1.0, float(np.mean(self.demands)))
+        max_penalty = max(penalty, 1e-6) * MAX_PENALTY_FACTOR
+
+        self.cost_history.append(current_cost)
+        self.temp_history.append(0.0)
+
+        for iteration in range(1, self.max_iterations + 1):
+            if self.is_cancel_requested():
+                break
+
+            move = self.evaluate_moves(iteration, current_cost, penalty)
+            if move is None:
+                break
+            _, delta_cost, kind, args = move
+            self.apply_move(kind, args, iteration)
+            current_cost += delta_cost
+            excess = self.total_excess()
+
+            if excess == 0:
+                penalty = max(penalty / 1.1, 1e-6)
+                if current_cost < self.best_cost - 1e-9:
+                    self.best_solution = self.current_routes()
+                    self.best_cost = current_cost
+                if self.elite_pool is not None:
+                    self.elite_pool.consider(self.current_routes(), current_cost)
+            else:
+                penalty = min(penalty * 1.1, max_penalty)
+                # Without any feasible solution yet, keep the least overloaded one
+                if self.best_cost == float('inf') and (excess, current_cost) < (best_excess, fallback_cost):
+                    best_excess, fallback_cost = excess, current_cost
+                    self.best_solution = self.current_routes()
+
+            if iteration % 10 == 0:
+                self.cost_history.append(self.best_cost if self.best_cost < float('inf') else current_cost)
+                self.temp_history.append(0.0)
+                if callback:
+                    progress = min(100, int(iteration / self.max_iterations * 100))
+                    callback(iteration, 0, 0.0, self.cost_history[-1], progress)
+
+        # Exact cost of the reported solution (the running total only accumulates deltas)
+        self.best_cost = self.calculate_total_distance(self.best_solution)
+        self.cost_history.append(self.best_cost)
+        self.temp_history.append(0.0)
+
+        if callback:
+            callback(self.max_iterations, 0, 0.0, self.best_cost, 100)
+
+        return self.best_solution, self.best_cost, self.cost_history, self.temp_history
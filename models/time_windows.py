@@ -0,0 +1,184 @@
+"""
+Time window support for the CVRP solvers.
+
+A sequence of visits is summarised by a segment tuple
+(first, last, duration, time_warp, earliest, latest):
+- duration: minimum time to serve the sequence (travel + service + waiting)
+- time_warp: lateness that cannot be avoided (0 for a feasible sequence)
+- earliest / latest: window for starting service at the first node
+
+Two segments concatenate in O(1). Each route caches its forward (depot -> k)
+and backward (k -> depot) segments, which hold the forward time slack and
+earliest-arrival information, so relocate, swap and 2-opt moves are checked
+by concatenating a handful of cached segments instead of re-simulating
+the whole route.
+"""
+
+from models.distance_matrix import lookup_rows
+
+INFINITY = float('inf')
+
+
+class TimeWindowData:
+    def __init__(self, time_windows, duration_matrix, depot, service_times=None):
+        """
+        Parameters:
+        - time_windows: List of (earliest, latest) service start times per node
+          (None entries mean no window)
+        - duration_matrix: 2D array of travel times between nodes
+        - depot: Index of the depot node (its window is the planning horizon)
+        - service_times: Optional list of service durations per node
+        """
+        num_nodes = len(duration_matrix)
+        self.depot = depot
+        self.durations = lookup_rows(duration_matrix, 'time windows')
+        self.service_times = [float(s) for s in service_times] if service_times is not None else [0.0] * num_nodes
+
+        self.windows = []
+        for window in time_windows:
+            if window is None:
+                self.windows.append((0.0, INFINITY))
+            else:
+                earliest, latest = window
+                self.windows.append((
+                    0.0 if earliest is None else float(earliest),
+                    INFINITY if latest is None else float(latest)
+                ))
+
+        # Single-node segments; the depot never has service time
+        self.node_segments = [
+            (i, i, 0.0 if i == depot else self.service_times[i], 0.0, self.windows[i][0], self.windows[i][1])
+            for i in range(num_nodes)
+        ]
+        self.depot_segment = self.node_segments[depot]
+
+    def concat(self, a, b):
+        """Concatenate two segments in O(1)"""
+        a_first, a_last, a_duration, a_warp, a_earliest, a_latest = a
+        b_first, b_last, b_duration, b_warp, b_earliest, b_latest = b
+
+        travel = self.durations[a_last][b_first]
+        delta = a_duration - a_warp + travel
+        waiting = max(b_earliest - delta - a_latest, 0.0)
+        warp = max(a_earliest + delta - b_latest, 0.0)
+
+        return (
+            a_first,
+            b_last,
+            a_duration + b_duration + travel + waiting,
+            a_warp + b_warp + warp,
+            max(b_earliest - delta, a_earliest) - waiting,
+            min(b_latest - delta, a_latest) + warp
+        )
+
+    def concat_all(self, *segments):
+        """Concatenate several segments left to right"""
+        result = segments[0]
+        for segment in segments[1:]:
+            result = self.concat(result, segment)
+        return result
+
+    def route_segment(self, route):
+        """Segment for a full route depot -> route -> depot (O(len(route)))"""
+        segment = self.depot_segment
+        for customer in route:
+            segment = self.concat(segment, self.node_segments[customer])
+        return self.concat(segment, self.depot_segment)
+
+    def route_cache(self, route):
+        return RouteTimeCache(self, route)
+
+    def route_schedule(self, route):
+        """
+        Simulate a route leaving the depot as early as possible
+
+        Returns:
+        - List of service start times for each customer in the route
+        - Total lateness over all customers
+        """
+        start_times = []
+        lateness = 0.0
+        time = self.windows[self.depot][0]
+        previous = self.depot
+
+        for customer in route:
+            earliest, latest = self.windows[customer]
+            time = max(time + self.durations[previous][customer], earliest)
+            start_times.append(time)
+            lateness += max(time - latest, 0.0)
+            time += self.service_times[customer]
+            previous = customer
+
+        return start_times, lateness
+
+
+class RouteTimeCache:
+    """
+    Forward/backward segment arrays of one route.
+    prefix(k) covers depot + route[:k], suffix(k) covers route[k:] + depot.
+    Inner (and reversed inner) segments are built one row at a time on first use.
+    """
+
+    def __init__(self, data, route):
+        self.data = data
+        self.route = route
+
+        forward = [data.depot_segment]
+        for customer in route:
+            forward.append(data.concat(forward[-1], data.node_segments[customer]))
+
+        backward = [data.depot_segment]
+        for customer in reversed(route):
+            backward.append(data.concat(data.node_segments[customer], backward[-1]))
+        backward.reverse()
+
+        self.forward = forward
+        self.backward = backward
+        self.total = data.concat(forward[-1], data.depot_segment)
+        self.time_warp = self.total[3]
+
+        self._inner_rows = {}
+        self._reversed_rows = {}
+
+    def prefix(self, k):
+        return self.forward[k]
+
+    def suffix(self, k):
+        return self.backward[k]
+
+    def at(self, k):
+        return self.data.node_segments[self.route[k]]
+
+    def customer(self, node):
+        return self.data.node_segments[node]
+
+    def depot_segment(self):
+        return self.data.depot_segment
+
+    def join(self, *segments):
+        """Segment of the full route formed by the given segments"""
+        return self.data.concat_all(*segments)
+
+    def inner(self, a, b):
+        """Segment for route[a..b] (inclusive, a <= b)"""
+        row = self._inner_rows.get(a)
+        if row is None:
+            segment = self.at(a)
+            row = [segment]
+            for k in range(a + 1, len(self.route)):
+                segment = self.data.concat(segment, self.at(k))
+                row.append(segment)
+            self._inner_rows[a] = row
+        return row[b - a]
+
+    def reversed_inner(self, a, b):
+        """Segment for route[a..b] visited in reverse order (a <= b)"""
+        row = self._reversed_rows.get(a)
+        if row is None:
+            segment = self.at(a)
+            row = [segment]
+            for k in range(a + 1, len(self.route)):
+                segment = self.data.concat(self.at(k), segment)
+                row.append(segment)
+            self._reversed_rows[a] = row
+        return row[b - a]
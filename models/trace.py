@@ -0,0 +1,259 @@
+"""
+Move trace recorder for offline analysis of the SA search.
+
+With tracing enabled, every proposed move is written to a binary ring file
+as one fixed-size record: step, move type, the two nodes involved, cost
+delta, accepted flag and temperature. Records go into a preallocated NumPy
+structured array and are flushed to the file in blocks, so a record costs
+one array assignment. The file holds the last `capacity` records; older
+ones are overwritten.
+
+File layout: a 32-byte header (magic, capacity, records written, record
+size, all little-endian uint64 after the magic) followed by `capacity`
+records of TRACE_DTYPE.
+
+Analysis: `python -m models.trace run.trace [--bins 20] [--json]` reports
+the acceptance curve over the run, per-move-type statistics and wasted
+work (null moves, rejected proposals, the frozen tail of the schedule).
+"""
+
+import os
+import sys
+import json
+import struct
+import tempfile
+import argparse
+import numpy as np
+
+TRACE_DIR = os.getenv('CVRP_TRACE_DIR', os.path.join(tempfile.gettempdir(), 'cvrp_traces'))
+
+TRACE_MAGIC = b'CVRPTRC1'
+TRACE_HEADER = struct.Struct('<8sQQQ')
+
+# Packed record layout (22 bytes)
+TRACE_DTYPE = np.dtype([
+    ('step', '<u4'),
+    ('move', 'u1'),
+    ('accepted', 'u1'),
+    ('node_a', '<i4'),
+    ('node_b', '<i4'),
+    ('delta', '<f4'),
+    ('temperature', '<f4')
+])
+
+# Move type codes ('none' = no valid neighbour was found, the solution is unchanged)
+MOVE_TYPES = ('none', 'swap', 'relocate', 'relocate_new', '2opt', 'route_swap')
+MOVE_CODES = {name: code for code, name in enumerate(MOVE_TYPES)}
+
+# Acceptance rate (of moves that change the cost) below which the search counts as frozen
+FROZEN_ACCEPTANCE = 0.01
+
+# Deltas this small are summation noise of an unchanged cost (null moves)
+NULL_DELTA = 1e-6
+
+
+class TraceRecorder:
+    """Writes move records to a ring file in blocks"""
+
+    def __init__(self, path, capacity=1000000, block_size=4096):
+        """
+        Parameters:
+        - path: Trace file (created or overwritten)
+        - capacity: Records kept in the file (older ones are overwritten)
+        - block_size: Records buffered in memory between writes
+        """
+        self.path = path
+        self.capacity = max(1, int(capacity))
+        self.block = np.zeros(max(1, min(int(block_size), self.capacity)), dtype=TRACE_DTYPE)
+        self.count = 0
+        self.written = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'w+b')
+        self.file.truncate(TRACE_HEADER.size + self.capacity * TRACE_DTYPE.itemsize)
+        self._write_header()
+
+    def _write_header(self):
+        self.file.seek(0)
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, self.capacity, self.written, TRACE_DTYPE.itemsize))
+
+    def record(self, step, move, node_a, node_b, delta, accepted, temperature):
+        """Buffer one proposed move (move is a name from MOVE_TYPES)"""
+        self.block[self.count] = (step, MOVE_CODES.get(move, 0), accepted, node_a, node_b, delta, temperature)
+        self.count += 1
+        if self.count == len(self.block):
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records at the ring position, wrapping around at the end"""
+        records = self.block[:self.count]
+        while len(records):
+            position = self.written % self.capacity
+            chunk = records[:self.capacity - position]
+            self.file.seek(TRACE_HEADER.size + position * TRACE_DTYPE.itemsize)
+            self.file.write(chunk.tobytes())
+            self.written += len(chunk)
+            records = records[len(chunk):]
+        self.count = 0
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self._write_header()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_trace(path):
+    """
+    Read a trace file
+
+    Returns:
+    - Structured array of TRACE_DTYPE records in chronological order
+    - Number of records written in total (more than the array length if the ring wrapped)
+    """
+    with open(path, 'rb') as f:
+        magic, capacity, written, itemsize = TRACE_HEADER.unpack(f.read(TRACE_HEADER.size))
+        if magic != TRACE_MAGIC or itemsize != TRACE_DTYPE.itemsize:
+            raise ValueError(f"{path} is not a move trace file")
+        records = np.fromfile(f, dtype=TRACE_DTYPE, count=capacity)
+
+    if written <= capacity:
+        return records[:written], written
+    start = written % capacity
+    return np.concatenate([records[start:], records[:start]]), written
+
+
+def analyze_trace(records, bins=20):
+    """
+    Summarize a move trace
+
+    Parameters:
+    - records: Structured array from read_trace
+    - bins: Number of equal-length step ranges for the acceptance curve
+
+    Returns:
+    - Dictionary with totals, per-move statistics, the acceptance curve and wasted work
+    """
+    total = len(records)
+    if total == 0:
+        return {'proposals': 0, 'moves': {}, 'curve': [], 'wasted': {}}
+
+    accepted = records['accepted'].astype(bool)
+    delta = records['delta'].astype(np.float64)
+    null = np.abs(delta) < NULL_DELTA
+    improving = accepted & (delta < 0) & ~null
+
+    moves = {}
+    for code, name in enumerate(MOVE_TYPES):
+        mask = records['move'] == code
+        count = int(mask.sum())
+        if not count:
+            continue
+        changing = mask & ~null
+        moves[name] = {
+            'proposed': count,
+            'share': count / total,
+            'null': int((mask & null).sum()),
+            'accepted': int((mask & accepted & ~null).sum()),
+            'acceptance_rate': float(accepted[changing].mean()) if changing.any() else 0.0,
+            'improving': int((mask & improving).sum()),
+            'total_improvement': float(-delta[mask & improving].sum()) or 0.0
+        }
+
+    # Acceptance curve over the run, null moves excluded (they are always accepted)
+    curve = []
+    for chunk in np.array_split(np.arange(total), min(bins, total)):
+        changing = chunk[~null[chunk]]
+        curve.append({
+            'first_step': int(records['step'][chunk[0]]),
+            'last_step': int(records['step'][chunk[-1]]),
+            'temperature': float(records['temperature'][chunk].mean()),
+            'acceptance_rate': float(accepted[changing].mean()) if len(changing) else 0.0,
+            'improving_rate': float(improving[chunk].mean()),
+            'null_rate': float(null[chunk].mean())
+        })
+
+    # Frozen tail: the run's end where (almost) nothing is accepted any more
+    frozen_from = len(curve)
+    while frozen_from > 0 and curve[frozen_from - 1]['acceptance_rate'] < FROZEN_ACCEPTANCE:
+        frozen_from -= 1
+    frozen_steps = sum(c['last_step'] - c['first_step'] + 1 for c in curve[frozen_from:])
+
+    wasted = {
+        'null_moves': int(null.sum()),
+        'null_share': float(null.mean()),
+        'rejected': int((~accepted).sum()),
+        'rejected_share': float((~accepted).mean()),
+        'frozen_from_step': curve[frozen_from]['first_step'] if frozen_from < len(curve) else None,
+        'frozen_share': frozen_steps / max(1, int(records['step'][-1]) - int(records['step'][0]) + 1)
+    }
+
+    return {
+        'proposals': total,
+        'accepted': int((accepted & ~null).sum()),
+        'improving': int(improving.sum()),
+        'moves': moves,
+        'curve': curve,
+        'wasted': wasted
+    }
+
+
+def format_report(summary, written=None):
+    """Plain-text report of analyze_trace output"""
+    lines = []
+    header = f"{summary['proposals']} moves"
+    if written is not None and written > summary['proposals']:
+        header += f" (last {summary['proposals']} of {written})"
+    lines.append(header)
+    if not summary['proposals']:
+        return '\n'.join(lines)
+
+    lines.append(f"accepted {summary['accepted']}, improving {summary['improving']}")
+    lines.append('')
+    lines.append(f"{'move':<14}{'share':>8}{'null':>9}{'accept':>9}{'improve':>9}{'gain':>12}")
+    for name, stats in summary['moves'].items():
+        lines.append(f"{name:<14}{stats['share']:>8.1%}{stats['null']:>9}{stats['acceptance_rate']:>9.1%}"
+                     f"{stats['improving']:>9}{stats['total_improvement']:>12.1f}")
+
+    lines.append('')
+    lines.append(f"{'steps':<22}{'temp':>10}{'accept':>9}{'improve':>9}{'null':>8}")
+    for c in summary['curve']:
+        steps = f"{c['first_step']}-{c['last_step']}"
+        lines.append(f"{steps:<22}{c['temperature']:>10.3g}{c['acceptance_rate']:>9.1%}"
+                     f"{c['improving_rate']:>9.2%}{c['null_rate']:>8.1%}")
+
+    wasted = summary['wasted']
+    lines.append('')
+    lines.append(f"null moves: {wasted['null_moves']} ({wasted['null_share']:.1%})")
+    lines.append(f"rejected:   {wasted['rejected']} ({wasted['rejected_share']:.1%})")
+    if wasted['frozen_from_step'] is not None:
+        lines.append(f"frozen from step {wasted['frozen_from_step']} ({wasted['frozen_share']:.1%} of the run)")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze a CVRP move trace file')
+    parser.add_argument('path', help='Trace file written by the SA solver')
+    parser.add_argument('--bins', type=int, default=20, help='Number of step ranges in the acceptance curve')
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    args = parser.parse_args(argv)
+
+    records, written = read_trace(args.path)
+    summary = analyze_trace(records, bins=args.bins)
+    if args.json:
+        print(json.dumps({**summary, 'written': written}, indent=2))
+    else:
+        print(format_report(summary, written))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())